@@ -0,0 +1,229 @@
+"""
+Benchmarks for `WavDecoder.next()` and the decode, scale, format and write
+stages of wav2vec.
+
+Every combination of the given sample widths, file types, readers, channel
+counts, durations, block sizes, downtoss values and formats is a case. Each
+case runs in its own process (so that its peak RSS can be measured) on a
+synthetic file generated by `benchmarks.synth` (and cached in the data
+directory). The reader is either the default one (`wave` or `aifc`, as chosen
+by the command line tool) or `wav2vec.mmapreader`.
+
+* next: iterating over a WavDecoder, i.e. calling `WavDecoder.next()` for
+  every block (decoding, splitting and scaling into lists of Points)
+
+The stages of rendering the file to os.devnull with `Formatter.output()` are
+measured with a `wav2vec.stats.Stats` object:
+
+* decode: reading and unpacking the frames of every block
+* scale: splitting and scaling the blocks
+* format: formatting the points of every block
+* write: writing the formatted output
+
+The results (seconds per stage, frames/s and peak RSS for each case) are
+printed and saved as JSON, which can be compared with an earlier run:
+    $ python -m benchmarks.bench --output new.json --compare old.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from . import synth
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "data")
+
+
+def peak_rss_kb():
+    """
+    Return the peak resident set size of this process in KiB (or None if it
+    cannot be measured).
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def run_case(case):
+    """
+    Run one benchmark case (a dict with the keys of `case_keys`) in this
+    process and return its results.
+    """
+    from wav2vec import WavDecoder
+    from wav2vec.formatter import formatters
+    from wav2vec.main import get_decoder_class
+    from wav2vec.stats import Stats
+
+    path = synth.ensure(case["data_dir"], case["bits"], case["channels"],
+                        case["seconds"], case["type"])
+    decoder_class = get_decoder_class(path, case["reader"] == "mmap")
+
+    def decoder(**kwargs):
+        return WavDecoder(path, decoder_class=decoder_class, bs=case["bs"],
+                          downtoss=case["downtoss"], max_width=1000,
+                          max_height=500, **kwargs)
+
+    # the WavDecoder.next() hot path
+    start = time.perf_counter()
+    with decoder() as wd:
+        for paths in wd:
+            pass
+    next_time = time.perf_counter() - start
+
+    # the stages of rendering the file
+    stats = Stats()
+    formatter = formatters[case["format"]](decoder(columnar=True,
+                                                   stats=stats))
+    with open(os.devnull, "wb") as devnull:
+        formatter.output(devnull)
+    timers = stats.timers
+    stages = dict(decode=timers.get("read", 0.0) + timers.get("unpack", 0.0),
+                  scale=timers.get("scale", 0.0),
+                  format=timers.get("format", 0.0),
+                  write=timers.get("write", 0.0),
+                  next=next_time)
+    total = timers["total"]
+    nframes = stats.counters.get("frames_decoded", 0)
+    return dict(frames=nframes, points=stats.counters.get("points", 0),
+                seconds=stages, total_seconds=total,
+                frames_per_second=nframes / total if total else None,
+                peak_rss_kb=peak_rss_kb())
+
+
+case_keys = ("bits", "type", "reader", "channels", "seconds", "bs",
+             "downtoss", "format")
+
+
+def case_id(case):
+    return "%(type)s-%(reader)s-%(bits)dbit-%(channels)dch-%(seconds)gs-" \
+        "bs%(bs)d-dt%(downtoss)d-%(format)s" % case
+
+
+def run(cases, data_dir):
+    """
+    Run every case in a fresh process and yield (case, results) tuples.
+    """
+    for case in cases:
+        case = dict(case, data_dir=data_dir)
+        # generate the input first, so that it is not part of the measurement
+        synth.ensure(data_dir, case["bits"], case["channels"],
+                     case["seconds"], case["type"])
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench", "--run-case",
+             json.dumps(case)],
+            stdout=subprocess.PIPE, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        yield case, json.loads(proc.stdout.decode("utf-8"))
+
+
+def compare(results, baseline):
+    """
+    Print the speedup of every case in `results` over the same case in
+    `baseline` (both as saved by main()).
+    """
+    old = dict((r["id"], r) for r in baseline["results"])
+    print("\n%-58s %10s %10s %8s" % ("case", "old f/s", "new f/s", "speedup"))
+    for r in results:
+        if r["id"] not in old:
+            continue
+        before = old[r["id"]]["frames_per_second"]
+        after = r["frames_per_second"]
+        print("%-58s %10.0f %10.0f %7.2fx"
+              % (r["id"], before, after, after / before))
+
+
+def main():
+    aparser = argparse.ArgumentParser(description=("Benchmark "
+                                                   "WavDecoder.next() and the "
+                                                   "decode, scale, format and "
+                                                   "write stages of wav2vec."))
+    aparser.add_argument("--bits", type=int, nargs="+", default=[16],
+                         choices=(8, 16, 32))
+    aparser.add_argument("--types", nargs="+", default=["wav"],
+                         choices=("wav", "aiff"))
+    aparser.add_argument("--readers", nargs="+", default=["default", "mmap"],
+                         choices=("default", "mmap"),
+                         help=("The readers to decode with: the default "
+                               "wave/aifc modules and/or mmapreader."))
+    aparser.add_argument("--channels", type=int, nargs="+", default=[1, 2])
+    aparser.add_argument("--durations", type=float, nargs="+", default=[10],
+                         metavar="SECONDS",
+                         help="Durations of the input files (e.g. 1 60 3600)")
+    aparser.add_argument("--bs", type=int, nargs="+", default=[0, 4096])
+    aparser.add_argument("--downtoss", type=int, nargs="+", default=[1])
+    aparser.add_argument("--formats", nargs="+", default=["SVG", "CSV"])
+    aparser.add_argument("--all", action="store_true",
+                         help=("Run the full matrix: 8/16/32 bit, WAV and "
+                               "AIFF, 1 to 8 channels, 1s to 1h, several "
+                               "block sizes and downtoss values and every "
+                               "text format."))
+    aparser.add_argument("--data-dir", default=DEFAULT_DATA_DIR,
+                         help="Where the synthetic files are cached.")
+    aparser.add_argument("--output", "-o", metavar="FILE",
+                         help="Save the results as JSON to FILE.")
+    aparser.add_argument("--compare", metavar="FILE",
+                         help="Compare with the results saved in FILE.")
+    aparser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = aparser.parse_args()
+
+    if args.run_case:
+        json.dump(run_case(json.loads(args.run_case)), sys.stdout)
+        return
+
+    if args.all:
+        args.bits = [8, 16, 32]
+        args.types = ["wav", "aiff"]
+        args.readers = ["default", "mmap"]
+        args.channels = [1, 2, 8]
+        args.durations = [1, 60, 3600]
+        args.bs = [0, 1024, 65536]
+        args.downtoss = [1, 16]
+        args.formats = ["SVG", "SVGPath", "CSV", "PostScript",
+                        "PostScriptCompact"]
+    cases = [dict(zip(case_keys, values)) for values in itertools.product(
+        args.bits, args.types, args.readers, args.channels, args.durations, args.bs,
+        args.downtoss, args.formats)]
+
+    print("%-58s %8s %8s %8s %8s %8s %10s %9s"
+          % ("case", "next", "decode", "scale", "format", "write",
+             "frames/s", "RSS MiB"))
+    results = []
+    for case, result in run(cases, args.data_dir):
+        s = result["seconds"]
+        rss = result["peak_rss_kb"]
+        print("%-58s %8.3f %8.3f %8.3f %8.3f %8.3f %10.0f %9s"
+              % (case_id(case), s["next"], s["decode"], s["scale"],
+                 s["format"], s["write"], result["frames_per_second"],
+                 "%.1f" % (rss / 1024.0) if rss is not None else "-"))
+        sys.stdout.flush()
+        result.update(id=case_id(case), case=dict(
+            (key, case[key]) for key in case_keys))
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(dict(python=platform.python_version(),
+                           platform=platform.platform(),
+                           time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                           results=results), f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
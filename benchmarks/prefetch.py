@@ -0,0 +1,126 @@
+"""
+Benchmark of reading ahead (`WavDecoder(prefetch=N)`): renders a streamed
+synthetic file with several prefetch depths and prints the time of each
+compared to not prefetching.
+
+Reading from the page cache is so fast that there is little to overlap, so
+the input can be dropped from the page cache before every run (`--cold`,
+where `os.posix_fadvise` is available) and/or every read can be delayed by a
+fixed latency (`--latency`) to simulate a network filesystem:
+    $ python -m benchmarks.prefetch --latency 2 --depths 0 1 4
+"""
+
+import argparse
+import io
+import os
+import time
+
+from . import synth
+from .bench import DEFAULT_DATA_DIR
+
+
+class LatencyReader(object):
+    """
+    A decoder class for WavDecoder which opens files with `reader` (e.g.
+    `wav2vec.mmapreader`) and sleeps for `latency` seconds before every
+    `readframes()`.
+    """
+
+    def __init__(self, reader, latency):
+        self.reader = reader
+        self.latency = latency
+        self.__name__ = reader.__name__
+
+    def open(self, filename, mode="rb"):
+        return _LatencyFile(self.reader.open(filename, mode), self.latency)
+
+
+class _LatencyFile(object):
+    def __init__(self, wav_file, latency):
+        self._wav_file = wav_file
+        self._latency = latency
+
+    def __getattr__(self, name):
+        return getattr(self._wav_file, name)
+
+    def readframes(self, n):
+        time.sleep(self._latency)
+        return self._wav_file.readframes(n)
+
+
+def drop_cache(path):
+    """
+    Ask the kernel to drop the pages of `path` from the page cache (a no-op
+    where `os.posix_fadvise` is not available).
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    with io.open(path, "rb") as f:
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def render(path, depth, bs=4096, format="SVG", reader=None, latency=0.0,
+           cold=False):
+    """
+    Render `path` with `format` to os.devnull, reading `depth` blocks ahead,
+    and return the time taken in seconds.
+    """
+    from wav2vec import WavDecoder, mmapreader
+    from wav2vec.formatter import formatters
+
+    reader = reader or mmapreader
+    if latency > 0:
+        reader = LatencyReader(reader, latency)
+    if cold:
+        drop_cache(path)
+    wd = WavDecoder(path, decoder_class=reader, bs=bs, max_width=1000,
+                    max_height=500, columnar=True, prefetch=depth)
+    formatter = formatters[format](wd)
+    start = time.perf_counter()
+    with open(os.devnull, "wb") as devnull:
+        formatter.output(devnull)
+    return time.perf_counter() - start
+
+
+def main():
+    import wave
+    from wav2vec import mmapreader
+
+    aparser = argparse.ArgumentParser(description=("Benchmark reading ahead "
+                                                   "in a background thread."))
+    aparser.add_argument("--depths", type=int, nargs="+", default=[0, 1, 4, 16],
+                         metavar="N", help="Prefetch depths to compare.")
+    aparser.add_argument("--bits", type=int, default=16, choices=(8, 16, 32))
+    aparser.add_argument("--channels", type=int, default=2)
+    aparser.add_argument("--duration", type=float, default=60,
+                         metavar="SECONDS")
+    aparser.add_argument("--bs", type=int, default=4096)
+    aparser.add_argument("--format", default="SVG")
+    aparser.add_argument("--reader", choices=("mmap", "wave"), default="mmap")
+    aparser.add_argument("--latency", type=float, default=0.0, metavar="MS",
+                         help="Delay every read by MS milliseconds.")
+    aparser.add_argument("--cold", action="store_true",
+                         help="Drop the input from the page cache before "
+                              "every run.")
+    aparser.add_argument("--repeat", type=int, default=3,
+                         help="Report the fastest of this many runs.")
+    aparser.add_argument("--data-dir", default=DEFAULT_DATA_DIR,
+                         help="Where the synthetic files are cached.")
+    args = aparser.parse_args()
+
+    path = synth.ensure(args.data_dir, args.bits, args.channels,
+                        args.duration, "wav")
+    reader = mmapreader if args.reader == "mmap" else wave
+    print("%8s %10s %8s" % ("prefetch", "seconds", "speedup"))
+    baseline = None
+    for depth in args.depths:
+        seconds = min(render(path, depth, args.bs, args.format, reader,
+                             args.latency / 1000.0, args.cold)
+                      for i in range(args.repeat))
+        if baseline is None:
+            baseline = seconds
+        print("%8d %10.3f %7.2fx" % (depth, seconds, baseline / seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark of the time it takes to import the command line tool, which is paid
+on every call of `wav2vec` (batch jobs call it thousands of times).
+
+Runs `python -X importtime -c "import wav2vec.main"` a few times, prints the
+slowest imports of the fastest run and exits with status 1 if the import
+takes longer than a budget, or if it imports a module which should only be
+imported when it is needed:
+    $ python -m benchmarks.startup --budget 250
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# modules which `import wav2vec.main` must not import: aifc (only needed for
+# AIFF files), sndhdr (replaced by a magic number check) and the modules of
+# optional features (loaded when their options are used)
+LAZY_MODULES = ("aifc", "sndhdr", "wav2vec.cache", "wav2vec.compressed",
+                "wav2vec.PeakIndex", "wav2vec.Simplifier",
+                "wav2vec.streamreader")
+
+DEFAULT_BUDGET_MS = 250
+
+
+def import_times(module="wav2vec.main"):
+    """
+    Import `module` in a fresh interpreter and return a dict of the
+    cumulative import time (in microseconds) of every module it imported.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import %s" % module],
+        stderr=subprocess.PIPE, check=True, cwd=root)
+    times = {}
+    for line in proc.stderr.decode("utf-8").splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            cumulative = int(fields[1])
+        except ValueError:
+            # the header line
+            continue
+        times[fields[2].strip()] = cumulative
+    return times
+
+
+def main():
+    aparser = argparse.ArgumentParser(description=("Benchmark the import "
+                                                   "time of the command line "
+                                                   "tool."))
+    aparser.add_argument("--budget", type=float, default=DEFAULT_BUDGET_MS,
+                         metavar="MS",
+                         help="Fail if the import takes longer (default %d)."
+                              % DEFAULT_BUDGET_MS)
+    aparser.add_argument("--repeat", type=int, default=5,
+                         help="Report the fastest of this many runs.")
+    aparser.add_argument("--top", type=int, default=10,
+                         help="How many of the slowest imports to list.")
+    args = aparser.parse_args()
+
+    times = min((import_times() for i in range(args.repeat)),
+                key=lambda t: t["wav2vec.main"])
+    slowest = sorted(times.items(), key=lambda item: -item[1])[:args.top]
+    for name, us in slowest:
+        print("%10.1f ms  %s" % (us / 1000.0, name))
+    total = times["wav2vec.main"] / 1000.0
+    print("import wav2vec.main: %.1f ms (budget %.0f ms)"
+          % (total, args.budget))
+    failed = False
+    for name in LAZY_MODULES:
+        if name in times:
+            print("%s should not be imported at startup" % name)
+            failed = True
+    if total > args.budget:
+        print("over budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
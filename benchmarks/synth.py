@@ -0,0 +1,148 @@
+"""
+Generate synthetic WAV and AIFF files for the benchmarks.
+
+The audio is a mix of a few sine waves and noise (deterministic for a given
+seed), at 8, 16 or 32 bits per sample and any number of channels. One second
+of audio is computed and then repeated, so that even hours-long files are
+generated quickly.
+    $ python -m benchmarks.synth out.wav --bits 16 --channels 2 --seconds 60
+"""
+
+import argparse
+import math
+import os
+import random
+import struct
+import sys
+import wave
+from array import array
+
+# array typecodes for each sample width (in bytes)
+_typecodes = {1: "b", 2: "h", 4: "i" if array("i").itemsize == 4 else "l"}
+
+
+def synth_second(bits, channels, framerate, seed=0):
+    """
+    Return one second of interleaved samples as an array of signed integers
+    in the range of `bits` per sample.
+    """
+    rng = random.Random(seed)
+    peak = 2 ** (bits - 1) - 1
+    samples = array(_typecodes[bits // 8])
+    freqs = [rng.uniform(50, 2000) for chan in range(channels)]
+    for i in range(framerate):
+        t = float(i) / framerate
+        for chan in range(channels):
+            value = (0.5 * math.sin(2 * math.pi * freqs[chan] * t) +
+                     0.2 * math.sin(2 * math.pi * 3.1 * freqs[chan] * t) +
+                     0.2 * rng.uniform(-1, 1))
+            samples.append(int(value * peak))
+    return samples
+
+
+def _frame_bytes(samples, bits, filetype):
+    """
+    Return the bytes of `samples` in the byte order and signedness of
+    `filetype` ('wav' or 'aiff').
+    """
+    if filetype == "wav" and bits == 8:
+        # 8 bit WAV samples are unsigned
+        return array("B", [s + 128 for s in samples]).tobytes()
+    samples = array(samples.typecode, samples)
+    big = filetype == "aiff"
+    if (sys.byteorder == "big") != big:
+        samples.byteswap()
+    return samples.tobytes()
+
+
+def _extended(value):
+    """
+    Encode `value` as an 80-bit IEEE 754 extended float (for AIFF).
+    """
+    if value == 0:
+        return b"\0" * 10
+    mantissa, exponent = math.frexp(value)
+    exponent += 16382
+    mantissa = int(mantissa * 2 ** 64)
+    return struct.pack(">HQ", exponent, mantissa)
+
+
+def write(filename, bits=16, channels=2, seconds=1.0, framerate=44100,
+          seed=0):
+    """
+    Write a synthetic WAV or AIFF file (depending on the extension of
+    `filename`) and return its name.
+    """
+    filetype = "aiff" if filename.lower().endswith((".aif", ".aiff")) \
+        else "wav"
+    second = _frame_bytes(synth_second(bits, channels, framerate, seed),
+                          bits, filetype)
+    nframes = int(seconds * framerate)
+    frame_size = channels * bits // 8
+    data_size = nframes * frame_size
+    with open(filename, "wb") as f:
+        if filetype == "wav":
+            w = wave.open(f, "wb")
+            w.setnchannels(channels)
+            w.setsampwidth(bits // 8)
+            w.setframerate(framerate)
+            w.setnframes(nframes)
+            _write_repeated(w.writeframesraw, second, data_size)
+            w.close()
+        else:
+            pad = data_size % 2
+            f.write(b"FORM" + struct.pack(">L", 4 + 26 + 16 + data_size + pad))
+            f.write(b"AIFF")
+            f.write(b"COMM" + struct.pack(">LhLh", 18, channels, nframes,
+                                          bits) + _extended(framerate))
+            f.write(b"SSND" + struct.pack(">LLL", 8 + data_size, 0, 0))
+            _write_repeated(f.write, second, data_size)
+            f.write(b"\0" * pad)
+    return filename
+
+
+def _write_repeated(write, data, size):
+    while size > 0:
+        chunk = data[:size]
+        write(chunk)
+        size -= len(chunk)
+
+
+def name(bits, channels, seconds, filetype):
+    """
+    Return the file name used for a synthetic file with these parameters.
+    """
+    return "synth-%dbit-%dch-%gs.%s" % (bits, channels, seconds, filetype)
+
+
+def ensure(directory, bits, channels, seconds, filetype):
+    """
+    Return the path of a synthetic file in `directory`, generating it if it
+    does not exist yet.
+    """
+    path = os.path.join(directory, name(bits, channels, seconds, filetype))
+    if not os.path.exists(path):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = path + ".tmp." + filetype
+        write(tmp, bits, channels, seconds)
+        os.rename(tmp, path)
+    return path
+
+
+def main():
+    aparser = argparse.ArgumentParser(description=("Generate a synthetic WAV "
+                                                   "or AIFF file."))
+    aparser.add_argument("filename", help="The file to write (.wav or .aiff)")
+    aparser.add_argument("--bits", type=int, default=16, choices=(8, 16, 32))
+    aparser.add_argument("--channels", type=int, default=2)
+    aparser.add_argument("--seconds", type=float, default=1.0)
+    aparser.add_argument("--framerate", type=int, default=44100)
+    aparser.add_argument("--seed", type=int, default=0)
+    args = aparser.parse_args()
+    write(args.filename, args.bits, args.channels, args.seconds,
+          args.framerate, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -65,16 +65,15 @@ setup(
     # simple. Or you can use find_packages().
     packages=find_packages(exclude=['contrib', 'docs', 'tests']),
 
-    install_requires=['standard-aifc', 'standard-chunk', 'standard-sndhdr'],
+    install_requires=['standard-aifc', 'standard-chunk'],
 
     # List additional groups of dependencies here (e.g. development
     # dependencies). You can install these using the following syntax,
     # for example:
     # $ pip install -e .[dev,test]
-    #extras_require={
-    #    'dev': ['check-manifest'],
-    #    'test': ['coverage'],
-    #},
+    extras_require={
+        'numpy': ['numpy'],
+    },
 
     # To provide executable scripts, use entry points in preference to the
     # "scripts" keyword. Entry points provide cross-platform support and allow
@@ -82,6 +81,7 @@ setup(
     entry_points={
         'console_scripts': [
             'wav2vec=wav2vec.main:main',
+            'wav2vec-server=wav2vec.server:main',
         ],
     },
 )
@@ -171,6 +171,27 @@ test_cases = [
         "flags": "--downtoss 3 -f PostScript",
         "outfile": "noise-16-down3.ps",
     },
+    # memory-mapped reader
+    {
+        "infile": "noise-8.wav",
+        "flags": "--mmap",
+        "outfile": "noise-8.svg",
+    },
+    {
+        "infile": "noise-8.aiff",
+        "flags": "--mmap",
+        "outfile": "noise-8.svg",
+    },
+    {
+        "infile": "noise-32.aiff",
+        "flags": "--mmap -f CSV",
+        "outfile": "noise-32-aiff.csv",
+    },
+    {
+        "infile": "test-16-stereo.aiff",
+        "flags": "--mmap --stream 1000 -f PostScript",
+        "outfile": "test-16-stereo-stream-aiff.ps",
+    },
 ]
 
 
@@ -0,0 +1,103 @@
+import asyncio
+import unittest
+from io import BytesIO
+from wav2vec import WavDecoder
+from wav2vec.aio import AsyncWavDecoder
+from wav2vec.formatter import formatters
+
+infile = 'tests/valfiles/snd/test-16-stereo.wav'
+
+
+class SlowWriter(object):
+    """
+    A StreamWriter stand-in which records the writes and yields to the loop
+    on every drain.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.drains = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    async def drain(self):
+        self.drains += 1
+        await asyncio.sleep(0)
+
+
+def render(name, **kwargs):
+    out = BytesIO()
+    formatters[name](WavDecoder(infile, **kwargs)).output(out)
+    return out.getvalue()
+
+
+class TestAsyncWavDecoder(unittest.TestCase):
+    def test_blocks_match(self):
+        async def decode():
+            async with AsyncWavDecoder(infile, bs=1000) as wd:
+                self.assertEqual(wd.params.nchannels, 2)
+                return [block async for block in wd]
+
+        with WavDecoder(infile, bs=1000) as wd:
+            expected = list(wd)
+        self.assertEqual(asyncio.run(decode()), expected)
+
+
+class TestOutputAsync(unittest.TestCase):
+    def test_matches_output(self):
+        for name in ('SVG', 'CSV', 'SVGPath', 'NPY'):
+            for bs in (0, 1000):
+                with self.subTest(format=name, bs=bs):
+                    writer = SlowWriter()
+                    formatter = formatters[name](WavDecoder(infile, bs=bs))
+                    asyncio.run(formatter.output_async(writer, bufsize=4096))
+                    self.assertEqual(b''.join(writer.chunks),
+                                     render(name, bs=bs))
+                    if bs:
+                        self.assertGreater(writer.drains, 10)
+
+    def test_renders_interleave(self):
+        order = []
+
+        class Writer(SlowWriter):
+            def __init__(self, name):
+                super(Writer, self).__init__()
+                self.name = name
+
+            def write(self, data):
+                order.append(self.name)
+                super(Writer, self).write(data)
+
+        async def both():
+            await asyncio.gather(*[
+                formatters['CSV'](WavDecoder(infile, bs=500)).output_async(
+                    Writer(name), bufsize=1) for name in 'ab'])
+
+        asyncio.run(both())
+        # the renders take turns instead of running one after the other
+        self.assertLess(order.index('b'), len(order) // 4)
+
+    def test_stream_writer(self):
+        received = []
+
+        async def serve_and_fetch():
+            async def handle(reader, writer):
+                await formatters['SVG'](WavDecoder(infile, bs=1000)) \
+                    .output_async(writer)
+                writer.close()
+
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                reader, writer = await asyncio.open_connection('127.0.0.1',
+                                                               port)
+                received.append(await reader.read())
+                writer.close()
+
+        asyncio.run(serve_and_fetch())
+        self.assertEqual(received[0], render('SVG', bs=1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
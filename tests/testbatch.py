@@ -0,0 +1,56 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+cmd = 'wav2vec.py'
+indir = 'tests/valfiles/snd'
+outdir = 'tests/valfiles/out'
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_batch(self, *inputs):
+        cmd_line = ["python3", cmd, "-o", self.tmpdir, "-j", "2"]
+        proc = subprocess.run(cmd_line + list(inputs),
+                              stderr=subprocess.PIPE)
+        return proc.returncode, proc.stderr.decode('utf-8')
+
+    def test_outputs_match_single_file_mode(self):
+        status, log = self.run_batch(indir + '/noise-*.wav',
+                                     indir + '/test-16-stereo.aiff')
+        self.assertEqual(status, 0)
+        self.assertIn('[4/4]', log)
+        for infile, outfile in [('noise-8', 'noise-8'),
+                                ('noise-16', 'noise-16'),
+                                ('noise-32', 'noise-32'),
+                                ('test-16-stereo', 'test-16-stereo-aiff')]:
+            with open('%s/%s.svg' % (outdir, outfile)) as f:
+                expected = f.read()
+            with open('%s/%s.svg' % (self.tmpdir, infile)) as f:
+                self.assertEqual(f.read(), expected)
+
+    def test_failures_do_not_abort(self):
+        status, log = self.run_batch(indir + '/noise-8.wav',
+                                     indir + '/does-not-exist.wav')
+        self.assertEqual(status, 1)
+        self.assertIn('does-not-exist.wav FAILED', log)
+        self.assertTrue(os.path.exists(self.tmpdir + '/noise-8.svg'))
+
+    def test_unmatched_pattern_warns(self):
+        status, log = self.run_batch(indir + '/noise-8.wav',
+                                     indir + '/nothing-*.wav')
+        self.assertEqual(status, 0)
+        self.assertIn('nothing-*.wav matched no input files', log)
+        self.assertTrue(os.path.exists(self.tmpdir + '/noise-8.svg'))
+
+    def test_no_inputs_is_an_error(self):
+        status, log = self.run_batch(indir + '/nothing-*.wav')
+        self.assertNotEqual(status, 0)
+        self.assertIn('no input files', log)
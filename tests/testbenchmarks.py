@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+from benchmarks import bench, startup, synth
+from wav2vec import WavDecoder, mmapreader
+
+
+class TestSynth(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_wav_and_aiff_decode_the_same(self):
+        for bits in (8, 16, 32):
+            with self.subTest(bits=bits):
+                data = []
+                for filetype in ('wav', 'aiff'):
+                    path = synth.ensure(self.dir, bits, 3, 0.5, filetype)
+                    with WavDecoder(path, decoder_class=mmapreader) as wd:
+                        self.assertEqual(wd.params.nchannels, 3)
+                        self.assertEqual(wd.params.sampwidth, bits // 8)
+                        self.assertEqual(wd.params.nframes, 22050)
+                        data.append(next(wd))
+                self.assertEqual(data[0], data[1])
+
+    def test_run_case(self):
+        for reader in ('default', 'mmap'):
+            with self.subTest(reader=reader):
+                case = dict(bits=16, type='wav', reader=reader, channels=2,
+                            seconds=0.5, bs=1024, downtoss=1, format='SVG',
+                            data_dir=self.dir)
+                result = bench.run_case(case)
+                self.assertEqual(result['frames'], 22050)
+                self.assertEqual(result['points'], 2 * 22050)
+                self.assertEqual(set(result['seconds']),
+                                 set(['next', 'decode', 'scale', 'format',
+                                      'write']))
+                self.assertGreater(result['seconds']['next'], 0)
+                self.assertGreater(result['frames_per_second'], 0)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.dir, synth.name(16, 2, 0.5, 'wav'))))
+
+
+class TestStartup(unittest.TestCase):
+    def test_lazy_imports(self):
+        times = startup.import_times()
+        self.assertIn('wav2vec.main', times)
+        for name in startup.LAZY_MODULES:
+            self.assertNotIn(name, times)
+
+    def test_option_values_match_lazy_modules(self):
+        from wav2vec import main
+        from wav2vec.Simplifier import methods
+        from wav2vec.cache import DEFAULT_DISK_SIZE
+        from wav2vec.compressed import extensions
+        self.assertEqual(main.compress_methods, tuple(sorted(extensions)))
+        self.assertEqual(main.simplify_methods, tuple(sorted(methods)))
+        self.assertEqual(main.DEFAULT_CACHE_SIZE, DEFAULT_DISK_SIZE)
+
+
+if __name__ == '__main__':
+    unittest.main()
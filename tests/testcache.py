@@ -0,0 +1,148 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from wav2vec import WavDecoder
+from wav2vec.cache import DiskCache, MemoryCache, RenderCache, render_key
+from wav2vec.formatter import formatters
+from wav2vec.Simplifier import Simplifier
+from wav2vec.WavDecoder import np
+
+infile = 'tests/valfiles/snd/test-16-stereo.wav'
+
+
+def fill_cache(directory, worker):
+    cache = DiskCache(directory, max_size=20000)
+    for i in range(30):
+        key = '%02x%d' % (worker, i)
+        cache.put(key, bytes([worker]) * 1000)
+        data = cache.get(key)
+        if data is not None and data != bytes([worker]) * 1000:
+            return False
+    return True
+
+
+class TestRenderCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.wav = os.path.join(self.tmpdir, 'test.wav')
+        shutil.copy(infile, self.wav)
+        self.cachedir = os.path.join(self.tmpdir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def formatter(self, name='SVG', path=None, **kwargs):
+        kwargs.setdefault('max_width', 200)
+        return formatters[name](WavDecoder(path or self.wav, **kwargs))
+
+    def test_hit_matches_output(self):
+        expected = BytesIO()
+        self.formatter().output(expected)
+        cache = RenderCache(self.cachedir)
+        for hit in (False, True):
+            out = BytesIO()
+            self.assertEqual(cache.output(self.formatter(), out), hit)
+            self.assertEqual(out.getvalue(), expected.getvalue())
+        # a new cache (e.g. in another process) finds the entry on disk
+        cache = RenderCache(self.cachedir, memory_size=0)
+        out = BytesIO()
+        self.assertTrue(cache.output(self.formatter(), out))
+        self.assertEqual(out.getvalue(), expected.getvalue())
+
+    def test_key_covers_options(self):
+        base = render_key(self.formatter())
+        self.assertEqual(render_key(self.formatter()), base)
+        keys = [render_key(self.formatter(max_width=300)),
+                render_key(self.formatter(downtoss=2)),
+                render_key(self.formatter(start=10)),
+                render_key(self.formatter('CSV')),
+                render_key(self.formatter('SVGPath')),
+                render_key(formatters['SVGPath'](WavDecoder(self.wav),
+                                                 precision=3)),
+                render_key(self.formatter(), compress='gzip'),
+                render_key(formatters['SVG'](
+                    Simplifier(WavDecoder(self.wav, max_width=200), 0.5))),
+                render_key(self.formatter(bs=1000)),
+                render_key(self.formatter(bs=1000), spool=4096)]
+        self.assertEqual(len(set(keys + [base])), len(keys) + 1)
+        # the spool size does not change the output
+        self.assertEqual(render_key(self.formatter(bs=1000), spool=4096),
+                         render_key(self.formatter(bs=1000), spool=100))
+        if np is not None:
+            self.assertNotEqual(render_key(self.formatter(use_numpy=False)),
+                                render_key(self.formatter(use_numpy=True)))
+
+    def test_spooled_and_unspooled_entries(self):
+        outputs = []
+        for spool in (None, 4096):
+            expected = BytesIO()
+            self.formatter(bs=1000).output(expected, spool=spool)
+            # a separate run sharing the cache directory
+            cache = RenderCache(self.cachedir, memory_size=0)
+            out = BytesIO()
+            self.assertFalse(cache.output(self.formatter(bs=1000), out,
+                                          spool=spool))
+            self.assertEqual(out.getvalue(), expected.getvalue())
+            outputs.append(expected.getvalue())
+        self.assertNotEqual(outputs[0], outputs[1])
+
+    def test_key_changes_with_source(self):
+        before = render_key(self.formatter())
+        stat = os.stat(self.wav)
+        os.utime(self.wav, (stat.st_atime, stat.st_mtime + 10))
+        self.assertNotEqual(render_key(self.formatter()), before)
+
+    def test_content_hash(self):
+        copy = os.path.join(self.tmpdir, 'copy.wav')
+        shutil.copy(self.wav, copy)
+        self.assertEqual(render_key(self.formatter(), hash_content=True),
+                         render_key(self.formatter(path=copy),
+                                    hash_content=True))
+        self.assertNotEqual(render_key(self.formatter()),
+                            render_key(self.formatter(path=copy)))
+
+    def test_memory_lru(self):
+        cache = MemoryCache(max_size=3000)
+        for key in 'abc':
+            cache.put(key, b'x' * 1000)
+        cache.get('a')
+        cache.put('d', b'x' * 1000)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertEqual(cache.size, 3000)
+
+    def test_disk_lru_and_ttl(self):
+        cache = DiskCache(self.cachedir, max_size=3000)
+        for i, key in enumerate(('aa1', 'bb2', 'cc3')):
+            cache.put(key, b'x' * 1000)
+            path = cache._path(key)
+            os.utime(path, (time.time() - 100 + i, time.time()))
+        cache.get('aa1')
+        cache.put('dd4', b'x' * 1000)
+        self.assertIsNone(cache.get('bb2'))
+        self.assertIsNotNone(cache.get('aa1'))
+        cache.ttl = 60
+        path = cache._path('cc3')
+        os.utime(path, (time.time(), time.time() - 120))
+        self.assertIsNone(cache.get('cc3'))
+        cache.evict()
+        self.assertFalse(os.path.exists(path))
+
+    def test_concurrent_processes(self):
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(fill_cache, [self.cachedir] * 4,
+                                        range(4)))
+        self.assertEqual(results, [True] * 4)
+        cache = DiskCache(self.cachedir, max_size=20000)
+        total = 0
+        for path, st in cache._entries():
+            total += st.st_size
+        self.assertLessEqual(total, 20000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import bz2
+import gzip
+import lzma
+import unittest
+from io import BytesIO
+from wav2vec import WavDecoder
+from wav2vec.compressed import CompressedWriter, output_extension
+from wav2vec.formatter import CSVFormatter, SVGFormatter
+
+infile = 'tests/valfiles/snd/test-16-stereo.wav'
+
+decompress = {
+    'gzip': gzip.decompress,
+    'bz2': bz2.decompress,
+    'xz': lzma.decompress,
+}
+
+
+class FailingFile(BytesIO):
+    def write(self, data):
+        raise IOError("disk full")
+
+
+class TestCompressedOutput(unittest.TestCase):
+    def test_round_trip(self):
+        expected = str(SVGFormatter(WavDecoder(infile, bs=1000)))
+        for method in sorted(decompress):
+            with self.subTest(method=method):
+                out = BytesIO()
+                SVGFormatter(WavDecoder(infile, bs=1000)).output(
+                    out, compress=method)
+                self.assertEqual(
+                    decompress[method](out.getvalue()).decode('utf-8'),
+                    expected)
+                self.assertLess(len(out.getvalue()), len(expected) / 2)
+
+    def test_level(self):
+        sizes = []
+        for level in (1, 9):
+            out = BytesIO()
+            CSVFormatter(WavDecoder(infile)).output(out, compress='gzip',
+                                                    compresslevel=level)
+            sizes.append(len(out.getvalue()))
+        self.assertGreater(sizes[0], sizes[1])
+
+    def test_unthreaded(self):
+        out = BytesIO()
+        with CompressedWriter(out, 'gzip', threaded=False) as writer:
+            writer.write(b'abc' * 1000)
+        self.assertEqual(gzip.decompress(out.getvalue()), b'abc' * 1000)
+
+    def test_errors_are_raised(self):
+        writer = CompressedWriter(FailingFile(), 'gzip', level=0)
+        with self.assertRaises(IOError):
+            for i in range(100):
+                writer.write(b'x' * 65536)
+        self.assertRaises(IOError, writer.close)
+        self.assertTrue(writer.closed)
+
+    def test_output_extension(self):
+        self.assertEqual(output_extension('svg', 'gzip'), 'svgz')
+        self.assertEqual(output_extension('csv', 'gzip'), 'csv.gz')
+        self.assertEqual(output_extension('ps', 'zstd'), 'ps.zst')
+        self.assertEqual(output_extension('svg', None), 'svg')
+
+    def test_unknown_method(self):
+        self.assertRaises(ValueError, CompressedWriter, BytesIO(), 'zip')
+
+
+if __name__ == '__main__':
+    unittest.main()
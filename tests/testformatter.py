@@ -1,5 +1,431 @@
-from wav2vec.formatter import Formatter
+from wav2vec.formatter import (Formatter, PSCompactFormatter, PSFormatter,
+                               SVGFormatter, SVGPathFormatter)
+from wav2vec.formatter.Formatter import ChannelSpools, OutputBuffer
+from wav2vec import WavDecoder
+from wav2vec.WavDecoder import Point, np
+from io import BytesIO, StringIO
 import unittest
 
 # TODO: maybe write some unit tests for Formatter. For now the validation tests
 # should do.
+
+infile = 'tests/valfiles/snd/test-16-stereo.wav'
+
+
+def render(formatter, **kwargs):
+    """
+    Return the output of `formatter` as bytes (which works for both text and
+    binary formatters).
+    """
+    out = BytesIO()
+    formatter.output(out, **kwargs)
+    return out.getvalue()
+
+
+class CountingStringIO(StringIO):
+    writes = 0
+
+    def write(self, s):
+        self.writes += 1
+        return super(CountingStringIO, self).write(s)
+
+
+class TestRegistry(unittest.TestCase):
+    def test_register_custom_formatter(self):
+        import io
+        import sys
+        from unittest import mock
+        from wav2vec.formatter import CSVFormatter, formatters
+        from wav2vec.main import main
+
+        class TabFormatter(CSVFormatter):
+            def points_to_str(self, sample, chan):
+                return "%f\t%f\n" % sample
+
+            def block_to_str(self, xs, ys, chan):
+                return "".join(self.points_to_str(p, chan)
+                               for p in zip(xs, ys))
+
+        formatters['Tab'] = TabFormatter
+        self.addCleanup(formatters.pop, 'Tab')
+        expected = render(TabFormatter(WavDecoder(
+            infile, max_width=1000, max_height=500, columnar=True)))
+        stdout = io.TextIOWrapper(BytesIO())
+        with mock.patch.object(sys, 'argv', ['wav2vec', infile, '-f', 'Tab']):
+            with mock.patch.object(sys, 'stdout', stdout):
+                main()
+        self.assertEqual(stdout.buffer.getvalue(), expected)
+        self.assertIn(b'\t', expected)
+
+
+class TestBufferedOutput(unittest.TestCase):
+    def test_binary_output_matches_text(self):
+        expected = str(SVGFormatter(WavDecoder(infile, bs=1000)))
+        out = BytesIO()
+        SVGFormatter(WavDecoder(infile, bs=1000)).output(out)
+        self.assertEqual(out.getvalue().decode('utf-8'), expected)
+
+    def test_writes_are_batched(self):
+        out = CountingStringIO()
+        SVGFormatter(WavDecoder(infile, bs=1000)).output(out, bufsize=2**24)
+        self.assertEqual(out.writes, 1)
+        out = CountingStringIO()
+        SVGFormatter(WavDecoder(infile, bs=1000)).output(out, bufsize=4096)
+        self.assertLess(out.writes, 2 * len(out.getvalue()) / 4096)
+        self.assertEqual(out.getvalue(),
+                         str(SVGFormatter(WavDecoder(infile, bs=1000))))
+
+    def test_buffer_flushes_remainder(self):
+        out = BytesIO()
+        buf = OutputBuffer(out, bufsize=10)
+        buf.write('abc')
+        self.assertEqual(out.getvalue(), b'')
+        buf.write('defghijk')
+        self.assertEqual(out.getvalue(), b'abcdefghijk')
+        buf.write('l')
+        buf.flush()
+        self.assertEqual(out.getvalue(), b'abcdefghijkl')
+
+
+class TestBlockToStr(unittest.TestCase):
+    def test_block_formatting_matches_per_point(self):
+        from wav2vec.formatter import formatters
+        for name, formatter_class in formatters.items():
+            if name == 'Float32':
+                # it writes a chunk for each call
+                continue
+            with self.subTest(format=name):
+                wd = WavDecoder(infile, bs=1000, downtoss=2)
+                expected = render(formatter_class(wd))
+                wd = WavDecoder(infile, bs=1000, downtoss=2, columnar=True)
+                self.assertEqual(render(formatter_class(wd)), expected)
+
+    def test_default_falls_back_to_points_to_str(self):
+        class PointsOnly(SVGFormatter):
+            block_to_str = Formatter.block_to_str
+        wd = WavDecoder(infile, columnar=True)
+        expected = str(SVGFormatter(wd))
+        self.assertEqual(str(PointsOnly(wd)), expected)
+
+
+class TestSpool(unittest.TestCase):
+    def test_spooled_stream_matches_unstreamed(self):
+        from wav2vec.formatter import formatters
+        for name, formatter_class in formatters.items():
+            if name == 'Float32':
+                # its chunks follow the blocks, even when spooled
+                continue
+            with self.subTest(format=name):
+                expected = render(formatter_class(WavDecoder(infile)))
+                actual = render(formatter_class(WavDecoder(infile, bs=1000)),
+                                spool=4096)
+                self.assertEqual(actual, expected)
+
+    def test_single_point_tail_block(self):
+        from wav2vec.Simplifier import Simplifier
+        # 33265 frames: the last block of 1008 frames holds a single frame
+        wd = Simplifier(WavDecoder(infile, bs=1008), 1.0)
+        self.assertTrue(render(SVGFormatter(wd), spool=4096).rstrip()
+                        .endswith(b'</svg>'))
+
+        # a tail block which only repeats the last spooled points adds nothing
+        first = [[Point(1.0, 2.0), Point(2.0, 3.0)],
+                 [Point(1.0, 5.0), Point(2.0, 6.0)]]
+        tail = [[Point(2.0, 3.0)], [Point(2.0, 6.0)]]
+        outputs = []
+        with WavDecoder(infile) as wd:
+            formatter = SVGFormatter(wd)
+            out = OutputBuffer(StringIO())
+            for blocks in ([first, tail], [first]):
+                spools = ChannelSpools()
+                for block in blocks:
+                    formatter._write_block(block, out, spools)
+                spooled = StringIO()
+                spools.write_to(formatter, spooled)
+                outputs.append(spooled.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_spills_to_disk(self):
+        spools = ChannelSpools(max_size=10)
+        spools.add([(1, 2, 'a' * 8), (3, 4, 'b' * 8)])
+        spools.add([(5, 6, 'c' * 8), (7, 8, 'd' * 8)])
+        self.assertTrue(all(spool._rolled for spool in spools._spools))
+        out = StringIO()
+        spools.write_to(SVGFormatter(WavDecoder(infile)), out)
+        self.assertIn('a' * 8 + 'c' * 8, out.getvalue())
+        self.assertIn('b' * 8 + 'd' * 8, out.getvalue())
+
+
+class TestNPYOptions(unittest.TestCase):
+    def run_cli(self, *flags, **kwargs):
+        import subprocess
+        import sys
+        proc = subprocess.run(
+            [sys.executable, 'wav2vec.py', kwargs.get('infile', infile),
+             '-f', 'NPY'] + list(flags),
+            input=kwargs.get('input'),
+            stdout=kwargs.get('stdout', subprocess.PIPE),
+            stderr=subprocess.PIPE)
+        return proc.returncode, proc.stdout, proc.stderr.decode('utf-8')
+
+    def test_rejected_before_output(self):
+        # a pipe is not seekable
+        for flags in (['--simplify', '1'], ['--peaks'],
+                      ['--peaks', '--stream', '1000'],
+                      ['--peaks', '--compress', 'gzip'],
+                      ['--peak-index']):
+            with self.subTest(flags=flags):
+                status, out, err = self.run_cli(*flags)
+                self.assertEqual(status, 2)
+                self.assertEqual(out, b'')
+                self.assertIn(flags[0], err)
+
+    def test_estimated_stdin_length_rejected(self):
+        with open(infile, 'rb') as f:
+            data = f.read()
+        status, out, err = self.run_cli('--length', '1', infile='-',
+                                        input=data)
+        self.assertEqual(status, 2)
+        self.assertEqual(out, b'')
+        self.assertIn('--length', err)
+
+    def test_seekable_file(self):
+        import tempfile
+        with tempfile.TemporaryFile() as f:
+            status, out, err = self.run_cli('--peaks', stdout=f)
+            self.assertEqual(status, 0, err)
+            f.seek(0)
+            shape, values = read_npy(f.read())
+            self.assertEqual(shape[0], 2)
+            # simplification is rejected even then
+            status, out, err = self.run_cli('--simplify', '1', stdout=f)
+            self.assertEqual(status, 2)
+
+
+def parse_path(d):
+    """
+    Return the absolute points of SVG path data with M, l, h and v commands.
+    """
+    import re
+    points = []
+    x = y = 0.0
+    cmd = None
+    tokens = re.findall(r'[Mlhv]|-?(?:\d+\.?\d*|\.\d+)', d)
+    i = 0
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            cmd = tokens[i]
+            i += 1
+        if cmd == 'M':
+            x, y = float(tokens[i]), float(tokens[i + 1])
+            i += 2
+        elif cmd == 'l':
+            x, y = x + float(tokens[i]), y + float(tokens[i + 1])
+            i += 2
+        elif cmd == 'h':
+            x += float(tokens[i])
+            i += 1
+        else:
+            y += float(tokens[i])
+            i += 1
+        points.append((x, y))
+    return points
+
+
+class TestSVGPath(unittest.TestCase):
+    def decoder(self, bs=0):
+        return WavDecoder(infile, bs=bs, max_width=1000, max_height=500,
+                          columnar=True)
+
+    def test_points_round_trip(self):
+        import re
+        with self.decoder() as wd:
+            original = next(wd)
+        for precision in (0, 2):
+            with self.subTest(precision=precision):
+                svg = str(SVGPathFormatter(self.decoder(), precision))
+                paths = re.findall(r'd="([^"]*)"', svg)
+                self.assertEqual(len(paths), 2)
+                for chan, d in enumerate(paths):
+                    points = parse_path(d)
+                    # consecutive duplicate points are dropped
+                    expected = []
+                    for p in original[chan]:
+                        q = (round(p.x, precision), round(-p.y, precision))
+                        if not expected or expected[-1] != q:
+                            expected.append(q)
+                    self.assertEqual(len(points), len(expected))
+                    for (x, y), (ex, ey) in zip(points, expected):
+                        self.assertAlmostEqual(x, ex, delta=1e-6)
+                        self.assertAlmostEqual(y, ey, delta=1e-6)
+
+    def test_streamed_output_matches(self):
+        expected = str(SVGPathFormatter(self.decoder()))
+        out = StringIO()
+        SVGPathFormatter(self.decoder(bs=1000)).output(out, spool=4096)
+        self.assertEqual(out.getvalue(), expected)
+
+    def test_compact_number_format(self):
+        from wav2vec.formatter.formatters import _fixed
+        self.assertEqual(_fixed(0, 2), '0')
+        self.assertEqual(_fixed(50, 2), '.5')
+        self.assertEqual(_fixed(-5, 2), '-.05')
+        self.assertEqual(_fixed(-1230, 2), '-12.3')
+        self.assertEqual(_fixed(7, 0), '7')
+
+    def test_smaller_than_svg(self):
+        svg = str(SVGFormatter(self.decoder()))
+        path = str(SVGPathFormatter(self.decoder()))
+        self.assertLess(3 * len(path), len(svg))
+
+
+def ps_lines(ps):
+    """
+    Return the (x, y) points drawn by the moveto and lineto commands of
+    PSFormatter output, or by the procedure of PSCompactFormatter output
+    (ignoring the translation of the page origin).
+    """
+    points = []
+    dy = None
+    drawing = False
+    for line in ps.splitlines():
+        tokens = line.split()
+        if drawing:
+            if tokens == ['E']:
+                drawing = False
+            else:
+                points.append((float(tokens[0]), float(tokens[1]) + dy))
+        elif tokens[-1:] == ['translate']:
+            dy = 0.0 if dy is None else dy + float(tokens[1])
+        elif tokens[-1:] in (['moveto'], ['lineto'], ['D']):
+            points.append((float(tokens[0]), float(tokens[1]) + dy))
+            drawing = tokens[-1] == 'D'
+    return points
+
+
+class TestPSCompact(unittest.TestCase):
+    def decoder(self, bs=0):
+        return WavDecoder(infile, bs=bs, max_width=1000, max_height=500,
+                          columnar=True)
+
+    def test_draws_same_points(self):
+        for bs in (0, 1000):
+            with self.subTest(bs=bs):
+                ps = str(PSFormatter(self.decoder(bs)))
+                compact = str(PSCompactFormatter(self.decoder(bs), 3))
+                expected = ps_lines(ps)
+                points = ps_lines(compact)
+                self.assertEqual(len(points), len(expected))
+                for (x, y), (ex, ey) in zip(points, expected):
+                    self.assertAlmostEqual(x, ex, delta=0.00051)
+                    self.assertAlmostEqual(y, ey, delta=0.00051)
+                compact = str(PSCompactFormatter(self.decoder(bs)))
+                self.assertLess(2 * len(compact), len(ps))
+
+    def test_block_matches_points(self):
+        wd = WavDecoder(infile, bs=1000, max_width=1000, max_height=500)
+        expected = str(PSCompactFormatter(wd))
+        self.assertEqual(str(PSCompactFormatter(self.decoder(1000))), expected)
+
+
+class NonSeekableBytesIO(BytesIO):
+    def seekable(self):
+        return False
+
+
+def read_npy(data):
+    """
+    Return the shape and the float32 values of an .npy file (without NumPy).
+    """
+    import ast
+    import struct
+    from array import array
+    assert data[:8] == b'\x93NUMPY\x01\x00'
+    (header_len,) = struct.unpack('<H', data[8:10])
+    header = ast.literal_eval(data[10:10 + header_len].decode('latin1'))
+    assert header['descr'] == '<f4' and not header['fortran_order']
+    values = array('f')
+    values.frombytes(data[10 + header_len:])
+    return header['shape'], values
+
+
+class TestBinaryFormatters(unittest.TestCase):
+    def points(self, **kwargs):
+        with WavDecoder(infile, max_width=1000, max_height=500,
+                        **kwargs) as wd:
+            blocks = list(wd)
+        return [[p for block in blocks for p in block[chan]]
+                for chan in range(len(blocks[0]))]
+
+    def render(self, formatter_class, out=None, **kwargs):
+        wd = WavDecoder(infile, max_width=1000, max_height=500,
+                        columnar=True, **kwargs)
+        out = BytesIO() if out is None else out
+        formatter_class(wd).output(out)
+        return out.getvalue()
+
+    def test_npy(self):
+        from wav2vec.formatter import NPYFormatter
+        for kwargs in ({}, {'bs': 1000, 'downtoss': 3}, {'peaks': True}):
+            with self.subTest(**kwargs):
+                shape, values = read_npy(self.render(NPYFormatter, **kwargs))
+                expected = self.points(**kwargs)
+                self.assertEqual(shape, (2, len(expected[0]), 2))
+                n = len(expected[0])
+                for chan, points in enumerate(expected):
+                    for i in (0, n // 2, n - 1):
+                        x, y = values[2 * (chan * n + i):2 * (chan * n + i) + 2]
+                        self.assertAlmostEqual(x, points[i].x, places=3)
+                        self.assertAlmostEqual(y, points[i].y, places=3)
+
+    def test_npy_header_needs_seekable_output(self):
+        from wav2vec.formatter import NPYFormatter
+        # the number of points is known in advance without peaks
+        data = self.render(NPYFormatter, NonSeekableBytesIO(), bs=1000)
+        self.assertEqual(data, self.render(NPYFormatter))
+        with self.assertRaises(IOError):
+            self.render(NPYFormatter, NonSeekableBytesIO(), peaks=True)
+
+    def test_npy_range(self):
+        from wav2vec.formatter import NPYFormatter
+        kwargs = dict(start=4321, end=8321)
+        expected = self.points(**kwargs)
+        self.assertEqual(len(expected[0]), 4000)
+        for bs in (0, 1000):
+            for workers in (None, 2):
+                with self.subTest(bs=bs, workers=workers):
+                    # the header is right from the start, so the output does
+                    # not need to be seekable
+                    out = NonSeekableBytesIO()
+                    wd = WavDecoder(infile, max_width=1000, max_height=500,
+                                    columnar=True, bs=bs, **kwargs)
+                    NPYFormatter(wd).output(out, workers=workers)
+                    shape, values = read_npy(out.getvalue())
+                    self.assertEqual(shape, (2, 4000, 2))
+                    self.assertEqual(len(values), 2 * 4000 * 2)
+                    self.assertAlmostEqual(values[-1], expected[1][-1].y,
+                                           places=3)
+
+    @unittest.skipUnless(np is not None, "requires numpy")
+    def test_npy_loads_with_numpy(self):
+        from wav2vec.formatter import NPYFormatter
+        points = np.load(BytesIO(self.render(NPYFormatter, peaks=True)))
+        expected = self.points(peaks=True)
+        self.assertEqual(points.shape, (2, len(expected[0]), 2))
+        self.assertAlmostEqual(points[1, -1, 1], expected[1][-1].y, places=3)
+
+    def test_float32_round_trip(self):
+        from wav2vec.formatter import Float32Formatter
+        from wav2vec.formatter.formatters import load_float32
+        for kwargs in ({}, {'bs': 1000}, {'bs': 1000, 'peaks': True}):
+            with self.subTest(**kwargs):
+                data = self.render(Float32Formatter, NonSeekableBytesIO(),
+                                   **kwargs)
+                header, channels = load_float32(BytesIO(data))
+                self.assertEqual(header['nchannels'], 2)
+                for (xs, ys), points in zip(channels, self.points(**kwargs)):
+                    self.assertEqual(len(xs), len(points))
+                    self.assertEqual(len(ys), len(points))
+                    for i in (0, len(points) // 2, len(points) - 1):
+                        self.assertAlmostEqual(xs[i], points[i].x, places=3)
+                        self.assertAlmostEqual(ys[i], points[i].y, places=3)
@@ -0,0 +1,57 @@
+import unittest
+import wave
+import aifc
+import io
+from wav2vec import mmapreader
+
+indir = 'tests/valfiles/snd'
+
+
+class TestMmapReader(unittest.TestCase):
+    def compare(self, filename, stdlib):
+        with stdlib.open(filename, 'rb') as expected:
+            with mmapreader.open(filename) as actual:
+                self.assertEqual(tuple(actual.getparams())[:4],
+                                 tuple(expected.getparams())[:4])
+                nframes = expected.getnframes()
+                while actual.tell() < nframes:
+                    block = actual.readframes(333)
+                    self.assertIsInstance(block, memoryview)
+                    self.assertEqual(bytes(block), expected.readframes(333))
+
+    def test_wav(self):
+        for name in ('noise-8', 'noise-16', 'noise-32', 'test-16-stereo'):
+            with self.subTest(name=name):
+                self.compare('%s/%s.wav' % (indir, name), wave)
+
+    def test_aiff(self):
+        for name in ('noise-8', 'noise-16', 'noise-32', 'test-16-stereo'):
+            with self.subTest(name=name):
+                self.compare('%s/%s.aiff' % (indir, name), aifc)
+
+    def test_filetype_and_endianness(self):
+        with mmapreader.open('%s/noise-16.wav' % indir) as wf:
+            self.assertEqual(wf.getfiletype(), 'wav')
+            self.assertEqual(wf.getendchar(), '<')
+        with mmapreader.open('%s/noise-16.aiff' % indir) as wf:
+            self.assertEqual(wf.getfiletype(), 'aiff')
+            self.assertEqual(wf.getendchar(), '>')
+
+    def test_setpos(self):
+        with mmapreader.open('%s/test-16-stereo.wav' % indir) as wf:
+            first = bytes(wf.readframes(10))
+            wf.setpos(5)
+            self.assertEqual(bytes(wf.readframes(5)), first[5*4:])
+            with self.assertRaises(mmapreader.Error):
+                wf.setpos(wf.getnframes() + 1)
+
+    def test_file_object_without_fileno(self):
+        with open('%s/noise-16.wav' % indir, 'rb') as f:
+            data = f.read()
+        with mmapreader.open(io.BytesIO(data)) as wf:
+            with wave.open('%s/noise-16.wav' % indir) as expected:
+                self.assertEqual(wf.getnframes(), expected.getnframes())
+
+    def test_not_a_sound_file(self):
+        with self.assertRaises(mmapreader.Error):
+            mmapreader.open(io.BytesIO(b'not a sound file, just bytes'))
@@ -0,0 +1,68 @@
+import unittest
+from io import BytesIO, StringIO
+from wav2vec import WavDecoder
+from wav2vec.formatter import formatters
+
+from .testformatter import read_npy
+
+infile = 'tests/valfiles/snd/test-16-stereo.wav'
+
+
+class TestParallelOutput(unittest.TestCase):
+    def test_matches_serial_output(self):
+        for name, formatter_class in formatters.items():
+            if formatter_class.relative:
+                continue
+            for bs in (0, 1000):
+                for downtoss in (1, 3):
+                    with self.subTest(format=name, bs=bs, downtoss=downtoss):
+                        wd = WavDecoder(infile, bs=bs, downtoss=downtoss,
+                                        max_width=500)
+                        expected = BytesIO()
+                        formatter_class(wd).output(expected)
+                        wd = WavDecoder(infile, bs=bs, downtoss=downtoss,
+                                        max_width=500)
+                        actual = BytesIO()
+                        formatter_class(wd).output(actual, workers=3)
+                        self.assertEqual(actual.getvalue(),
+                                         expected.getvalue())
+
+    def test_range_matches_serial_output(self):
+        for bs in (0, 1000):
+            with self.subTest(bs=bs):
+                kwargs = dict(bs=bs, downtoss=3, max_width=300, start=4321,
+                              end=20000)
+                expected = BytesIO()
+                formatters['SVG'](WavDecoder(infile, **kwargs)).output(
+                    expected)
+                actual = BytesIO()
+                formatters['SVG'](WavDecoder(infile, **kwargs)).output(
+                    actual, workers=3)
+                self.assertEqual(actual.getvalue(), expected.getvalue())
+
+    def test_npy_header_counts_worker_points(self):
+        # the header written up front is sized for the whole file, so it must
+        # be patched from the number of points the workers formatted
+        for bs in (0, 1000):
+            with self.subTest(bs=bs):
+                kwargs = dict(bs=bs, max_width=300, start=4321, end=8321)
+                expected = BytesIO()
+                formatters['NPY'](WavDecoder(infile, **kwargs)).output(
+                    expected)
+                actual = BytesIO()
+                formatters['NPY'](WavDecoder(infile, **kwargs)).output(
+                    actual, workers=3)
+                self.assertEqual(actual.getvalue(), expected.getvalue())
+                shape, values = read_npy(actual.getvalue())
+                self.assertEqual(shape, (2, 4000, 2))
+                self.assertEqual(len(values), 2 * 4000 * 2)
+
+    def test_peaks_not_supported(self):
+        wd = WavDecoder(infile, peaks=True)
+        with self.assertRaises(ValueError):
+            formatters['SVG'](wd).output(StringIO(), workers=2)
+
+    def test_relative_formatters_not_supported(self):
+        wd = WavDecoder(infile)
+        with self.assertRaises(ValueError):
+            formatters['SVGPath'](wd).output(StringIO(), workers=2)
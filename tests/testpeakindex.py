@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+from wav2vec import WavDecoder
+from wav2vec.PeakIndex import PeakIndex, PeakDecoder
+
+infile = 'tests/valfiles/snd/test-16-stereo.wav'
+
+
+def envelope(decoder):
+    with decoder:
+        blocks = list(decoder)
+    return [sum((list(b[chan]) for b in blocks), [])
+            for chan in range(len(blocks[0]))]
+
+
+class TestPeakIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.wav = os.path.join(self.tmpdir, 'test.wav')
+        shutil.copy(infile, self.wav)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_save_and_load(self):
+        index = PeakIndex.build(WavDecoder(self.wav), base_bucket=16,
+                                rms=True)
+        index.save(self.wav + '.peaks')
+        loaded = PeakIndex.load(self.wav + '.peaks')
+        self.assertEqual(len(loaded.levels), len(index.levels))
+        for level_num, level in enumerate(index.levels):
+            self.assertEqual(loaded.read_level(level_num), level)
+        self.assertEqual(loaded.columns(100), index.columns(100))
+
+    def test_top_level_is_global_extrema(self):
+        index = PeakIndex.build(WavDecoder(self.wav, max_height=0),
+                                base_bucket=16)
+        full = envelope(WavDecoder(self.wav, max_height=0, signed=True))
+        top = index.levels[-1]
+        self.assertEqual(top.nbuckets, 1)
+        offset = 2**15
+        for chan, points in enumerate(full):
+            ys = [p.y for p in points]
+            self.assertEqual(top.mins[chan][0] * 0.5 * (2**16 - 1) / offset,
+                             min(ys))
+            self.assertEqual(top.maxs[chan][0] * 0.5 * (2**16 - 1) / offset,
+                             max(ys))
+
+    def test_decoder_builds_and_reuses_sidecar(self):
+        pd = PeakDecoder(WavDecoder(self.wav, max_width=50), base_bucket=16)
+        first = envelope(pd)
+        self.assertTrue(os.path.exists(self.wav + '.peaks'))
+        mtime = os.stat(self.wav + '.peaks').st_mtime_ns
+        pd = PeakDecoder(WavDecoder(self.wav, max_width=50), base_bucket=16)
+        self.assertEqual(envelope(pd), first)
+        self.assertEqual(os.stat(self.wav + '.peaks').st_mtime_ns, mtime)
+        for chan in first:
+            self.assertLessEqual(len(chan), 100)
+            self.assertEqual(chan[-1].x, 50)
+
+    def test_stale_sidecar_is_rebuilt(self):
+        PeakIndex.build(WavDecoder(self.wav), base_bucket=16).save(
+            self.wav + '.peaks')
+        st = os.stat(self.wav)
+        os.utime(self.wav, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        wd = WavDecoder(self.wav, max_width=50)
+        wd.open()
+        self.assertFalse(PeakIndex.load(self.wav + '.peaks').is_valid_for(wd))
+        wd.close()
+        envelope(PeakDecoder(WavDecoder(self.wav, max_width=50),
+                             base_bucket=16))
+        wd.open()
+        self.assertTrue(PeakIndex.load(self.wav + '.peaks').is_valid_for(wd))
+        wd.close()
+
+    def test_falls_back_when_too_wide(self):
+        expected = envelope(WavDecoder(self.wav, max_width=10000, peaks=True))
+        pd = PeakDecoder(WavDecoder(self.wav, max_width=10000),
+                         base_bucket=256)
+        self.assertEqual(envelope(pd), expected)
+
+    def test_falls_back_for_range(self):
+        expected = envelope(WavDecoder(self.wav, max_width=50, peaks=True,
+                                       start=1000, end=9000))
+        pd = PeakDecoder(WavDecoder(self.wav, max_width=50, start=1000,
+                                    end=9000))
+        self.assertEqual(envelope(pd), expected)
+        self.assertFalse(os.path.exists(self.wav + '.peaks'))
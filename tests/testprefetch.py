@@ -0,0 +1,99 @@
+import threading
+import unittest
+from io import BytesIO
+from wav2vec import WavDecoder, mmapreader
+from wav2vec.WavDecoder import np
+from wav2vec.PeakIndex import PeakIndex
+from wav2vec.formatter import SVGFormatter
+from wav2vec.prefetch import Prefetcher
+
+infile = 'tests/valfiles/snd/test-16-stereo.wav'
+
+
+class _FailingReader(object):
+    """
+    A reader whose third read fails.
+    """
+
+    def __init__(self):
+        self.reads = 0
+
+    def setpos(self, pos):
+        pass
+
+    def readframes(self, n):
+        self.reads += 1
+        if self.reads == 3:
+            raise IOError("read failed")
+        return memoryview(b"\0" * n)
+
+
+class TestPrefetch(unittest.TestCase):
+    def output(self, **kwargs):
+        out = BytesIO()
+        SVGFormatter(WavDecoder(infile, **kwargs)).output(out)
+        return out.getvalue()
+
+    def test_same_output(self):
+        for decoder_class in (WavDecoder(infile).decoder, mmapreader):
+            for numpy in (False, True) if np is not None else (False,):
+                for peaks in (False, True):
+                    kwargs = dict(decoder_class=decoder_class, bs=1000,
+                                  use_numpy=numpy, peaks=peaks, max_width=300)
+                    with self.subTest(decoder=decoder_class.__name__,
+                                      numpy=numpy, peaks=peaks):
+                        self.assertEqual(self.output(prefetch=3, **kwargs),
+                                         self.output(**kwargs))
+
+    def test_range(self):
+        kwargs = dict(bs=700, start=1000, end=9000, columnar=True)
+        self.assertEqual(self.output(prefetch=2, **kwargs),
+                         self.output(**kwargs))
+
+    def test_close_stops_thread(self):
+        wd = WavDecoder(infile, decoder_class=mmapreader, bs=100, prefetch=2)
+        with wd:
+            next(wd)
+            thread = wd._prefetcher._thread
+            self.assertTrue(thread.is_alive())
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(wd._prefetcher)
+
+    def test_restarts_after_rewind(self):
+        wd = WavDecoder(infile, bs=1000, prefetch=2, columnar=True)
+        with wd:
+            first = next(wd)
+            next(wd)
+            wd._seek_range(0, wd.params.nframes)
+            self.assertEqual(list(next(wd)[0].ys), list(first[0].ys))
+
+    def test_peak_index(self):
+        index = PeakIndex.build(WavDecoder(infile, bs=100, prefetch=4), 64)
+        self.assertEqual(index.levels, PeakIndex.build(WavDecoder(infile),
+                                                       64).levels)
+
+    def test_errors_are_raised(self):
+        pf = Prefetcher(_FailingReader(), 0, 10, 2, 1)
+        try:
+            self.assertEqual(pf.get()[1], 2)
+            self.assertEqual(pf.get()[1], 2)
+            self.assertRaises(IOError, pf.get)
+        finally:
+            pf.close()
+
+    def test_recycles_buffers(self):
+        pf = Prefetcher(_FailingReader(), 0, 4, 2, 1)
+        try:
+            first = pf.get()[0]
+            self.assertIsInstance(first, bytearray)
+            self.assertNotEqual(threading.active_count(), 1)
+        finally:
+            pf.close()
+        self.assertIn(first, pf._free)
+
+    def test_negative_depth(self):
+        self.assertRaises(ValueError, WavDecoder, infile, prefetch=-1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from http.client import HTTPConnection
+from io import BytesIO
+from wav2vec import WavDecoder
+from wav2vec.formatter import formatters
+from wav2vec.server import RenderServer, parse_options
+
+infile = 'tests/valfiles/snd/test-16-stereo.wav'
+
+
+def render(name='SVG', **kwargs):
+    out = BytesIO()
+    kwargs.setdefault('max_width', 1000)
+    kwargs.setdefault('max_height', 500)
+    formatters[name](WavDecoder(infile, **kwargs)).output(out)
+    return out.getvalue()
+
+
+class TestRenderServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp()
+        shutil.copy(infile, os.path.join(cls.root, 'test.wav'))
+        cls.server = RenderServer(port=0, root=cls.root, workers=1,
+                                  max_queue=0, bufsize=4096, timeout=5)
+        ready = threading.Event()
+        cls.thread = threading.Thread(target=cls.server.run, args=(ready,))
+        cls.thread.start()
+        ready.wait(5)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.thread.join(5)
+        shutil.rmtree(cls.root)
+
+    def request(self, method, url, body=None):
+        conn = HTTPConnection('127.0.0.1', self.server.port, timeout=10)
+        conn.request(method, url, body)
+        response = conn.getresponse()
+        data = response.read()
+        conn.close()
+        return response, data
+
+    def test_health(self):
+        response, data = self.request('GET', '/health')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(json.loads(data.decode('utf-8')), {'status': 'ok'})
+
+    def test_render_path(self):
+        response, data = self.request('GET', '/render?path=test.wav&bs=1000')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('Transfer-Encoding'), 'chunked')
+        self.assertEqual(response.getheader('Content-Type'), 'image/svg+xml')
+        self.assertEqual(data, render(bs=1000))
+
+    def test_render_upload(self):
+        with open(infile, 'rb') as f:
+            body = f.read()
+        response, data = self.request(
+            'POST', '/render?format=CSV&width=100&start=0.1&end=0.2', body)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(data, render('CSV', max_width=100, start=0.1,
+                                      end=0.2, unit='seconds'))
+
+    def test_errors(self):
+        for url, status in (('/render?path=../etc/passwd', 403),
+                            ('/render?path=missing.wav', 404),
+                            ('/render?path=test.wav&format=GIF', 400),
+                            ('/render?path=test.wav&color=red', 400),
+                            ('/nothing', 404)):
+            with self.subTest(url=url):
+                self.assertEqual(self.request('GET', url)[0].status, status)
+        response, data = self.request('POST', '/render', b'not a wav file')
+        self.assertEqual(response.status, 400)
+
+    def test_rejects_when_full(self):
+        # a stalled upload holds the only slot
+        sock = socket.create_connection(('127.0.0.1', self.server.port))
+        try:
+            sock.sendall(b'POST /render HTTP/1.1\r\n'
+                         b'Content-Length: 1000\r\n\r\n')
+            for i in range(100):
+                if self.server.pending:
+                    break
+                time.sleep(0.01)
+            response, data = self.request('GET', '/render?path=test.wav')
+            self.assertEqual(response.status, 503)
+            response, data = self.request('GET', '/metrics')
+            self.assertIn(b'wav2vec_requests_rejected_total 1', data)
+        finally:
+            sock.close()
+
+    def test_client_disconnect_frees_worker(self):
+        sock = socket.create_connection(('127.0.0.1', self.server.port))
+        sock.sendall(b'GET /render?path=test.wav&width=0&bs=100 HTTP/1.1'
+                     b'\r\n\r\n')
+        self.assertTrue(sock.recv(1024).startswith(b'HTTP/1.1 200'))
+        sock.close()
+        for i in range(500):
+            if not self.server.pending:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.server.pending, 0)
+        self.assertEqual(self.request('GET', '/health')[0].status, 200)
+
+    def test_parse_options(self):
+        name, decoder_kwargs, formatter_kwargs = parse_options(
+            'format=SVGPath&width=10&peaks=1&start=100&frames=yes'
+            '&precision=3')
+        self.assertEqual(name, 'SVGPath')
+        self.assertEqual(decoder_kwargs['max_width'], 10)
+        self.assertTrue(decoder_kwargs['peaks'])
+        self.assertEqual((decoder_kwargs['start'], decoder_kwargs['unit']),
+                         (100.0, 'frames'))
+        self.assertEqual(formatter_kwargs, {'precision': 3})
+        self.assertRaises(ValueError, parse_options, 'downtoss=0')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import io
+from wav2vec import WavDecoder
+from wav2vec.formatter import CSVFormatter
+from wav2vec.Simplifier import Simplifier, rdp, visvalingam
+from wav2vec.WavDecoder import np
+import unittest
+
+infile = 'tests/valfiles/snd/test-16-stereo.wav'
+
+
+def distance_to_path(x, y, xs, ys):
+    """
+    Distance from (x, y) to the polyline through xs, ys.
+    """
+    best = float('inf')
+    for i in range(len(xs) - 1):
+        x0, y0, x1, y1 = xs[i], ys[i], xs[i + 1], ys[i + 1]
+        dx, dy = x1 - x0, y1 - y0
+        length = dx * dx + dy * dy
+        t = 0.0 if not length else ((x - x0) * dx + (y - y0) * dy) / length
+        t = max(0.0, min(1.0, t))
+        px, py = x0 + t * dx, y0 + t * dy
+        best = min(best, ((x - px) ** 2 + (y - py) ** 2) ** 0.5)
+    return best
+
+
+class TestAlgorithms(unittest.TestCase):
+    def test_collinear_points_are_dropped(self):
+        xs = [0, 1, 2, 3, 4]
+        ys = [0, 1, 2, 3, 4]
+        self.assertEqual(rdp(xs, ys, 0.1), [0, 4])
+        self.assertEqual(visvalingam(xs, ys, 0.1), [0, 4])
+
+    def test_peaks_are_kept(self):
+        xs = [0, 1, 2, 3, 4]
+        ys = [0, 0, 5, 0, 0]
+        self.assertEqual(rdp(xs, ys, 0.5), [0, 1, 2, 3, 4])
+        self.assertEqual(visvalingam(xs, ys, 0.5), [0, 1, 2, 3, 4])
+        self.assertEqual(rdp(xs, ys, 10), [0, 4])
+
+    def test_short_paths(self):
+        self.assertEqual(rdp([], [], 1), [])
+        self.assertEqual(rdp([0, 1], [0, 1], 1), [0, 1])
+        self.assertEqual(visvalingam([0], [0], 1), [0])
+
+    @unittest.skipUnless(np is not None, "requires numpy")
+    def test_numpy_matches_python(self):
+        xs = [float(i) for i in range(200)]
+        ys = [float((i * 37) % 23) for i in range(200)]
+        self.assertEqual(rdp(np.array(xs), np.array(ys), 2), rdp(xs, ys, 2))
+
+
+class TestSimplifier(unittest.TestCase):
+    def simplified(self, bs, method='rdp', tolerance=1.0, columnar=True):
+        wd = WavDecoder(infile, bs=bs, max_width=1000, max_height=500,
+                        columnar=columnar)
+        s = Simplifier(wd, tolerance, method)
+        with s:
+            blocks = list(s)
+        chans = []
+        for chan in range(len(blocks[0])):
+            # after the first block, multi-channel blocks start with the last
+            # point of the previous one
+            chans.append(list(blocks[0][chan]) +
+                         [p for block in blocks[1:] for p in block[chan][1:]])
+        return s, chans
+
+    def test_streamed_paths_stay_within_tolerance(self):
+        with WavDecoder(infile, max_width=1000, max_height=500) as wd:
+            original = next(wd)
+        for method in ('rdp', 'vw'):
+            with self.subTest(method=method):
+                s, chans = self.simplified(1000, method)
+                self.assertGreater(s.ratio, 2)
+                self.assertEqual(s.points_in, sum(len(c) for c in original))
+                self.assertEqual(s.points_out, sum(len(c) for c in chans))
+                if method != 'rdp':
+                    continue
+                for chan, points in enumerate(chans):
+                    xs = [p.x for p in points]
+                    ys = [p.y for p in points]
+                    self.assertEqual(points[0], original[chan][0])
+                    self.assertEqual(points[-1], original[chan][-1])
+                    for p in original[chan][::50]:
+                        self.assertLessEqual(
+                            distance_to_path(p.x, p.y, xs, ys), 1.0 + 1e-9)
+
+    def test_point_lists_match_columnar(self):
+        s, columnar = self.simplified(1000)
+        s, points = self.simplified(1000, columnar=False)
+        self.assertEqual(points, columnar)
+
+    def test_multichannel_blocks_join(self):
+        wd = WavDecoder(infile, bs=1000, max_width=1000, max_height=500)
+        with Simplifier(wd, 1.0) as s:
+            blocks = list(s)
+        self.assertGreater(len(blocks), 2)
+        self.assertEqual(len(blocks[0]), 2)
+        for prev, block in zip(blocks, blocks[1:]):
+            for chan in range(2):
+                self.assertEqual(block[chan][0], prev[chan][-1])
+
+        # a spooled path does not repeat the joining points
+        s, chans = self.simplified(1000)
+        out = io.StringIO()
+        CSVFormatter(Simplifier(WavDecoder(infile, bs=1000, max_width=1000,
+                                           max_height=500, columnar=True),
+                                1.0)).output(out, spool=1000)
+        rows = [row for row in out.getvalue().splitlines()
+                if row[:1].isdigit()]
+        self.assertEqual(len(rows), s.points_out)
+        self.assertEqual(rows, ["%f, %f" % p for chan in chans for p in chan])
+
+    def test_unknown_method(self):
+        self.assertRaises(ValueError, Simplifier, WavDecoder(infile),
+                          1.0, 'nope')
+
+
+if __name__ == '__main__':
+    unittest.main()
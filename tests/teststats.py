@@ -0,0 +1,49 @@
+import unittest
+from io import BytesIO
+from wav2vec import WavDecoder
+from wav2vec.WavDecoder import np
+from wav2vec.formatter import SVGFormatter
+from wav2vec.stats import Stats, stages
+
+infile = 'tests/valfiles/snd/test-16-stereo.wav'
+
+
+class TestStats(unittest.TestCase):
+    def output(self, **kwargs):
+        stats = Stats(observers=[self.observed.append])
+        out = BytesIO()
+        SVGFormatter(WavDecoder(infile, stats=stats, **kwargs)).output(out)
+        return stats, out.getvalue()
+
+    def setUp(self):
+        self.observed = []
+
+    def test_stages_and_counters(self):
+        for bs in (0, 1000):
+            for numpy in (False, True) if np is not None else (False,):
+                with self.subTest(bs=bs, numpy=numpy):
+                    stats, data = self.output(bs=bs, use_numpy=numpy)
+                    for stage in stages + ("total",):
+                        self.assertIn(stage, stats.timers)
+                    with WavDecoder(infile) as wd:
+                        nframes = wd.params.nframes
+                    self.assertEqual(stats.counters["frames_decoded"],
+                                     nframes)
+                    self.assertEqual(stats.counters["bytes_read"],
+                                     nframes * 4)
+                    self.assertEqual(stats.counters["bytes_written"],
+                                     len(data))
+                    self.assertEqual(stats.counters["points"], 2 * nframes)
+
+    def test_observers(self):
+        stats, data = self.output()
+        self.assertEqual(self.observed, [stats])
+        self.assertIn("frames/s", stats.summary())
+        self.assertEqual(sorted(stats.as_dict()), ["counters", "timers"])
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(WavDecoder(infile).stats)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+import io
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import unittest
+from io import BytesIO
+from wav2vec import WavDecoder, mmapreader, streamreader
+from wav2vec.formatter import SVGFormatter
+from tests.testwavedecoder import write_aifc_float
+
+infile = 'tests/valfiles/snd/test-16-stereo.wav'
+aiff = 'tests/valfiles/snd/noise-16.aiff'
+
+
+class Pipe(object):
+    """
+    A binary stream which cannot seek and returns at most 1000 bytes per
+    read, like a pipe.
+    """
+
+    def __init__(self, data):
+        self._data = BytesIO(data)
+
+    def read(self, size=-1):
+        if size < 0 or size > 1000:
+            size = 1000
+        return self._data.read(size)
+
+
+def streamed(filename, unknown_size=0xFFFFFFFF, junk=False):
+    """
+    Return the content of the WAV file `filename` up to the end of its data
+    chunk with the RIFF and data chunk sizes replaced by `unknown_size` (and
+    a LIST chunk inserted before the data chunk if `junk` is set), as a
+    streaming encoder writes it.
+    """
+    with io.open(filename, 'rb') as f:
+        data = f.read()
+    pos = data.index(b'data')
+    (size,) = struct.unpack('<L', data[pos + 4:pos + 8])
+    data = data[:pos + 8 + size]
+    if junk:
+        data = data[:pos] + b'LIST' + struct.pack('<L', 3) + b'abc\0' + \
+            data[pos:]
+        pos += 12
+    unknown = struct.pack('<L', unknown_size)
+    return b'RIFF' + unknown + data[8:pos + 4] + unknown + data[pos + 8:]
+
+
+def svg(source, decoder_class, **kwargs):
+    out = BytesIO()
+    SVGFormatter(WavDecoder(source, decoder_class=decoder_class,
+                            **kwargs)).output(out)
+    return out.getvalue()
+
+
+class TestStreamReader(unittest.TestCase):
+    def compare(self, stream, filename):
+        with mmapreader.open(filename) as expected:
+            nframes = expected.getnframes()
+            frames = expected.readframes(nframes)
+            with streamreader.open(stream) as actual:
+                self.assertEqual(actual.getparams()[:3],
+                                 expected.getparams()[:3])
+                self.assertEqual(actual.getendchar(), expected.getendchar())
+                data = actual.readframes(300) + actual.readframes(nframes)
+                self.assertEqual(data, bytes(frames))
+                self.assertEqual(actual.tell(), nframes)
+                self.assertEqual(actual.readframes(10), b'')
+
+    def test_known_size(self):
+        with io.open(infile, 'rb') as f:
+            stream = Pipe(f.read())
+        with streamreader.open(stream) as sr:
+            with mmapreader.open(infile) as mr:
+                self.assertEqual(sr.getnframes(), mr.getnframes())
+        with io.open(infile, 'rb') as f:
+            self.compare(Pipe(f.read()), infile)
+        with io.open(aiff, 'rb') as f:
+            self.compare(Pipe(f.read()), aiff)
+
+    def test_unknown_size(self):
+        for size in (0, 0xFFFFFFFF):
+            with self.subTest(size=size):
+                data = streamed(infile, size, junk=True)
+                with streamreader.open(Pipe(data)) as sr:
+                    self.assertIsNone(sr.getnframes())
+                self.compare(Pipe(data), infile)
+
+    def test_float_aifc(self):
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, 'float.aifc')
+        samples = struct.pack('>4f', 0.5, -0.5, 0.25, 1.0)
+        try:
+            write_aifc_float(path, samples, 4)
+            with io.open(path, 'rb') as f:
+                stream = Pipe(f.read())
+            with streamreader.open(stream) as sr:
+                self.assertEqual(sr.getsampleformat(), 'float')
+                self.assertEqual(sr.readframes(4), samples)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_seek(self):
+        with mmapreader.open(infile) as mr:
+            nframes = mr.getnframes()
+        with streamreader.open(Pipe(streamed(infile))) as sr:
+            first = sr.readframes(10)
+            sr.setpos(100)
+            self.assertEqual(sr.tell(), 100)
+            self.assertRaises(mmapreader.Error, sr.setpos, 50)
+            sr.spool()
+            self.assertEqual(sr.getnframes(), nframes)
+            sr.setpos(100)
+            data = sr.readframes(10)
+            sr.setpos(100)
+            self.assertEqual(sr.readframes(10), data)
+            self.assertNotEqual(data, first)
+
+    def test_truncated_header(self):
+        with io.open(infile, 'rb') as f:
+            header = f.read(30)
+        self.assertRaises(mmapreader.Error, streamreader.open, Pipe(header))
+        self.assertRaises(mmapreader.Error, streamreader.open,
+                          Pipe(b'not a WAV file'))
+
+
+class TestStreamDecoding(unittest.TestCase):
+    def setUp(self):
+        with WavDecoder(infile) as wd:
+            self.nframes = wd.params.nframes
+            self.framerate = wd.params.framerate
+
+    def test_without_length(self):
+        for bs in (0, 1000):
+            with self.subTest(bs=bs):
+                self.assertEqual(svg(Pipe(streamed(infile)), streamreader,
+                                     bs=bs, max_width=500),
+                                 svg(infile, mmapreader, bs=bs, max_width=500))
+
+    def test_with_length(self):
+        expected = svg(infile, mmapreader, bs=1000, max_width=500)
+        for unit, length in (("frames", self.nframes),
+                             ("seconds", self.nframes / self.framerate)):
+            for prefetch in (0, 2):
+                with self.subTest(unit=unit, prefetch=prefetch):
+                    self.assertEqual(
+                        svg(Pipe(streamed(infile)), streamreader, bs=1000,
+                            max_width=500, length=length, unit=unit,
+                            prefetch=prefetch), expected)
+
+    def test_last_block(self):
+        # the length is only an estimate: decoding continues past it and
+        # stops at the end of the stream
+        for length in (self.nframes // 3, self.nframes * 3):
+            with self.subTest(length=length):
+                wd = WavDecoder(Pipe(streamed(infile)),
+                                decoder_class=streamreader, bs=1000,
+                                length=length, columnar=True)
+                with wd:
+                    last = []
+                    frames = 0
+                    for block in wd:
+                        last.append(wd.last_block)
+                        frames += len(block[0])
+                self.assertEqual(frames, self.nframes)
+                self.assertEqual(last, [False] * (len(last) - 1) + [True])
+
+    def test_peaks_past_length(self):
+        wd = WavDecoder(Pipe(streamed(infile)), decoder_class=streamreader,
+                        bs=1000, length=self.nframes * 2, peaks=True,
+                        max_width=10, columnar=True)
+        with wd:
+            xs = [x for block in wd for x in block[0].xs]
+        # half of the columns, the last of them partial
+        self.assertEqual(sorted(set(xs)), [1.0, 2.0, 3.0, 4.0, 5.0])
+
+    def test_cli(self):
+        with io.open('tests/valfiles/snd/noise-16.wav', 'rb') as f:
+            data = f.read()
+        expected = subprocess.run(
+            [sys.executable, 'wav2vec.py', 'tests/valfiles/snd/noise-16.wav',
+             '--stream', '1000'], stdout=subprocess.PIPE, check=True).stdout
+        actual = subprocess.run(
+            [sys.executable, 'wav2vec.py', '-', '--stream', '1000'],
+            input=data, stdout=subprocess.PIPE, check=True).stdout
+        self.assertEqual(actual, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
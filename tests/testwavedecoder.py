@@ -1,10 +1,20 @@
+import os
+import shutil
+import struct
+import tempfile
 import unittest
 from unittest.mock import MagicMock
 import wave
 import random
-from wav2vec import WavDecoder
+from wav2vec import WavDecoder, mmapreader
+from wav2vec.main import get_decoder_class, get_file_type
 from math import floor
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 def build_mock_wave(nchannels=2, sampwidth=2, framerate=44100, nframes=100,
                     comptype="NONE", compname="not compressed", bytes=b'\x4a'):
@@ -166,8 +176,8 @@ class TestStructFmt(unittest.TestCase):
     def test_struct_fmt_char_24(self):
         mock_wave = build_mock_wave(sampwidth=3)
         wd = WavDecoder("filename", decoder_class=mock_wave)
-        with self.assertRaises(ValueError):
-            wd.open()
+        wd.open()
+        self.assertEqual(wd.struct_fmt_char, '3')
 
     def test_struct_fmt_char_0(self):
         mock_wave = build_mock_wave(sampwidth=0)
@@ -219,3 +229,288 @@ class TestNext(SetupBase):
                     i += 1
                     self.assertAlmostEqual(point.y, 257, delta=5)
                 self.assertEqual(i, self.wd.bs)
+
+
+class TestNextArrays(unittest.TestCase):
+    infile = 'tests/valfiles/snd/test-16-stereo.wav'
+
+    def decode(self, method, **kwargs):
+        wd = WavDecoder(self.infile, max_width=250, max_height=100,
+                        downtoss=3, **kwargs)
+        with wd:
+            return getattr(wd, method)()
+
+    def test_python_matches_next(self):
+        points = self.decode('next')
+        arrays = self.decode('next_arrays', use_numpy=False)
+        self.assertEqual(len(arrays), len(points))
+        for (xs, ys), chan in zip(arrays, points):
+            self.assertEqual(list(xs), [p.x for p in chan])
+            self.assertEqual(list(ys), [p.y for p in chan])
+
+    @unittest.skipUnless(numpy, "NumPy is not installed")
+    def test_numpy_matches_python(self):
+        expected = self.decode('next_arrays', use_numpy=False)
+        actual = self.decode('next_arrays', use_numpy=True)
+        for (xs, ys), (exp_xs, exp_ys) in zip(actual, expected):
+            numpy.testing.assert_allclose(xs, exp_xs)
+            numpy.testing.assert_allclose(ys, exp_ys)
+
+    @unittest.skipUnless(numpy, "NumPy is not installed")
+    def test_numpy_unsigned_8_bit(self):
+        mock_wave = build_mock_wave(bytes=b'\xf0', nframes=10, sampwidth=1)
+        wd = WavDecoder("filename", decoder_class=mock_wave, signed=False,
+                        use_numpy=True)
+        (xs, ys), _ = wd.next_arrays()
+        for y in ys:
+            self.assertAlmostEqual(y, wd.scale_y(0xf0))
+
+
+def write_wav(filename, samples, sampwidth, nchannels=1, format_tag=1,
+              extensible=False):
+    """
+    Write packed little-endian `samples` (bytes) as a WAV file with the given
+    format tag, optionally in a WAVE_FORMAT_EXTENSIBLE fmt chunk.
+    """
+    bits = sampwidth * 8
+    blockalign = nchannels * sampwidth
+    fmt = struct.pack('<HHLLHH', 0xFFFE if extensible else format_tag,
+                      nchannels, 44100, 44100 * blockalign, blockalign, bits)
+    if extensible:
+        fmt += struct.pack('<HHL', 22, bits, 0)
+        fmt += struct.pack('<H', format_tag) + b'\x00\x00\x00\x00\x10\x00' \
+            b'\x80\x00\x00\xaa\x00\x38\x9b\x71'
+    with open(filename, 'wb') as f:
+        f.write(b'RIFF' + struct.pack('<L', 4 + 8 + len(fmt) + 8 +
+                                      len(samples)) + b'WAVE')
+        f.write(b'fmt ' + struct.pack('<L', len(fmt)) + fmt)
+        f.write(b'data' + struct.pack('<L', len(samples)) + samples)
+
+
+def write_aifc_float(filename, samples, sampwidth):
+    """
+    Write packed big-endian float `samples` (bytes) as a mono AIFF-C file.
+    """
+    comptype = b'fl32' if sampwidth == 4 else b'fl64'
+    nframes = len(samples) // sampwidth
+    # 44100 as an 80-bit extended float
+    rate = b'\x40\x0e\xac\x44' + b'\x00' * 6
+    comm = struct.pack('>hLh', 1, nframes, sampwidth * 8) + rate + \
+        comptype + b'\x00\x00'
+    body = (b'AIFC' + b'COMM' + struct.pack('>L', len(comm)) + comm +
+            b'SSND' + struct.pack('>LLL', 8 + len(samples), 0, 0) + samples)
+    with open(filename, 'wb') as f:
+        f.write(b'FORM' + struct.pack('>L', len(body)) + body)
+
+
+class TestHighResolution(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rng = random.Random(24)
+        self.ints = [rng.randint(-2**23, 2**23 - 1) for i in range(500)]
+        self.ints += [-2**23, 2**23 - 1, 0, -1]
+        self.floats = [rng.uniform(-1, 1) for i in range(500)] + [-1.0, 1.0]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def ys(self, filename, decoder_class, **kwargs):
+        results = []
+        for use_numpy in (False, True) if numpy else (False,):
+            with WavDecoder(filename, decoder_class=decoder_class,
+                            max_height=200, use_numpy=use_numpy,
+                            bs=77, **kwargs) as wd:
+                results.append([p.y for block in wd for p in block[0]])
+        for ys in results[1:]:
+            self.assertEqual(ys, results[0])
+        return results[0]
+
+    def test_24_bit(self):
+        wav = self.path('24.wav')
+        with wave.open(wav, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(3)
+            w.setframerate(44100)
+            w.writeframes(b''.join(v.to_bytes(3, 'little', signed=True)
+                                   for v in self.ints))
+        expected = [v * 100.0 / 2**23 for v in self.ints]
+        for decoder_class in (wave, mmapreader):
+            with self.subTest(decoder_class=decoder_class.__name__):
+                ys = self.ys(wav, decoder_class)
+                for y, exp in zip(ys, expected):
+                    self.assertAlmostEqual(y, exp)
+
+    def test_24_bit_aiff(self):
+        import aifc
+        aiff = self.path('24.aiff')
+        with aifc.open(aiff, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(3)
+            w.setframerate(44100)
+            w.writeframes(b''.join(v.to_bytes(3, 'big', signed=True)
+                                   for v in self.ints))
+        expected = self.ys(aiff, aifc)
+        self.assertEqual(self.ys(aiff, mmapreader), expected)
+        self.assertAlmostEqual(expected[-4], -100.0)
+
+    def test_float(self):
+        for sampwidth, char in ((4, 'f'), (8, 'd')):
+            le = struct.pack('<%d%s' % (len(self.floats), char), *self.floats)
+            be = struct.pack('>%d%s' % (len(self.floats), char), *self.floats)
+            write_wav(self.path('float.wav'), le, sampwidth, format_tag=3)
+            write_wav(self.path('ext.wav'), le, sampwidth, format_tag=3,
+                      extensible=True)
+            write_aifc_float(self.path('float.aifc'), be, sampwidth)
+            for name in ('float.wav', 'ext.wav', 'float.aifc'):
+                with self.subTest(name=name, sampwidth=sampwidth):
+                    ys = self.ys(self.path(name), mmapreader)
+                    self.assertEqual(len(ys), len(self.floats))
+                    for y, v in zip(ys, self.floats):
+                        self.assertAlmostEqual(y, v * 100.0, places=4)
+
+    def test_float_default_height(self):
+        data = struct.pack('<3f', -1.0, 0.5, 1.0)
+        write_wav(self.path('float.wav'), data, 4, format_tag=3)
+        with WavDecoder(self.path('float.wav'),
+                        decoder_class=mmapreader) as wd:
+            self.assertEqual(wd.struct_fmt_char, 'f')
+            self.assertEqual([p.y for p in wd.next()[0]], [-1.0, 0.5, 1.0])
+
+    def test_unknown_format(self):
+        write_wav(self.path('alaw.wav'), b'\x00' * 10, 1, format_tag=6)
+        with self.assertRaises(mmapreader.Error):
+            mmapreader.open(self.path('alaw.wav'))
+        with self.assertRaises(ValueError):
+            get_decoder_class(self.path('alaw.wav'))
+
+    def test_decoder_class(self):
+        import aifc
+        le = struct.pack('<2f', 0.5, -0.5)
+        write_wav(self.path('pcm.wav'), b'\x00' * 4, 2)
+        write_wav(self.path('float.wav'), le, 4, format_tag=3)
+        write_wav(self.path('ext.wav'), le, 4, format_tag=3, extensible=True)
+        write_aifc_float(self.path('float.aifc'), struct.pack('>2f', 0.5, 0),
+                         4)
+        with open(self.path('text.wav'), 'wb') as f:
+            f.write(b'not a WAV file')
+        for name, expected in (('pcm.wav', wave), ('float.wav', mmapreader),
+                               ('ext.wav', mmapreader),
+                               ('float.aifc', mmapreader)):
+            with self.subTest(name=name):
+                self.assertIs(get_decoder_class(self.path(name)), expected)
+                self.assertIs(get_decoder_class(self.path(name), True),
+                              mmapreader)
+        self.assertIs(get_decoder_class('tests/valfiles/snd/noise-8.aiff'),
+                      aifc)
+        self.assertEqual(get_file_type(self.path('float.aifc')), 'aifc')
+        self.assertIsNone(get_file_type(self.path('text.wav')))
+        self.assertRaises(ValueError, get_decoder_class,
+                          self.path('text.wav'))
+
+
+class TestColumnar(unittest.TestCase):
+    infile = 'tests/valfiles/snd/test-16-stereo.wav'
+
+    def test_blocks_match_points(self):
+        for bs in (0, 1000):
+            with WavDecoder(self.infile, bs=bs, downtoss=2) as wd:
+                expected = list(wd)
+            with WavDecoder(self.infile, bs=bs, downtoss=2,
+                            columnar=True) as wd:
+                actual = list(wd)
+            self.assertEqual(len(actual), len(expected))
+            for blocks, paths in zip(actual, expected):
+                for block, points in zip(blocks, paths):
+                    self.assertEqual(len(block), len(points))
+                    self.assertEqual(block[0], points[0])
+                    self.assertEqual(block[-1], points[-1])
+                    self.assertEqual(list(block), points)
+                    self.assertEqual(list(block[1:3]), points[1:3])
+
+
+class TestRange(unittest.TestCase):
+    infile = 'tests/valfiles/snd/test-16-stereo.wav'
+
+    def decode(self, **kwargs):
+        with WavDecoder(self.infile, columnar=True, **kwargs) as wd:
+            blocks = list(wd)
+            self.assertTrue(wd.last_block)
+        return [[p for b in blocks for p in b[chan]] for chan in range(2)]
+
+    def test_range_matches_full_decode(self):
+        full = self.decode()
+        for bs in (0, 1000):
+            for use_numpy in (False, True) if numpy else (False,):
+                with self.subTest(bs=bs, use_numpy=use_numpy):
+                    part = self.decode(start=1000, end=5000, bs=bs,
+                                       use_numpy=use_numpy)
+                    for part_chan, full_chan in zip(part, full):
+                        self.assertEqual([p.y for p in part_chan],
+                                         [p.y for p in full_chan[1000:5000]])
+                        self.assertEqual([p.x for p in part_chan],
+                                         [float(x) for x in range(1, 4001)])
+
+    def test_seconds_and_width(self):
+        with WavDecoder(self.infile) as wd:
+            framerate = wd.params.framerate
+        part = self.decode(start=0.25, end=0.5, unit='seconds',
+                           max_width=100)
+        self.assertEqual(len(part[0]), int(round(0.5 * framerate)) -
+                         int(round(0.25 * framerate)))
+        self.assertAlmostEqual(part[0][-1].x, 100)
+
+    def test_seeks_to_start(self):
+        with WavDecoder(self.infile, start=2000) as wd:
+            self.assertEqual(wd.index, 2000)
+            self.assertEqual(wd._wav_file.tell(), 2000)
+            self.assertTrue(wd.next() and wd.first_block)
+
+    def test_peaks(self):
+        full = self.decode(start=3000, end=9000)
+        peaks = self.decode(start=3000, end=9000, peaks=True, max_width=50,
+                            bs=777)
+        for peak_chan, full_chan in zip(peaks, full):
+            self.assertEqual(peak_chan[-1].x, 50)
+            self.assertEqual(max(p.y for p in peak_chan),
+                             max(p.y for p in full_chan))
+
+    def test_empty_range(self):
+        wd = WavDecoder(self.infile, start=5000, end=5000)
+        self.assertRaises(ValueError, wd.open)
+        self.assertRaises(ValueError, WavDecoder, self.infile, unit='beats')
+
+
+class TestPeaks(unittest.TestCase):
+    infile = 'tests/valfiles/snd/test-16-stereo.wav'
+
+    def decode(self, **kwargs):
+        with WavDecoder(self.infile, **kwargs) as wd:
+            blocks = list(wd)
+            self.assertTrue(wd.last_block)
+        return [sum((list(b[chan]) for b in blocks), [])
+                for chan in range(len(blocks[0]))]
+
+    def test_streaming_matches_slurp(self):
+        expected = self.decode(max_width=100, peaks=True)
+        for bs in (1, 37, 1000):
+            with self.subTest(bs=bs):
+                self.assertEqual(self.decode(max_width=100, peaks=True, bs=bs),
+                                 expected)
+
+    def test_envelope_keeps_extrema(self):
+        peaks = self.decode(max_width=100, peaks=True, columnar=True)
+        full = self.decode(max_width=100)
+        for peak_chan, full_chan in zip(peaks, full):
+            self.assertLessEqual(len(peak_chan), 200)
+            self.assertEqual(max(p.y for p in peak_chan),
+                             max(p.y for p in full_chan))
+            self.assertEqual(min(p.y for p in peak_chan),
+                             min(p.y for p in full_chan))
+            self.assertEqual(peak_chan[-1].x, 100)
+
+    def test_no_reduction_when_narrow(self):
+        self.assertEqual(self.decode(max_width=0, peaks=True),
+                         self.decode(max_width=0))
@@ -0,0 +1,569 @@
+"""
+This module defines the PeakIndex class, a persistent multi-resolution summary
+of a waveform file, and the PeakDecoder class which renders a peak envelope
+from it.
+
+A PeakIndex is a pyramid of levels: the base level stores the minimum and
+maximum sample (and optionally the RMS) of every `base_bucket` frames of each
+channel, and every following level summarizes pairs of buckets of the level
+below it. The whole pyramid is built in one pass over the audio and saved to a
+compact binary sidecar file (by default the name of the audio file with
+'.peaks' appended). Rendering at any width then only needs to read the one
+level whose buckets are a small fraction of a column, so re-rendering takes the
+same time however long the audio is. (Because buckets do not line up exactly
+with columns, the envelope may differ slightly from the one WavDecoder computes
+in peaks mode.)
+"""
+
+import io
+import logging
+import math
+import os
+import struct
+import sys
+from array import array
+from collections import namedtuple
+
+from .WavDecoder import (ChannelBlock, Point, _array_frombytes, _array_tobytes,
+                         _extrema, _wave_params)
+
+logger = logging.getLogger(__name__)
+
+try:
+    xrange
+except NameError:
+    # in Python3 xrange has been renamed to range
+    xrange = range
+
+MAGIC = b"W2VPEAKS"
+VERSION = 1
+FLAG_RMS = 1
+
+# magic, version, flags, signed, nchannels, sampwidth, framerate, nframes,
+# source size, source mtime (ns), base bucket size, number of levels, typecode
+_header = struct.Struct("<8sHBBHHLQQqLHc")
+# bucket size, number of buckets, offset of the level's data in the file
+_level_entry = struct.Struct("<QQQ")
+
+# order flags: which of the min and max sample of a bucket comes first
+MIN_FIRST = -1
+SAME = 0
+MAX_FIRST = 1
+
+Level = namedtuple("Level", "bucket_size nbuckets mins maxs orders rms")
+
+
+class PeakIndex(object):
+    """
+    A min/max (and optionally RMS) pyramid for one waveform file.
+
+    Build it with `PeakIndex.build()` (which reads the file through a
+    WavDecoder), save it with `save()`, and load it again with `load()`. Use
+    `read_level()` to read a single level from a saved index.
+        >>> index = PeakIndex.build(WavDecoder('filename'))
+        >>> index.save('filename.peaks')
+    """
+
+    def __init__(self, params, signed, base_bucket, levels, rms=False,
+                 source_size=0, source_mtime=0, typecode="i"):
+        """
+        Args:
+            params (tuple): the parameters of the source file (as returned by
+                Wave_read.getparams())
+            signed (bool): whether the samples were decoded as signed
+            base_bucket (int): the number of frames summarized by each bucket
+                of the finest level
+            levels (list): a Level for every level of the pyramid, finest
+                first (entries may be None for levels which were not loaded)
+            rms (bool): whether the levels include RMS values
+            source_size (int): the size of the source file in bytes
+            source_mtime (int): the modification time of the source file in
+                nanoseconds
+            typecode (str): the `array` typecode of the stored min/max values
+        """
+        self.params = params
+        self.signed = signed
+        self.base_bucket = base_bucket
+        self.levels = levels
+        self.rms = rms
+        self.source_size = source_size
+        self.source_mtime = source_mtime
+        self.typecode = typecode
+        self._path = None
+        self._level_table = None
+
+    @classmethod
+    def build(cls, decoder, base_bucket=256, rms=False):
+        """
+        Build an index by reading all of the frames of `decoder` (a
+        WavDecoder) in one pass.
+        """
+        opened = decoder._wav_file is None
+        if opened:
+            decoder.open()
+        if decoder.start is not None or decoder.end is not None:
+            if opened:
+                decoder.close()
+            raise ValueError("a peak index is built from the whole file; "
+                             "the decoder must not have a start or end")
+        old_bs = decoder.bs
+        # read whole buckets at a time
+        decoder.bs = base_bucket * max(1, 65536 // base_bucket)
+        try:
+            p = decoder.params
+            nbuckets = -(-p.nframes // base_bucket)
+            typecode = _typecode(decoder)
+            mins = [array(typecode) for chan in xrange(0, p.nchannels)]
+            maxs = [array(typecode) for chan in xrange(0, p.nchannels)]
+            orders = [array("b") for chan in xrange(0, p.nchannels)]
+            sums = [array("f") for chan in xrange(0, p.nchannels)]
+            decoder._stop_prefetch()
+            decoder.index = 0
+            decoder._wav_file.rewind()
+            while True:
+                try:
+                    wav_bytes, frames = decoder._read_block()
+                except StopIteration:
+                    break
+                chans = decoder._split_channels(wav_bytes, frames)
+                decoder.index += frames
+                for chan, chan_data in enumerate(chans):
+                    for start in xrange(0, frames, base_bucket):
+                        seg = chan_data[start : start + base_bucket]
+                        vmin, imin, vmax, imax = _extrema(seg)
+                        mins[chan].append(vmin)
+                        maxs[chan].append(vmax)
+                        orders[chan].append(_order(imin, imax))
+                        if rms:
+                            sums[chan].append(_rms(seg))
+        finally:
+            decoder.bs = old_bs
+            if opened:
+                decoder.close()
+            else:
+                # leave the decoder ready to read from the start again
+                decoder._stop_prefetch()
+                decoder._wav_file.rewind()
+                decoder.index = 0
+        levels = [Level(base_bucket, nbuckets, mins, maxs, orders,
+                        sums if rms else None)]
+        while levels[-1].nbuckets > 1:
+            levels.append(_merge_level(levels[-1], p.nframes))
+        size, mtime = _source_stat(decoder._filename)
+        logger.info("Built peak index with %d levels for %s"
+                    % (len(levels), decoder._filename))
+        return cls(_plain_params(p), decoder.signed, base_bucket, levels,
+                   rms, size, mtime, typecode)
+
+    def save(self, path):
+        """
+        Write the index to `path` (atomically, via a temporary file).
+        """
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        p = self.params
+        with io.open(tmp_path, "wb") as f:
+            f.write(_header.pack(
+                MAGIC, VERSION, FLAG_RMS if self.rms else 0,
+                1 if self.signed else 0, p.nchannels, p.sampwidth,
+                p.framerate, p.nframes, self.source_size, self.source_mtime,
+                self.base_bucket, len(self.levels),
+                self.typecode.encode("ascii")))
+            offset = _header.size + _level_entry.size * len(self.levels)
+            for level in self.levels:
+                f.write(_level_entry.pack(level.bucket_size, level.nbuckets,
+                                          offset))
+                offset += self._level_size(level.nbuckets)
+            for level in self.levels:
+                columns = level.mins + level.maxs + level.orders
+                if self.rms:
+                    columns += level.rms
+                for column in columns:
+                    _write_le(f, column)
+        os.replace(tmp_path, path)
+        self._path = path
+        logger.info("Saved peak index to %s" % path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read the header and level table of the index saved at `path`. The
+        levels themselves are only read by `read_level()`.
+
+        Raises ValueError if `path` is not a peak index.
+        """
+        with io.open(path, "rb") as f:
+            header = f.read(_header.size)
+            if len(header) != _header.size or header[:8] != MAGIC:
+                raise ValueError("Not a peak index: %s" % path)
+            (_, version, flags, signed, nchannels, sampwidth, framerate,
+             nframes, size, mtime, base_bucket, nlevels,
+             typecode) = _header.unpack(header)
+            if version != VERSION:
+                raise ValueError("Unsupported peak index version %d"
+                                 % version)
+            table = [_level_entry.unpack(f.read(_level_entry.size))
+                     for i in xrange(0, nlevels)]
+        params = _plain_params((nchannels, sampwidth, framerate, nframes,
+                                "NONE", "not compressed"))
+        index = cls(params, bool(signed), base_bucket, [None] * nlevels,
+                    bool(flags & FLAG_RMS), size, mtime,
+                    typecode.decode("ascii"))
+        index._path = path
+        index._level_table = table
+        return index
+
+    def _level_size(self, nbuckets):
+        nchannels = self.params.nchannels
+        itemsize = array(self.typecode).itemsize
+        size = nbuckets * nchannels * (2 * itemsize + 1)
+        if self.rms:
+            size += nbuckets * nchannels * 4
+        return size
+
+    def read_level(self, level_num):
+        """
+        Return the Level `level_num` (0 is the finest), reading it from the
+        sidecar file if it has not been read yet.
+        """
+        level = self.levels[level_num]
+        if level is not None:
+            return level
+        bucket_size, nbuckets, offset = self._level_table[level_num]
+        nchannels = self.params.nchannels
+        with io.open(self._path, "rb") as f:
+            f.seek(offset)
+            mins = [_read_le(f, self.typecode, nbuckets)
+                    for chan in xrange(0, nchannels)]
+            maxs = [_read_le(f, self.typecode, nbuckets)
+                    for chan in xrange(0, nchannels)]
+            orders = [_read_le(f, "b", nbuckets)
+                      for chan in xrange(0, nchannels)]
+            rms = None
+            if self.rms:
+                rms = [_read_le(f, "f", nbuckets)
+                       for chan in xrange(0, nchannels)]
+        level = Level(bucket_size, nbuckets, mins, maxs, orders, rms)
+        self.levels[level_num] = level
+        logger.debug("Read level %d (%d buckets) from %s"
+                     % (level_num, nbuckets, self._path))
+        return level
+
+    def level_for_width(self, width, oversample=8):
+        """
+        Return the number of the level to use when the frames are divided into
+        `width` columns, or None if even the base level is too coarse.
+
+        Buckets do not line up with column boundaries, so a column's extrema
+        may be taken from a bucket which straddles its neighbour. To keep that
+        error small the coarsest level with at least `oversample` buckets per
+        column is chosen (or the base level if none has that many).
+        """
+        nframes = self.params.nframes
+        if self._bucket_size(0) * width > nframes:
+            return None
+        best = 0
+        for level_num in xrange(1, len(self.levels)):
+            if self._bucket_size(level_num) * width * oversample <= nframes:
+                best = level_num
+        return best
+
+    def _bucket_size(self, level_num):
+        if self._level_table is not None:
+            return self._level_table[level_num][0]
+        return self.levels[level_num].bucket_size
+
+    def columns(self, width):
+        """
+        Summarize the frames in `width` columns using the appropriate level.
+
+        Returns a list for each channel with a (min, max, order, rms) tuple
+        for each column, where order is one of MIN_FIRST, SAME or MAX_FIRST and
+        rms is None unless the index includes RMS values. Returns None if the
+        index is too coarse for `width`.
+        """
+        level_num = self.level_for_width(width)
+        if level_num is None:
+            return None
+        level = self.read_level(level_num)
+        nframes = self.params.nframes
+        result = []
+        for chan in xrange(0, self.params.nchannels):
+            cols = []
+            col = None
+            for b in xrange(0, level.nbuckets):
+                bucket = (level.mins[chan][b], level.maxs[chan][b],
+                          level.orders[chan][b], _bucket_frames(
+                              level.bucket_size, b, nframes),
+                          level.rms[chan][b] if level.rms else None)
+                c = b * level.bucket_size * width // nframes
+                if c != len(cols) - 1:
+                    cols.append(bucket)
+                else:
+                    cols[-1] = _merge(cols[-1], bucket)
+            result.append([(vmin, vmax, order, rms)
+                           for vmin, vmax, order, n, rms in cols])
+        return result
+
+    def is_valid_for(self, decoder, base_bucket=None, rms=False):
+        """
+        True if this index was built from the current version of the file
+        `decoder` reads (same size, mtime and parameters).
+        """
+        size, mtime = _source_stat(decoder._filename)
+        if (size, mtime) != (self.source_size, self.source_mtime):
+            return False
+        if base_bucket is not None and base_bucket != self.base_bucket:
+            return False
+        if rms and not self.rms:
+            return False
+        if decoder.signed is not None and decoder.signed != self.signed:
+            return False
+        if self.typecode != _typecode(decoder):
+            return False
+        p = decoder.params
+        return (p.nchannels, p.sampwidth, p.framerate, p.nframes) == (
+            self.params.nchannels, self.params.sampwidth,
+            self.params.framerate, self.params.nframes)
+
+
+class PeakDecoder(object):
+    """
+    A drop-in replacement for a WavDecoder in peaks mode which renders the
+    peak envelope from a PeakIndex sidecar file instead of decoding the audio.
+    The index is built (and saved) the first time, and rebuilt whenever the
+    audio file or the index parameters change.
+
+    If the requested width is too fine for the index, or the decoder only
+    decodes part of the file (see WavDecoder's `start` and `end`), the
+    wrapped decoder is used directly (in peaks mode).
+        >>> wd = WavDecoder('filename', max_width=1000, max_height=500)
+        >>> svg = str(SVGFormatter(PeakDecoder(wd)))
+    """
+
+    def __init__(self, decoder, index_path=None, base_bucket=256, rms=False):
+        """
+        Args:
+            decoder (WavDecoder): the decoder for the audio file. Its
+                `max_width` and `max_height` determine the output size.
+            index_path (str): name of the sidecar file. Defaults to the name
+                of the audio file with '.peaks' appended.
+            base_bucket (int): the number of frames in each bucket of the
+                finest level of a newly built index
+            rms (bool): also store RMS values when building the index
+        """
+        self.decoder = decoder
+        if index_path is None:
+            index_path = decoder._filename + ".peaks"
+        self.index_path = index_path
+        self.base_bucket = base_bucket
+        self.rms = rms
+        self.peak_index = None
+        self._fallback = False
+        self._done = False
+
+    def __getattr__(self, name):
+        # params, width, height, bs, etc. come from the wrapped decoder
+        return getattr(self.decoder, name)
+
+    def __iter__(self):
+        return self
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        """
+        Open the wrapped decoder (which only reads the header of the audio
+        file) and load, or build and save, the peak index.
+        """
+        self.decoder.open()
+        self._done = False
+        if self.decoder.start is not None or self.decoder.end is not None:
+            # the index covers the whole file, so decode the range instead
+            logger.info("Decoding the selected range instead of using the "
+                        "peak index")
+            self._fallback = True
+            self.decoder.peaks = True
+            return
+        self.peak_index = self._load_index()
+        if self.peak_index is None:
+            self.peak_index = PeakIndex.build(self.decoder, self.base_bucket,
+                                              self.rms)
+            try:
+                self.peak_index.save(self.index_path)
+            except (IOError, OSError) as e:
+                logger.warning("Could not save peak index %s: %s"
+                               % (self.index_path, e))
+        width = self.decoder.width
+        self._fallback = self.peak_index.level_for_width(width) is None
+        if self._fallback:
+            logger.info("Peak index too coarse for width %d; decoding audio"
+                        % self.decoder.width)
+            self.decoder.peaks = True
+
+    def _load_index(self):
+        try:
+            index = PeakIndex.load(self.index_path)
+        except (IOError, OSError, ValueError, struct.error) as e:
+            logger.debug("No usable peak index at %s: %s"
+                         % (self.index_path, e))
+            return None
+        if not index.is_valid_for(self.decoder, self.base_bucket, self.rms):
+            logger.info("Peak index %s is stale" % self.index_path)
+            return None
+        return index
+
+    def close(self):
+        self.decoder.close()
+        self.peak_index = None
+
+    def next(self):
+        """
+        Return the whole peak envelope as a single block (a list with a
+        ChannelBlock or list of Points for each channel).
+        """
+        if self._fallback:
+            return self.decoder.next()
+        if self._done:
+            raise StopIteration
+        d = self.decoder
+        offset, scale = d._y_transform()
+        sep_data = []
+        for chan_cols in self.peak_index.columns(d.width):
+            xs = array("d")
+            ys = array("d")
+            for c, (vmin, vmax, order, rms) in enumerate(chan_cols):
+                if order == SAME:
+                    samples = (vmin,)
+                elif order == MIN_FIRST:
+                    samples = (vmin, vmax)
+                else:
+                    samples = (vmax, vmin)
+                for sample in samples:
+                    xs.append(c + 1)
+                    ys.append((sample - offset) * scale)
+            if d.columnar:
+                sep_data.append(ChannelBlock(xs, ys))
+            else:
+                sep_data.append([Point(x, y) for x, y in zip(xs, ys)])
+        self._done = True
+        d.index = d.params.nframes
+        d.first_block = True
+        d.last_block = True
+        return sep_data
+
+    # alias for python3-style iterators:
+    __next__ = next
+
+
+def _plain_params(params):
+    return _wave_params(*tuple(params))
+
+
+def _source_stat(filename):
+    st = os.stat(filename)
+    mtime = getattr(st, "st_mtime_ns", None)
+    if mtime is None:
+        mtime = int(st.st_mtime * 1e9)
+    return st.st_size, mtime
+
+
+def _order(imin, imax):
+    if imin == imax:
+        return SAME
+    return MIN_FIRST if imin < imax else MAX_FIRST
+
+
+def _rms(seg):
+    return math.sqrt(math.fsum(float(v) * v for v in seg) / len(seg))
+
+
+def _bucket_frames(bucket_size, b, nframes):
+    return min(bucket_size, nframes - b * bucket_size)
+
+
+def _merge(a, b):
+    """
+    Merge the (min, max, order, nframes, rms) summaries of two adjacent
+    buckets (`a` coming first).
+    """
+    a_min, a_max, a_order, a_n, a_rms = a
+    b_min, b_max, b_order, b_n, b_rms = b
+    # earlier samples win ties
+    min_from_a = a_min <= b_min
+    max_from_a = a_max >= b_max
+    if min_from_a and max_from_a:
+        order = a_order
+    elif not min_from_a and not max_from_a:
+        order = b_order
+    else:
+        order = MIN_FIRST if min_from_a else MAX_FIRST
+    rms = None
+    if a_rms is not None:
+        rms = math.sqrt((a_rms * a_rms * a_n + b_rms * b_rms * b_n)
+                        / (a_n + b_n))
+    return (a_min if min_from_a else b_min, a_max if max_from_a else b_max,
+            order, a_n + b_n, rms)
+
+
+def _merge_level(level, nframes):
+    """
+    Return the next coarser level, which summarizes pairs of buckets.
+    """
+    nchannels = len(level.mins)
+    nbuckets = -(-level.nbuckets // 2)
+    mins = [array(level.mins[0].typecode) for chan in xrange(0, nchannels)]
+    maxs = [array(level.maxs[0].typecode) for chan in xrange(0, nchannels)]
+    orders = [array("b") for chan in xrange(0, nchannels)]
+    rms = [array("f") for chan in xrange(0, nchannels)] if level.rms else None
+    for chan in xrange(0, nchannels):
+        for b in xrange(0, level.nbuckets, 2):
+            merged = _level_bucket(level, chan, b, nframes)
+            if b + 1 < level.nbuckets:
+                merged = _merge(merged,
+                                _level_bucket(level, chan, b + 1, nframes))
+            mins[chan].append(merged[0])
+            maxs[chan].append(merged[1])
+            orders[chan].append(merged[2])
+            if rms is not None:
+                rms[chan].append(merged[4])
+    return Level(level.bucket_size * 2, nbuckets, mins, maxs, orders, rms)
+
+
+def _level_bucket(level, chan, b, nframes):
+    return (level.mins[chan][b], level.maxs[chan][b], level.orders[chan][b],
+            _bucket_frames(level.bucket_size, b, nframes),
+            level.rms[chan][b] if level.rms else None)
+
+
+def _write_le(f, column):
+    """
+    Write an array to `f` in little-endian byte order.
+    """
+    if sys.byteorder != "little" and column.itemsize > 1:
+        column = array(column.typecode, column)
+        column.byteswap()
+    f.write(_array_tobytes(column))
+
+
+def _typecode(decoder):
+    """
+    Return the `array` typecode of the min/max values of an index built from
+    the (open) `decoder`: doubles for float samples, integers otherwise.
+    """
+    return "d" if decoder.sample_format == "float" else "i"
+
+
+def _read_le(f, typecode, count):
+    """
+    Read `count` little-endian items of type `typecode` from `f`.
+    """
+    column = array(typecode)
+    _array_frombytes(column, f.read(count * column.itemsize))
+    if sys.byteorder != "little" and column.itemsize > 1:
+        column.byteswap()
+    return column
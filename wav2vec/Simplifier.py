@@ -0,0 +1,276 @@
+"""
+This module defines the Simplifier class, a decoder proxy which simplifies the
+paths of each channel before they are formatted, and the line simplification
+algorithms it can use.
+
+Waveforms (especially with many samples per pixel) contain lots of points
+which are collinear with their neighbours or closer together than a pixel.
+Dropping them makes SVG and PostScript output much smaller and faster to
+render without any visible difference. The tolerance is given in pixels (the
+units of the scaled output).
+
+Blocks are simplified one at a time, so streaming (bs > 0) still uses bounded
+memory: the last point kept from the previous block of a channel is used as
+the starting point of the next one, so the paths join up as if the whole
+channel had been simplified in pieces. Multi-channel blocks are formatted as a
+separate path per block, so each of their channels also starts with that
+point (otherwise the segment joining the blocks would be lost).
+    >>> wd = WavDecoder('filename', bs=4096)
+    >>> svg = str(SVGFormatter(Simplifier(wd, tolerance=0.5)))
+"""
+
+import heapq
+import logging
+from array import array
+
+from .WavDecoder import ChannelBlock, Point, np
+
+logger = logging.getLogger(__name__)
+
+try:
+    xrange
+except NameError:
+    # in Python3 xrange has been renamed to range
+    xrange = range
+
+
+def rdp(xs, ys, tolerance):
+    """
+    Simplify a path with the Ramer-Douglas-Peucker algorithm: every dropped
+    point lies within `tolerance` of the simplified path.
+
+    Returns the (sorted) indices of the points to keep. The first and last
+    point are always kept.
+    """
+    n = len(xs)
+    if n < 3:
+        return list(xrange(n))
+    if not (np is not None and isinstance(xs, np.ndarray)):
+        xs = list(xs)
+        ys = list(ys)
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        index, dist = _farthest(xs, ys, first, last)
+        if dist > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [i for i in xrange(n) if keep[i]]
+
+
+def _farthest(xs, ys, first, last):
+    """
+    Return the index of the point between `first` and `last` which is
+    farthest from the segment joining them, and its distance.
+
+    (The distance to the segment rather than to the line through it is used,
+    so that points beyond either end, which are common where a waveform is
+    squeezed into few pixels, are not dropped.)
+    """
+    x0, y0 = xs[first], ys[first]
+    dx, dy = xs[last] - x0, ys[last] - y0
+    length = float(dx * dx + dy * dy)
+    if np is not None and isinstance(xs, np.ndarray):
+        px = xs[first + 1:last] - x0
+        py = ys[first + 1:last] - y0
+        if length:
+            t = np.clip((px * dx + py * dy) / length, 0.0, 1.0)
+            px = px - t * dx
+            py = py - t * dy
+        dists = px * px + py * py
+        i = int(dists.argmax())
+        return first + 1 + i, dists[i].item() ** 0.5
+    index, dist = first, -1.0
+    for i in xrange(first + 1, last):
+        px = xs[i] - x0
+        py = ys[i] - y0
+        if length:
+            t = (px * dx + py * dy) / length
+            if t > 1.0:
+                t = 1.0
+            elif t < 0.0:
+                t = 0.0
+            px -= t * dx
+            py -= t * dy
+        d = px * px + py * py
+        if d > dist:
+            index, dist = i, d
+    return index, dist ** 0.5
+
+
+def visvalingam(xs, ys, tolerance):
+    """
+    Simplify a path with the Visvalingam-Whyatt algorithm: repeatedly drop
+    the point which forms the smallest triangle with its neighbours, until
+    every triangle has an area of at least `tolerance` squared.
+
+    Returns the (sorted) indices of the points to keep. The first and last
+    point are always kept.
+    """
+    n = len(xs)
+    if n < 3:
+        return list(xrange(n))
+    xs = list(xs)
+    ys = list(ys)
+    # compare twice the triangle areas to avoid a division
+    threshold = 2.0 * tolerance * tolerance
+    prev = list(xrange(-1, n - 1))
+    nxt = list(xrange(1, n + 1))
+    removed = [False] * n
+
+    def area(i):
+        p, q = prev[i], nxt[i]
+        return abs((xs[i] - xs[p]) * (ys[q] - ys[p]) -
+                   (xs[q] - xs[p]) * (ys[i] - ys[p]))
+
+    areas = [None] * n
+    heap = []
+    for i in xrange(1, n - 1):
+        areas[i] = area(i)
+        heap.append((areas[i], i))
+    heapq.heapify(heap)
+    while heap:
+        a, i = heapq.heappop(heap)
+        if removed[i] or a != areas[i]:
+            # stale entry: the point was removed or its area changed
+            continue
+        if a >= threshold:
+            break
+        removed[i] = True
+        p, q = prev[i], nxt[i]
+        nxt[p] = q
+        prev[q] = p
+        for j in (p, q):
+            if 0 < j < n - 1:
+                # a neighbour never becomes less significant than the point
+                # removed before it
+                areas[j] = max(area(j), a)
+                heapq.heappush(heap, (areas[j], j))
+    return [i for i in xrange(n) if not removed[i]]
+
+
+# available simplification algorithms, by name
+methods = {
+    "rdp": rdp,
+    "vw": visvalingam,
+}
+
+
+class Simplifier(object):
+    """
+    A decoder proxy which simplifies every channel of each block returned by
+    the wrapped decoder (a WavDecoder or PeakDecoder) before it reaches the
+    formatter.
+
+    After the output, `points_in` and `points_out` hold the number of points
+    decoded and kept, and `ratio` is the point-reduction ratio.
+        >>> wd = WavDecoder('filename')
+        >>> svg = str(SVGFormatter(Simplifier(wd, tolerance=0.5)))
+    """
+
+    def __init__(self, decoder, tolerance=0.5, method="rdp"):
+        """
+        Args:
+            decoder (WavDecoder): the decoder to read blocks from
+            tolerance (float): the simplification tolerance in pixels
+            method (str or callable): the name of an algorithm in `methods`,
+                or a function taking (xs, ys, tolerance) which returns the
+                sorted indices of the points to keep (including the first and
+                last point)
+        """
+        self.decoder = decoder
+        self.tolerance = tolerance
+        if not callable(method):
+            if method not in methods:
+                raise ValueError("Unknown simplification method: %s" % method)
+            method = methods[method]
+        self.method = method
+        self._anchors = None
+        self.points_in = 0
+        self.points_out = 0
+
+    def __getattr__(self, name):
+        # params, width, height, first_block, etc. come from the wrapped
+        # decoder
+        return getattr(self.decoder, name)
+
+    def __iter__(self):
+        return self
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def ratio(self):
+        """
+        The number of points decoded per point kept.
+        """
+        if not self.points_out:
+            return 1.0
+        return float(self.points_in) / self.points_out
+
+    def open(self):
+        self.decoder.open()
+        self._anchors = None
+        self.points_in = 0
+        self.points_out = 0
+
+    def close(self):
+        self.decoder.close()
+        logger.debug("Simplified %d points to %d (%.1fx reduction)"
+                     % (self.points_in, self.points_out, self.ratio))
+
+    def next(self):
+        """
+        Return the next block of the wrapped decoder with every channel
+        simplified (as a ChannelBlock or list of Points, like the decoder).
+        """
+        paths = self.decoder.next()
+        if self._anchors is None:
+            self._anchors = [None] * len(paths)
+        join = len(paths) > 1
+        return [self._simplify(chan_data, chan, join)
+                for chan, chan_data in enumerate(paths)]
+    __next__ = next
+
+    def _simplify(self, chan_data, chan, join=False):
+        if isinstance(chan_data, ChannelBlock):
+            xs, ys = chan_data.xs, chan_data.ys
+        else:
+            xs = array("d", [sample.x for sample in chan_data])
+            ys = array("d", [sample.y for sample in chan_data])
+        n = len(xs)
+        anchor = self._anchors[chan]
+        if anchor is not None:
+            # start from the last point kept of the previous block
+            xs, ys = _prepend(xs, anchor.x), _prepend(ys, anchor.y)
+        kept = self.method(xs, ys, self.tolerance)
+        if anchor is not None and not join:
+            kept = kept[1:]
+        if np is not None and isinstance(xs, np.ndarray):
+            xs, ys = xs[kept], ys[kept]
+        else:
+            xs = array("d", [xs[i] for i in kept])
+            ys = array("d", [ys[i] for i in kept])
+        if len(xs):
+            self._anchors[chan] = Point(xs[-1], ys[-1])
+        self.points_in += n
+        self.points_out += len(xs) - (anchor is not None and join)
+        if isinstance(chan_data, ChannelBlock):
+            return ChannelBlock(xs, ys)
+        return [Point(x, y) for x, y in zip(xs, ys)]
+
+
+def _prepend(seq, value):
+    if np is not None and isinstance(seq, np.ndarray):
+        return np.concatenate(([value], seq))
+    return array("d", [value]) + seq
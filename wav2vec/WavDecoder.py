@@ -1,20 +1,23 @@
 """
 This module defines the WavDecoder class, used to read WAV and AIFF files from
-disk and decode them into channel-separated integers.
+disk and decode them into channel-separated integers (or floats, for IEEE
+float files).
 """
 
 import logging
-import struct
+import sys
 import wave
+from array import array
 from collections import namedtuple
 
-# aifc was dropped with python 3.13 (see https://peps.python.org/pep-0594/)
-# but the package can still be pip installed (https://github.com/youknowone/python-deadlib)
-# pip3 install standard-aifc
+from .stats import clock
+
+# NumPy is optional: if it is available then `next_arrays()` decodes and scales
+# whole blocks at once, otherwise it falls back to the pure-Python path.
 try:
-    import aifc
+    import numpy as np
 except ImportError:
-    raise ImportError("Please install aifc with `pip install standard-aifc`")
+    np = None
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +30,53 @@ except NameError:
 
 Point = namedtuple("Point", ["x", "y"])
 
+# Map `struct_fmt_char` characters to the `array` typecodes of the same size
+# (24-bit samples are unpacked into 32-bit integers, see `_widen_24()`)
+_array_typecodes = {
+    "B": "B",
+    "b": "b",
+    "h": "h",
+    "i": "i" if array("i").itemsize == 4 else "l",
+    "3": "i" if array("i").itemsize == 4 else "l",
+    "f": "f",
+    "d": "d",
+}
+_native_endchar = "<" if sys.byteorder == "little" else ">"
+
+
+class ChannelBlock(object):
+    """
+    The decoded data for one channel of a block, stored column-wise: `xs` and
+    `ys` are contiguous buffers of floats (`array('d')` or NumPy arrays)
+    instead of a list of Point tuples, which takes roughly a tenth of the
+    memory.
+
+    For backward compatibility it behaves like a read-only list of Points:
+    indexing and iterating produce Points and slicing produces a new
+    ChannelBlock.
+    """
+
+    __slots__ = ("xs", "ys")
+
+    def __init__(self, xs, ys):
+        self.xs = xs
+        self.ys = ys
+
+    def __len__(self):
+        return len(self.xs)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ChannelBlock(self.xs[index], self.ys[index])
+        return Point(self.xs[index], self.ys[index])
+
+    def __iter__(self):
+        for x, y in zip(self.xs, self.ys):
+            yield Point(x, y)
+
+    def __repr__(self):
+        return "ChannelBlock(%d points)" % len(self)
+
 # The Python 2.7 version of the wave module does not use a namedtuple as the
 # return value of getparams(), so we define it here for cross-compatibility
 _wave_params = namedtuple(
@@ -75,12 +125,23 @@ class WavDecoder(object):
         bs=0,
         downtoss=1,
         signed=None,
+        use_numpy=None,
+        columnar=False,
+        peaks=False,
+        stats=None,
+        start=None,
+        end=None,
+        unit="frames",
+        prefetch=0,
+        length=None,
     ):
         """
         Args:
-            filename (str): Name of waveform file
+            filename (str): Name of waveform file (or a binary file object,
+                such as `sys.stdin.buffer` with `wav2vec.streamreader`)
             decoder_class (Class): either wave or aifc or a compatible class
-                name
+                name (such as `wav2vec.mmapreader`, which reads both WAV and
+                AIFF files through a memory map)
             endchar (str): the `struct.unpack()` character which determines
                 endianness of the data ('<' == little endian; '>' == big
                 endian).  Defaults to '<'. This should only need to be set
@@ -105,7 +166,47 @@ class WavDecoder(object):
             signed (bool): True to force PCM data to be treated as signed; False
                 to force data to be treated as unsigned. By default (None) data
                 will be treated as signed except in the case of 8-bit WAV which
-                is unsigned.
+                is unsigned. Float samples are always signed.
+            use_numpy (bool): True to decode with NumPy in `next_arrays()`;
+                False to always use the pure-Python path. By default (None)
+                NumPy is used if it can be imported.
+            columnar (bool): If True, `next()` returns a ChannelBlock for each
+                channel instead of a list of Points. ChannelBlocks index and
+                iterate like lists of Points but store the data compactly.
+                Defaults to False.
+            peaks (bool): If True, reduce the data to a peak envelope instead
+                of returning every sample: the frames are divided into `width`
+                columns and only the minimum and maximum sample of each column
+                (in the order they occur) are returned for each channel. This
+                keeps transients which `downtoss` would throw away, and the
+                output size depends only on the width. `downtoss` is ignored.
+                Defaults to False.
+            stats (Stats): If given, time the read, unpack and scale stages
+                and count the bytes read and frames decoded into this
+                `wav2vec.stats.Stats` object (formatters outputting this
+                decoder add their stages to it too). Defaults to None.
+            start (Number): Only decode from this position (in `unit`s from
+                the beginning of the file). `open()` seeks straight to it, and
+                the x values and `max_width` scaling are relative to it.
+                Defaults to None (the beginning of the file).
+            end (Number): Stop decoding at this position (in `unit`s from the
+                beginning of the file). Defaults to None (the end of the
+                file).
+            unit (str): 'frames' or 'seconds', the unit of `start` and `end`.
+                Defaults to 'frames'.
+            prefetch (int): If > 0 (and `bs` > 0), read up to this many blocks
+                ahead in a background thread, so that reading from disk
+                overlaps with decoding and formatting (see
+                `wav2vec.prefetch`). Defaults to 0 (read each block when it
+                is needed).
+            length (Number): The expected length of the input (in `unit`s)
+                if its header does not say how long it is, as with streams
+                from streaming encoders (see `wav2vec.streamreader`): x
+                values are scaled as if the input had this length, and blocks
+                are decoded as they arrive until the stream ends. Without
+                it, the rest of the stream is read before the first block is
+                decoded, so that it can be scaled by its real length.
+                Defaults to None.
         """
         self._filename = filename
         self.decoder = decoder_class
@@ -113,13 +214,37 @@ class WavDecoder(object):
         self.max_height = max_height
         self.bs = bs
         self._downtoss = downtoss
+        self._endchar = endchar
         if endchar is None:
-            if self.decoder == aifc:
+            # compared by name: aifc is only imported (by the caller) when an
+            # AIFF file is decoded
+            if getattr(self.decoder, "__name__", None) == "aifc":
                 # AIFF is encoded big-endian
                 self.endchar = ">"
             else:
                 self.endchar = "<"
+        else:
+            self.endchar = endchar
         self.signed = signed
+        if use_numpy is None:
+            use_numpy = np is not None
+        elif use_numpy and np is None:
+            raise ImportError("use_numpy requires NumPy: `pip install numpy`")
+        self.use_numpy = use_numpy
+        self.columnar = columnar
+        self.peaks = peaks
+        self.stats = stats
+        if unit not in ("frames", "seconds"):
+            raise ValueError("unit must be 'frames' or 'seconds'")
+        self.start = start
+        self.end = end
+        self.unit = unit
+        if prefetch < 0:
+            raise ValueError("prefetch must be >= 0")
+        self.prefetch = prefetch
+        self.length = length
+        if peaks and downtoss != 1:
+            logger.warning("downtoss is ignored when peaks is set")
         self._reset()
         logger.info("WavDecoder initialized for %s" % filename)
 
@@ -137,7 +262,11 @@ class WavDecoder(object):
 
     def _reset(self):
         self._wav_file = None
+        # the Prefetcher reading ahead from _wav_file (see `prefetch`)
+        self._prefetcher = None
         self.params = None
+        # 'int' for PCM samples or 'float' for IEEE float samples
+        self.sample_format = None
         self.width = None
         self.height = None
         self._samp_fmt = None
@@ -145,6 +274,27 @@ class WavDecoder(object):
         # We can't rely on the Wav_read.tell() because the docs say it is
         # implementation specific.
         self.index = None
+        # whether the block last returned by next() is the first/last one
+        self.first_block = False
+        self.last_block = False
+        # the selected range of frames [_first_frame, _end_frame) (see `start`
+        # and `end`)
+        self._first_frame = 0
+        self._end_frame = None
+        # the frame to stop reading at (None for the end of the file), and the
+        # amount subtracted from sample numbers before x-scaling; used by
+        # workers which decode part of the file (see wav2vec.parallel)
+        self._stop_index = None
+        self._x_shift = 0
+        # the column being accumulated and its partial extrema (peaks mode)
+        self._peak_col = 0
+        self._peak_acc = None
+        # whether the input's length is only estimated from `length` (it is
+        # then read until it ends, with the block after the current one read
+        # ahead into _lookahead to tell whether it is the last one)
+        self._streaming = False
+        self._lookahead = None
+        self._eof = False
 
     def open(self):
         """
@@ -154,14 +304,40 @@ class WavDecoder(object):
         wf = self.decoder.open(self._filename, "rb")
         self._wav_file = wf
         self.index = 0
-        self.params = _wave_params(*wf.getparams())
+        params = list(wf.getparams())
+        if params[3] is None:
+            # a stream whose header does not say how many frames it has
+            if self.length is None:
+                logger.debug("Reading the rest of the stream to scale it")
+                wf.spool()
+                params = list(wf.getparams())
+            else:
+                params[3] = self._to_frames(self.length, params[2])
+                self._streaming = True
+        self.params = _wave_params(*params)
+        if self._endchar is None and hasattr(wf, "getendchar"):
+            # readers which handle both WAV and AIFF (like mmapreader) know
+            # the endianness of the file they opened
+            self.endchar = wf.getendchar()
+        self.sample_format = "int"
+        if hasattr(wf, "getsampleformat"):
+            self.sample_format = wf.getsampleformat()
+        self._first_frame, self._end_frame = self._frame_range()
+        if self._first_frame > 0 or self._end_frame < self.params.nframes:
+            logger.debug("Decoding frames %d to %d"
+                         % (self._first_frame, self._end_frame))
+            self._seek_range(self._first_frame, self._end_frame)
+        nframes = self._end_frame - self._first_frame
         if self.max_width <= 0:
             # if max_width is set to 0 then use full width of waveform
-            self.width = self.params.nframes
+            self.width = nframes
         else:
-            self.width = min(self.max_width, self.params.nframes)
+            self.width = min(self.max_width, nframes)
 
-        if self.max_height <= 0:
+        if self.sample_format == "float":
+            # float samples are in [-1.0, 1.0]
+            self.height = 2 if self.max_height <= 0 else self.max_height
+        elif self.max_height <= 0:
             # If max-height is set at 0, then use full bitdepth
             self.height = 2 ** (self.params.sampwidth * 8) - 1
         else:
@@ -169,7 +345,9 @@ class WavDecoder(object):
         logger.debug("height set to %d" % self.height)
 
         if self.signed is None:
-            self.signed = (self.params.sampwidth == 1) and (self.decoder == wave)
+            is_wav = self.decoder == wave or (
+                hasattr(wf, "getfiletype") and wf.getfiletype() == "wav")
+            self.signed = (self.params.sampwidth == 1) and is_wav
 
         samp_fmt = self.struct_fmt_char
 
@@ -177,10 +355,40 @@ class WavDecoder(object):
         logger.debug("_samp_fmt set to %s" % self._samp_fmt)
         logger.info("Opened WavDecoder for %s" % self._filename)
 
+    def _frame_range(self):
+        """
+        Return the selected range of frames [first, end) of the open file,
+        according to `start`, `end` and `unit`.
+
+        Raises ValueError if the range is empty.
+        """
+        nframes = self.params.nframes
+        positions = []
+        for pos, default in ((self.start, 0), (self.end, nframes)):
+            if pos is None:
+                positions.append(default)
+                continue
+            pos = self._to_frames(pos, self.params.framerate)
+            positions.append(max(0, min(pos, nframes)))
+        first, end = positions
+        if first >= end and (self.start is not None or self.end is not None):
+            raise ValueError("The range from %s to %s %s is empty"
+                             % (self.start, self.end, self.unit))
+        return first, end
+
+    def _to_frames(self, pos, framerate):
+        """
+        Return the frame number of position `pos` (in `unit`s).
+        """
+        if self.unit == "seconds":
+            return int(round(pos * framerate))
+        return int(pos)
+
     def close(self):
         """
         Close and reset decoder and underlying wave file.
         """
+        self._stop_prefetch()
         self._wav_file.close()
         self._reset()
 
@@ -188,21 +396,43 @@ class WavDecoder(object):
         """
         Scale `x` according to `max_width`
         """
-        # (explicit cast to float needed for Python2)
-        return x * min(1.0, float(self.width) / self.params.nframes)
+        return x * self._x_scale()
 
     def scale_y(self, y):
         """
         Scale 'y' according to `max_height`
         """
+        offset, scale = self._y_transform()
+        if offset:
+            # 8-bit wav files are unsigned
+            y -= offset
+        return y * scale
+
+    def _y_transform(self):
+        """
+        Return the (offset, scale) pair used by `scale_y()`: the offset is
+        subtracted from unsigned samples before they are multiplied by scale.
+        """
         sampwidth = self.params.sampwidth
+        if self.sample_format == "float":
+            return 0, self.height * 0.5
         bitdepth = sampwidth * 8
+        if sampwidth == 3:
+            # 24-bit samples are unpacked into the top 3 bytes of an int32
+            bitdepth = 32
         divisor = 2 ** (bitdepth - 1)
         scale = (self.height * 0.5) / divisor
         if sampwidth == 1 and not self.signed:
-            # 8-bit wav files are unsigned
-            y -= divisor
-        return y * scale
+            return divisor, scale
+        return 0, scale
+
+    def _x_scale(self):
+        """
+        Return the factor `scale_x()` multiplies sample numbers by.
+        """
+        # (explicit cast to float needed for Python2)
+        return min(1.0, float(self.width) /
+                   (self._end_frame - self._first_frame))
 
     @property
     def struct_fmt_char(self):
@@ -214,13 +444,25 @@ class WavDecoder(object):
             - 8-bit unsigned WAV
             - 8-bit signed AIFF
             - 16-bit signed WAV (little endian)and AIFF (big endian)
+            - 24-bit signed WAV and AIFF ('3', which is not a `struct`
+              character: the samples are widened to 32 bits by `_unpack()`)
             - 32-bit signed WAV (little endian)and AIFF (big endian)
+            - 32- and 64-bit IEEE float WAV and AIFF-C ('f' and 'd'; only
+              with readers which support them, such as `wav2vec.mmapreader`)
 
         Raises ValueError if `filename` is not a supported file type.
 
         see: https://docs.python.org/library/struct.html
         """
         sampwidth = self.params.sampwidth
+        if self.sample_format == "float":
+            if sampwidth == 4:
+                logger.info("32-bit float ('f')")
+                return "f"
+            elif sampwidth == 8:
+                logger.info("64-bit float ('d')")
+                return "d"
+            raise ValueError("Unsupported file type.")
         if sampwidth == 1 and not self.signed:
             logger.info("unsigned 8-bit ('B')")
             return "B"
@@ -230,21 +472,47 @@ class WavDecoder(object):
         elif sampwidth == 2:
             logger.info("signed 16-bit ('h')")
             return "h"
+        elif sampwidth == 3:
+            logger.info("signed 24-bit ('3')")
+            return "3"
         elif sampwidth == 4:
             logger.info("signed 32-bit ('h')")
             return "i"
         else:
             raise ValueError("Unsupported file type.")
 
-    def next(self):
+    @property
+    def numpy_dtype(self):
         """
-        Read and decode the next bs frames and return channel-separated data.
+        The NumPy dtype string equivalent to `struct_fmt_char` (including
+        endianness), used to decode sample bytes with `np.frombuffer()`.
+        """
+        kinds = {"B": "u1", "b": "i1", "h": "i2", "i": "i4", "3": "i4",
+                 "f": "f4", "d": "f8"}
+        return self.endchar + kinds[self._samp_fmt]
 
-        Returns data as a list of Points for each channel:
-        [
-         [Point(x=1, y=4), ...] # chan 1
-         [Point(x=3, y=435), ..] # chan 2
-        ]
+    def _frombuffer(self, wav_bytes, count):
+        """
+        Decode `count` samples from raw bytes into a NumPy array (24-bit
+        samples are widened like in `_unpack()`).
+        """
+        if self._samp_fmt == "3":
+            packed = np.frombuffer(wav_bytes, dtype=np.uint8, count=count * 3)
+            wide = np.zeros((count, 4), dtype=np.uint8)
+            if self.endchar == "<":
+                wide[:, 1:] = packed.reshape(count, 3)
+            else:
+                wide[:, :3] = packed.reshape(count, 3)
+            return wide.view(self.numpy_dtype).reshape(count)
+        return np.frombuffer(wav_bytes, dtype=self.numpy_dtype, count=count)
+
+    def _read_block(self):
+        """
+        Read the next bs frames (or all frames if bs == 0) from the underlying
+        file.
+
+        Returns a tuple of (wav_bytes, frames). Raises StopIteration once all
+        frames have been read.
         """
         if self._wav_file is None:
             # Likely user didn't open(), do it for them:
@@ -255,29 +523,163 @@ class WavDecoder(object):
                 )
             )
             self.open()
+        if self._streaming:
+            # read until the stream (or the selected range) ends
+            return self._read_stream_block(self._stop_index)
         p = self.params
+        stop = p.nframes if self._stop_index is None else self._stop_index
         if self.bs == 0:
             # Read all frames into memory if bs == 0:
-            frames = p.nframes
+            frames = stop - self.index
         else:
-            frames = self.bs
-        next_index = self.index + frames
-
-        # check bounds
-        if next_index > p.nframes:
-            frames = p.nframes - self.index
+            # check bounds
+            frames = min(self.bs, stop - self.index)
+        if frames <= 0:
+            logger.debug("No more frames")
+            raise StopIteration
+
+        stats = self.stats
+        if stats is not None:
+            t = clock()
+        if self.prefetch > 0 and self.bs > 0:
+            wav_bytes, frames = self._prefetched(self.index, stop).get()
+        else:
+            wav_bytes = self._wav_file.readframes(frames)
+        if stats is not None:
+            stats.time("read", clock() - t)
+            stats.count("bytes_read", len(wav_bytes))
+            stats.count("frames_decoded", frames)
+        logger.debug("Read %d frames", frames)
+        return wav_bytes, frames
+
+    def _read_stream_block(self, stop):
+        """
+        Return the next (wav_bytes, frames) of a stream of unknown length
+        (up to frame `stop` if it is not None), and read the block after it
+        ahead to set `_eof` if there is none.
+        """
+        position = self.index
+        if self._lookahead is None:
+            self._lookahead = self._read_stream(position, stop)
+        wav_bytes, frames = self._lookahead
+        if frames == 0:
+            raise StopIteration
+        self._lookahead = self._read_stream(position + frames, stop)
+        self._eof = self._lookahead[1] == 0
+        return wav_bytes, frames
+
+    def _read_stream(self, position, stop):
+        """
+        Read the block of a stream of unknown length which starts at frame
+        `position` and return (wav_bytes, frames), with 0 frames at the end.
+        """
+        frames = self.bs or sys.maxsize
+        if stop is not None:
+            frames = min(frames, stop - position)
             if frames <= 0:
-                logger.debug("No more frames")
-                raise StopIteration
+                return b"", 0
+        stats = self.stats
+        if stats is not None:
+            t = clock()
+        if self.prefetch > 0 and self.bs > 0:
+            # (streams are read as bytes, never into the Prefetcher's
+            # recycled buffers, so the block read ahead cannot overwrite the
+            # current one)
+            try:
+                wav_bytes = self._prefetched(position, stop).get()[0]
+            except StopIteration:
+                wav_bytes = b""
+        else:
+            wav_bytes = self._wav_file.readframes(frames)
+        frames = len(wav_bytes) // (self.params.nchannels *
+                                    self.params.sampwidth)
+        if stats is not None:
+            stats.time("read", clock() - t)
+            stats.count("bytes_read", len(wav_bytes))
+            stats.count("frames_decoded", frames)
+        logger.debug("Read %d frames", frames)
+        return wav_bytes, frames
+
+    def _prefetched(self, position, stop):
+        """
+        Return the Prefetcher reading the blocks from `position` to `stop`
+        (None for the end of a stream), starting a new one if there is none
+        yet or the position, block size or stop changed since it was started.
+        """
+        pf = self._prefetcher
+        if pf is not None and (pf.position != position or pf.bs != self.bs
+                               or pf.stop != stop):
+            self._stop_prefetch()
+            pf = None
+        if pf is None:
+            # imported lazily: most decoders never start a thread
+            from .prefetch import Prefetcher
+
+            framesize = self.params.nchannels * self.params.sampwidth
+            pf = Prefetcher(self._wav_file, position, stop, self.bs,
+                            self.prefetch, framesize)
+            self._prefetcher = pf
+        return pf
+
+    def _stop_prefetch(self):
+        """
+        Stop reading ahead (before using `_wav_file` directly).
+        """
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+            self._prefetcher = None
+
+    def _unpack(self, wav_bytes, frames):
+        """
+        Decode raw interleaved sample bytes into a flat array of integers.
+
+        This is equivalent to `struct.unpack()` with `struct_fmt_char`, but the
+        result is a compact `array` (one machine integer per sample) rather
+        than a tuple of Python ints. 24-bit samples are shifted into the top 3
+        bytes of 32-bit integers (i.e. multiplied by 256).
+        """
+        stats = self.stats
+        if stats is not None:
+            t = clock()
+        typecode = _array_typecodes[self._samp_fmt]
+        data = array(typecode)
+        if self._samp_fmt == "3":
+            wav_bytes = _widen_24(wav_bytes, self.endchar)
+        _array_frombytes(data, wav_bytes)
+        if data.itemsize > 1 and _native_endchar != self.endchar:
+            data.byteswap()
+        if stats is not None:
+            stats.time("unpack", clock() - t)
+        return data
+
+    def next(self):
+        """
+        Read and decode the next bs frames and return channel-separated data.
 
-        wav_bytes = self._wav_file.readframes(frames)
-        logger.debug("Read %d frames" % frames)
-        fmt = self._samp_fmt
-        fmt_str = "%s%d%s" % (self.endchar, p.nchannels * frames, fmt)
-        data = struct.unpack(fmt_str, wav_bytes)
+        Returns data as a list of Points for each channel:
+        [
+         [Point(x=1, y=4), ...] # chan 1
+         [Point(x=3, y=435), ..] # chan 2
+        ]
+
+        If `columnar` is set, each channel is instead a ChannelBlock (which
+        behaves like a list of Points).
+        """
+        if self.columnar:
+            return [ChannelBlock(xs, ys) for xs, ys in self.next_arrays()]
+        if self.peaks:
+            return [[Point(x, y) for x, y in zip(xs, ys)]
+                    for xs, ys in self.next_arrays()]
+        wav_bytes, frames = self._read_block()
+        first_index = self.index
+        p = self.params
+        data = self._unpack(wav_bytes, frames)
+        stats = self.stats
+        if stats is not None:
+            t = clock()
 
         # Extract the tuples of integers into a list of Points for each channel:
-        start = self.index + 1
+        start = self.index - self._first_frame - self._x_shift + 1
         sep_data = []
         for chan in xrange(0, p.nchannels):
             chan_data = data[chan :: p.nchannels]
@@ -289,8 +691,282 @@ class WavDecoder(object):
                 y = self.scale_y(sample)
                 chan_points.append(Point(x, y))
             sep_data.append(chan_points)
+        if stats is not None:
+            stats.time("scale", clock() - t)
         self.index += frames
+        self._mark_block(first_index)
         return sep_data
 
     # alias for python3-style iterators:
     __next__ = next
+
+    def next_arrays(self):
+        """
+        Read and decode the next bs frames like `next()`, but return the
+        scaled data as a pair of x and y arrays for each channel instead of as
+        lists of Points:
+        [
+         (xs, ys), # chan 1
+         (xs, ys), # chan 2
+        ]
+
+        If `use_numpy` is set the arrays are float64 NumPy arrays computed
+        with whole-array operations; otherwise they are `array('d')` buffers.
+        The values are the same either way.
+        """
+        if self.peaks:
+            return self._next_peaks()
+        wav_bytes, frames = self._read_block()
+        first_index = self.index
+        start = self.index - self._first_frame - self._x_shift + 1
+        if self.use_numpy:
+            sep_data = self._decode_numpy(wav_bytes, frames, start)
+        else:
+            sep_data = self._decode_python(wav_bytes, frames, start)
+        self.index += frames
+        self._mark_block(first_index)
+        return sep_data
+
+    def _seek_range(self, start, stop, x_shift=0):
+        """
+        Restrict an open decoder to the frames [start, stop), and subtract
+        `x_shift` from sample numbers before x-scaling them.
+        """
+        self._stop_prefetch()
+        self._lookahead = None
+        self._wav_file.setpos(start)
+        self.index = start
+        self._stop_index = stop
+        self._x_shift = x_shift
+
+    def _mark_block(self, first_index):
+        """
+        Record whether the block which started at frame `first_index` (and
+        ended at the current index) is the first and/or last block.
+        """
+        self.first_block = first_index == self._first_frame
+        self.last_block = self._exhausted()
+
+    def _exhausted(self):
+        """
+        True if every frame has been decoded.
+        """
+        if self._streaming:
+            return self._eof
+        return self.index >= self._end_frame
+
+    def _decode_python(self, wav_bytes, frames, start):
+        p = self.params
+        data = self._unpack(wav_bytes, frames)
+        stats = self.stats
+        if stats is not None:
+            t = clock()
+        x_scale = self._x_scale()
+        offset, scale = self._y_transform()
+        sep_data = []
+        for chan in xrange(0, p.nchannels):
+            chan_data = data[chan :: p.nchannels][:: self._downtoss]
+            xs = array("d", ((i + start) * x_scale
+                             for i in xrange(len(chan_data))))
+            ys = array("d", ((sample - offset) * scale
+                             for sample in chan_data))
+            sep_data.append((xs, ys))
+        if stats is not None:
+            stats.time("scale", clock() - t)
+        return sep_data
+
+    def _decode_numpy(self, wav_bytes, frames, start):
+        p = self.params
+        stats = self.stats
+        if stats is not None:
+            t = clock()
+        data = self._frombuffer(wav_bytes, frames * p.nchannels)
+        # de-interleave into one column per channel, then downsample:
+        data = data.reshape(frames, p.nchannels)[:: self._downtoss]
+        if stats is not None:
+            t2 = clock()
+            stats.time("unpack", t2 - t)
+            t = t2
+        offset, scale = self._y_transform()
+        ys = data.astype(np.float64)
+        if offset:
+            ys -= offset
+        ys *= scale
+        xs = np.arange(ys.shape[0], dtype=np.float64)
+        xs += start
+        xs *= self._x_scale()
+        sep_data = [(xs, np.ascontiguousarray(ys[:, chan]))
+                    for chan in xrange(0, p.nchannels)]
+        if stats is not None:
+            stats.time("scale", clock() - t)
+        return sep_data
+
+    def _column_start(self, col):
+        """
+        Return the first frame which belongs to column `col` in peaks mode.
+        """
+        # ceil(col * nframes / width) without floating point error
+        nframes = self._end_frame - self._first_frame
+        return self._first_frame + -(-col * nframes // self.width)
+
+    def _split_channels(self, wav_bytes, frames):
+        """
+        Decode raw bytes and return one (unscaled) sequence per channel.
+        """
+        nchannels = self.params.nchannels
+        if self.use_numpy:
+            stats = self.stats
+            if stats is not None:
+                t = clock()
+            data = self._frombuffer(wav_bytes, frames * nchannels)
+            data = data.reshape(frames, nchannels)
+            if stats is not None:
+                stats.time("unpack", clock() - t)
+            return [data[:, chan] for chan in xrange(0, nchannels)]
+        data = self._unpack(wav_bytes, frames)
+        return [data[chan::nchannels] for chan in xrange(0, nchannels)]
+
+    def _next_peaks(self):
+        """
+        Read blocks until at least one column of the peak envelope is complete
+        and return the min/max Points of all completed columns as a pair of x
+        and y arrays for each channel.
+        """
+        wav_bytes, frames = self._read_block()
+        first_index = self.index
+        nchannels = self.params.nchannels
+        xs = [array("d") for chan in xrange(0, nchannels)]
+        ys = [array("d") for chan in xrange(0, nchannels)]
+        stats = self.stats
+        while True:
+            chans = self._split_channels(wav_bytes, frames)
+            if stats is not None:
+                t = clock()
+            block_end = self.index + frames
+            pos = self.index
+            while pos < block_end:
+                col_end = self._column_start(self._peak_col + 1)
+                seg_end = min(col_end, block_end)
+                self._accumulate_peaks(chans, pos - self.index,
+                                       seg_end - self.index, pos)
+                pos = seg_end
+                if pos == col_end:
+                    self._emit_peaks(xs, ys)
+            if stats is not None:
+                stats.time("scale", clock() - t)
+            self.index = block_end
+            if self._streaming and self._eof and self._peak_acc is not None:
+                # the stream ended before its expected length, in the middle
+                # of a column
+                self._emit_peaks(xs, ys)
+            if xs[0] or self._exhausted():
+                break
+            wav_bytes, frames = self._read_block()
+        self._mark_block(first_index)
+        if self.use_numpy:
+            return [(np.asarray(x), np.asarray(y)) for x, y in zip(xs, ys)]
+        return list(zip(xs, ys))
+
+    def _accumulate_peaks(self, chans, start, end, offset):
+        """
+        Merge the extrema of chans[*][start:end] into the current column.
+        """
+        acc = self._peak_acc
+        if acc is None:
+            acc = self._peak_acc = [None] * len(chans)
+        for chan, chan_data in enumerate(chans):
+            vmin, imin, vmax, imax = _extrema(chan_data[start:end])
+            imin += offset
+            imax += offset
+            old = acc[chan]
+            if old is not None:
+                # earlier samples win ties
+                if old[0] <= vmin:
+                    vmin, imin = old[0], old[1]
+                if old[2] >= vmax:
+                    vmax, imax = old[2], old[3]
+            acc[chan] = (vmin, imin, vmax, imax)
+
+    def _emit_peaks(self, xs, ys):
+        """
+        Append the min and max of the completed column to xs and ys and start
+        the next column.
+        """
+        x = self._peak_col + 1
+        offset, scale = self._y_transform()
+        for chan, (vmin, imin, vmax, imax) in enumerate(self._peak_acc):
+            if imin == imax:
+                samples = (vmin,)
+            elif imin < imax:
+                samples = (vmin, vmax)
+            else:
+                samples = (vmax, vmin)
+            for sample in samples:
+                xs[chan].append(x)
+                ys[chan].append((sample - offset) * scale)
+        self._peak_acc = None
+        self._peak_col += 1
+
+
+def _as_bytes(data):
+    """
+    Return a bytes copy of `data` (bytes, bytearray or memoryview).
+    """
+    if isinstance(data, memoryview):
+        # on Python 2 bytes() of a memoryview is its repr
+        return data.tobytes()
+    return bytes(data)
+
+
+def _array_frombytes(values, data):
+    """
+    Append the machine values in `data` to the array `values`.
+    """
+    try:
+        frombytes = values.frombytes
+    except AttributeError:
+        # Python 2 arrays only have fromstring()
+        values.fromstring(_as_bytes(data))
+    else:
+        frombytes(data)
+
+
+def _array_tobytes(values):
+    """
+    Return the machine representation of the array `values` as bytes.
+    """
+    try:
+        tobytes = values.tobytes
+    except AttributeError:
+        # Python 2 arrays only have tostring()
+        return values.tostring()
+    return tobytes()
+
+
+def _widen_24(wav_bytes, endchar):
+    """
+    Return packed 24-bit samples as 32-bit integers of the same endianness,
+    with each sample in the top 3 bytes (so the sign is preserved), using
+    slice assignment instead of converting sample by sample.
+    """
+    packed = _as_bytes(wav_bytes)
+    wide = bytearray(len(packed) // 3 * 4)
+    # the zero low byte comes first in little-endian and last in big-endian
+    first = 1 if endchar == "<" else 0
+    for i in xrange(3):
+        wide[first + i :: 4] = packed[i::3]
+    return wide
+
+
+def _extrema(seq):
+    """
+    Return (min, index of min, max, index of max) of a non-empty sequence,
+    using the first occurrence of ties.
+    """
+    if np is not None and isinstance(seq, np.ndarray):
+        imin = int(seq.argmin())
+        imax = int(seq.argmax())
+        return seq[imin].item(), imin, seq[imax].item(), imax
+    vmin = min(seq)
+    vmax = max(seq)
+    return vmin, seq.index(vmin), vmax, seq.index(vmax)
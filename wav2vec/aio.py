@@ -0,0 +1,204 @@
+"""
+This module lets asyncio programs decode and format files without blocking
+the event loop (Python 3.7+). The blocking work (reading from disk, decoding
+and formatting) runs in an executor one block at a time, so many renders can
+interleave on one loop, and output is written to an `asyncio.StreamWriter`
+with `drain()` after every block, so a slow reader slows down the render
+instead of letting output pile up in memory.
+
+AsyncWavDecoder is a WavDecoder which can be used with `async with` and
+`async for`:
+    >>> async with AsyncWavDecoder('filename', bs=4096) as wd:
+    ...     async for block in wd:
+    ...         print(block)
+
+`Formatter.output_async()` (which calls `output()` in this module) writes the
+formatted output to a StreamWriter:
+    >>> await SVGFormatter(WavDecoder('filename', bs=4096)).output_async(writer)
+"""
+
+import asyncio
+import functools
+import logging
+
+from .WavDecoder import WavDecoder
+from .formatter.Formatter import (DEFAULT_BUFSIZE, DEFAULT_SPOOL_SIZE,
+                                  ChannelSpools, OutputBuffer)
+from .stats import clock
+
+logger = logging.getLogger(__name__)
+
+# returned by the executor instead of raising StopIteration (which cannot be
+# raised through a future)
+_END = object()
+
+
+def _next_block(decoder):
+    try:
+        return next(decoder)
+    except StopIteration:
+        return _END
+
+
+class AsyncWavDecoder(object):
+    """
+    An asynchronous wrapper around a WavDecoder (or a decoder proxy such as a
+    PeakDecoder): `open()`, `close()` and `next()` are coroutines which run
+    the decoder's methods in `executor` (the loop's default executor if
+    None). Other attributes (params, first_block, ...) are the decoder's.
+    """
+
+    def __init__(self, decoder, executor=None, **kwargs):
+        """
+        Args:
+            decoder (WavDecoder): the decoder to wrap, or a file name to
+                create a WavDecoder for (with `kwargs`)
+            executor (Executor): where to run the blocking work
+        """
+        if not hasattr(decoder, "next"):
+            decoder = WavDecoder(decoder, **kwargs)
+        self.decoder = decoder
+        self.executor = executor
+
+    def __getattr__(self, name):
+        return getattr(self.decoder, name)
+
+    def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self.executor,
+                                    functools.partial(func, *args))
+
+    async def open(self):
+        await self._run(self.decoder.open)
+
+    async def close(self):
+        await self._run(self.decoder.close)
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def next(self):
+        """
+        Return the next block, like `WavDecoder.next()`. Raises
+        StopAsyncIteration after the last block.
+        """
+        block = await self._run(_next_block, self.decoder)
+        if block is _END:
+            raise StopAsyncIteration
+        return block
+
+    __anext__ = next
+
+
+class _Chunks(object):
+    """
+    A binary file which collects everything written to it, for an
+    OutputBuffer filled in the executor and emptied on the loop.
+    """
+
+    mode = "wb"
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def take(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+class _ThreadSink(object):
+    """
+    A binary file which is written to from the executor and writes to
+    `writer` on `loop`, waiting for it to drain (for output which is too
+    large to collect in memory, like the contents of spools).
+    """
+
+    mode = "wb"
+
+    def __init__(self, writer, loop):
+        self.writer = writer
+        self.loop = loop
+
+    def write(self, data):
+        asyncio.run_coroutine_threadsafe(self._write(data), self.loop).result()
+
+    async def _write(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+
+async def output(formatter, writer, bufsize=DEFAULT_BUFSIZE, spool=None,
+                 executor=None):
+    """
+    Write the output of `formatter` to `writer` (an `asyncio.StreamWriter`,
+    or any object with `write()` and a coroutine `drain()`) like
+    `Formatter.output()`.
+
+    Each block is decoded and formatted in `executor` (the loop's default
+    executor if None) and the output collected so far is written (at least
+    `bufsize` characters at a time) and drained before the next block.
+    Since `writer` is not seekable, formatters which patch their output
+    afterwards (like NPY) raise IOError if they would need to.
+    """
+    loop = asyncio.get_running_loop()
+
+    def run(func, *args):
+        return loop.run_in_executor(executor, functools.partial(func, *args))
+
+    async def send():
+        chunks = sink.take()
+        if chunks:
+            for chunk in chunks:
+                writer.write(chunk)
+            await writer.drain()
+
+    decoder = formatter.decoder
+    stats = getattr(decoder, "stats", None)
+    if stats is not None:
+        started = clock()
+    sink = _Chunks()
+    out = OutputBuffer(sink, bufsize, stats)
+    spools = None
+    if formatter.contiguous and spool is None:
+        spool = DEFAULT_SPOOL_SIZE
+
+    def step():
+        block = _next_block(decoder)
+        if block is _END:
+            return False
+        formatter._write_block(block, out, spools, stats)
+        return True
+
+    await run(decoder.open)
+    try:
+        if spool is not None and decoder.bs:
+            spools = ChannelSpools(spool, formatter.binary)
+        out.write(formatter.doc_front_matter(decoder.params))
+        while await run(step):
+            await send()
+        if spools is not None:
+            out.flush()
+            await send()
+            # the spools are written straight from the executor
+            spool_out = OutputBuffer(_ThreadSink(writer, loop), bufsize, stats)
+            await run(spools.write_to, formatter, spool_out, bufsize)
+            await run(spool_out.flush)
+        out.write(formatter.doc_end_matter(decoder.params))
+        out.flush()
+        await send()
+    finally:
+        await run(decoder.close)
+    formatter.patch_output(writer, None)
+    if stats is not None:
+        stats.time("total", clock() - started)
+        stats.finish()
@@ -0,0 +1,394 @@
+"""
+This module caches rendered output, so that converting the same file with the
+same options again only costs a lookup. A RenderCache has two tiers: an
+in-memory LRU (per process) and an optional directory on disk which can be
+shared by many processes (it is capped in size, and entries are evicted least
+recently used first or when they are older than a TTL).
+
+Entries are keyed by the identity of the source file (its size, mtime and
+inode, or a hash of its content) and by every option which affects the
+output: the decoder's and formatter's parameters and the compression.
+    >>> cache = RenderCache("/var/cache/wav2vec", max_size=2**30)
+    >>> cache.output(SVGFormatter(WavDecoder('filename')), outfile)
+"""
+
+import errno
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows: eviction is then not serialized between
+    # processes (which is still safe, only wasteful)
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# bump to invalidate existing entries when the output format changes
+CACHE_VERSION = 1
+
+DEFAULT_MEMORY_SIZE = 64 * 2**20
+DEFAULT_DISK_SIZE = 512 * 2**20
+
+# the attributes of each decoder layer which affect the output
+_layer_options = {
+    "WavDecoder": ("max_width", "max_height", "bs", "_downtoss", "_endchar",
+                   "signed", "use_numpy", "peaks", "start", "end", "unit"),
+    "PeakDecoder": ("base_bucket", "rms"),
+    "Simplifier": ("tolerance", "method"),
+}
+
+_HASH_CHUNK = 2**20
+
+# atomically replace a file (os.rename does not on Windows; Python 2 has no
+# os.replace)
+_replace = getattr(os, "replace", os.rename)
+
+
+def source_identity(filename, hash_content=False):
+    """
+    Return a dict which identifies the content of `filename`: its size, mtime
+    and inode (cheap, but changes when the file is copied), or the SHA-256 of
+    its content if `hash_content` is set.
+    """
+    if hash_content:
+        digest = hashlib.sha256()
+        with io.open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+                digest.update(chunk)
+        return dict(sha256=digest.hexdigest())
+    st = os.stat(filename)
+    mtime = getattr(st, "st_mtime_ns", int(st.st_mtime * 1e9))
+    return dict(size=st.st_size, mtime=mtime, inode=st.st_ino,
+                device=st.st_dev)
+
+
+def render_key(formatter, hash_content=False, compress=None,
+               compresslevel=None, spool=None):
+    """
+    Return the cache key (a hex digest) for the output of `formatter` with
+    the given compression and spooling (see `Formatter.output()`).
+    """
+    layers = []
+    decoder = formatter.decoder
+    while True:
+        name = type(decoder).__name__
+        options = _layer_options.get(name)
+        if options is None:
+            raise ValueError("Cannot cache output of a %s" % name)
+        layers.append([name] + [_option_value(getattr(decoder, option))
+                                for option in options])
+        if name == "WavDecoder":
+            break
+        decoder = decoder.decoder
+    # streamed multi-channel output is one path per channel when spooled and
+    # one per block otherwise (the spool size does not change the output)
+    spooled = bool(decoder.bs) and (spool is not None or formatter.contiguous)
+    description = dict(
+        version=CACHE_VERSION,
+        source=source_identity(decoder._filename, hash_content),
+        decoder=layers,
+        formatter=[type(formatter).__name__, formatter.backend,
+                   getattr(formatter, "precision", None)],
+        compress=[compress, compresslevel],
+        spooled=spooled,
+    )
+    data = json.dumps(description, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def _option_value(value):
+    """
+    Return `value` in a form which can be encoded as JSON (functions, such as
+    a Simplifier's method, by their name).
+    """
+    if callable(value):
+        return "%s.%s" % (value.__module__, value.__name__)
+    return value
+
+
+class MemoryCache(object):
+    """
+    A thread-safe LRU mapping of keys to bytes, holding at most `max_size`
+    bytes of values.
+    """
+
+    def __init__(self, max_size=DEFAULT_MEMORY_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.pop(key, None)
+            if data is not None:
+                # re-insert as the most recently used entry
+                self._entries[key] = data
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_size:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class DiskCache(object):
+    """
+    A directory of cached outputs which can be shared by several processes.
+
+    Entries are written to a temporary file and renamed into place, so
+    readers never see partial entries. Reading an entry updates its access
+    time, and the least recently accessed entries are evicted when the total
+    size exceeds `max_size`. Entries older than `ttl` seconds are treated as
+    missing and evicted. Eviction holds an exclusive lock on a lock file in
+    the directory (where `fcntl` is available).
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_DISK_SIZE, ttl=None):
+        """
+        Args:
+            directory (str): where to store the entries (created if needed)
+            max_size (int): the maximum total size of the entries in bytes
+            ttl (Number): the maximum age of an entry in seconds (None for no
+                limit)
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                # another process may have created it
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _expired(self, st, now):
+        return self.ttl is not None and now - st.st_mtime > self.ttl
+
+    def get(self, key):
+        """
+        Return the entry for `key`, or None if there is none (or it expired).
+        """
+        path = self._path(key)
+        try:
+            with io.open(path, "rb") as f:
+                st = os.fstat(f.fileno())
+                now = time.time()
+                if self._expired(st, now):
+                    return None
+                data = f.read()
+            # the mtime is the creation time (for the TTL), the atime the
+            # time of the last use (for LRU eviction)
+            os.utime(path, (now, st.st_mtime))
+        except (IOError, OSError):
+            # missing, or evicted by another process in the meantime
+            return None
+        return data
+
+    def put(self, key, data):
+        """
+        Store `data` as the entry for `key` and evict entries as needed.
+        """
+        if len(data) > self.max_size:
+            return
+        path = self._path(key)
+        subdir = os.path.dirname(path)
+        if not os.path.isdir(subdir):
+            try:
+                os.makedirs(subdir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        fd, tmp_path = tempfile.mkstemp(dir=subdir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            _replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self.evict()
+
+    def _entries(self):
+        """
+        Yield (path, stat) for every entry.
+        """
+        for subdir in os.listdir(self.directory):
+            subdir = os.path.join(self.directory, subdir)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                if name.startswith(".tmp-"):
+                    continue
+                path = os.path.join(subdir, name)
+                try:
+                    yield path, os.stat(path)
+                except OSError:
+                    continue
+
+    def evict(self):
+        """
+        Remove expired entries, then the least recently used entries until
+        the total size is at most `max_size`.
+        """
+        with _FileLock(os.path.join(self.directory, ".lock")):
+            now = time.time()
+            entries = []
+            total = 0
+            for path, st in self._entries():
+                if self._expired(st, now):
+                    _remove(path)
+                    continue
+                entries.append((st.st_atime, st.st_size, path))
+                total += st.st_size
+            entries.sort()
+            for atime, size, path in entries:
+                if total <= self.max_size:
+                    break
+                _remove(path)
+                total -= size
+
+    def clear(self):
+        with _FileLock(os.path.join(self.directory, ".lock")):
+            for path, st in list(self._entries()):
+                _remove(path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        # already removed by another process
+        pass
+
+
+class _FileLock(object):
+    """
+    An exclusive lock between processes, held while in the `with` block.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = io.open(self.path, "ab")
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class RenderCache(object):
+    """
+    Caches the output of `Formatter.output()` in memory and, if a
+    `directory` is given, on disk.
+
+    Use `output()` in place of `Formatter.output()`. A hit writes the cached
+    bytes to the output file without opening the source file (apart from a
+    stat, or reading it to hash it with `hash_content`).
+    """
+
+    def __init__(self, directory=None, max_size=DEFAULT_DISK_SIZE, ttl=None,
+                 memory_size=DEFAULT_MEMORY_SIZE, hash_content=False):
+        """
+        Args:
+            directory (str): the directory of the disk tier (None to only
+                cache in memory)
+            max_size (int): the size cap of the disk tier in bytes
+            ttl (Number): the maximum age of disk entries in seconds (None
+                for no limit)
+            memory_size (int): the size cap of the memory tier in bytes (0
+                to disable it)
+            hash_content (bool): key entries by a hash of the source file's
+                content instead of its size, mtime and inode
+        """
+        self.memory = MemoryCache(memory_size) if memory_size > 0 else None
+        self.disk = None
+        if directory is not None:
+            self.disk = DiskCache(directory, max_size, ttl)
+        self.hash_content = hash_content
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Return the cached output for `key` or None.
+        """
+        if self.memory is not None:
+            data = self.memory.get(key)
+            if data is not None:
+                return data
+        if self.disk is not None:
+            data = self.disk.get(key)
+            if data is not None:
+                if self.memory is not None:
+                    self.memory.put(key, data)
+                return data
+        return None
+
+    def put(self, key, data):
+        if self.memory is not None:
+            self.memory.put(key, data)
+        if self.disk is not None:
+            self.disk.put(key, data)
+
+    def output(self, formatter, outfile, **kwargs):
+        """
+        Write the output of `formatter` to `outfile` (a binary file) like
+        `formatter.output(outfile, **kwargs)`, from the cache if possible.
+
+        On a miss the whole output is rendered into memory before it is
+        written. Returns True on a cache hit.
+        """
+        key = render_key(formatter, self.hash_content,
+                         kwargs.get("compress"), kwargs.get("compresslevel"),
+                         kwargs.get("spool"))
+        data = self.get(key)
+        if data is not None:
+            logger.debug("Cache hit for %s" % key)
+            self.hits += 1
+            outfile.write(data)
+            return True
+        logger.debug("Cache miss for %s" % key)
+        self.misses += 1
+        buf = io.BytesIO()
+        formatter.output(buf, **kwargs)
+        data = buf.getvalue()
+        self.put(key, data)
+        outfile.write(data)
+        return False
@@ -0,0 +1,183 @@
+"""
+This module writes compressed output: a CompressedWriter is a binary file-like
+object which compresses everything written to it (with gzip, bzip2, xz or
+zstd) in a background thread and writes the result to another file.
+
+The stdlib compressors release the GIL while they work, so formatting and
+compression run on separate cores. Use it through `Formatter.output()`:
+    >>> SVGFormatter(wd).output(outfile, compress="gzip")
+"""
+
+import io
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    # Python 2
+    import Queue as queue
+
+logger = logging.getLogger(__name__)
+
+# file name extensions of the compressed output (by method)
+extensions = {
+    "gzip": "gz",
+    "bz2": "bz2",
+    "xz": "xz",
+    "zstd": "zst",
+}
+
+# compressed formats which have their own extension (by format extension)
+_compressed_extensions = {
+    ("svg", "gzip"): "svgz",
+}
+
+# maximum number of chunks waiting to be compressed
+_QUEUE_SIZE = 8
+
+
+def output_extension(extension, method):
+    """
+    Return the file name extension for output with `extension` compressed
+    with `method`, e.g. "svgz" for SVG compressed with gzip.
+    """
+    if method is None:
+        return extension
+    return _compressed_extensions.get((extension, method),
+                                      "%s.%s" % (extension, extensions[method]))
+
+
+def compressor(method, level=None):
+    """
+    Return a compressor object (with `compress()` and `flush()` methods) for
+    `method`, one of the keys of `extensions`.
+
+    `level` is the compression level (the default depends on the method).
+    Raises ValueError if the method is unknown, and ImportError if zstd is
+    neither in the standard library (Python 3.14+) nor installed as the
+    `zstandard` package.
+    """
+    if method == "gzip":
+        import zlib
+        if level is None:
+            level = 6
+        # wbits 16 + 15 writes a gzip header and trailer
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if method == "bz2":
+        import bz2
+        return bz2.BZ2Compressor(9 if level is None else level)
+    if method == "xz":
+        import lzma
+        return lzma.LZMACompressor(preset=level)
+    if method == "zstd":
+        try:
+            from compression import zstd
+            return zstd.ZstdCompressor(level=level)
+        except ImportError:
+            pass
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd compression requires Python 3.14 or the "
+                              "zstandard package (`pip install zstandard`)")
+        if level is None:
+            level = 3
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    raise ValueError("Unknown compression method: %s" % method)
+
+
+class CompressedWriter(io.RawIOBase):
+    """
+    A binary file-like object which compresses the data written to it and
+    writes it to `outfile` (which is not closed by `close()`).
+
+    With `threaded` (the default), compression runs in a background thread
+    which takes the chunks passed to `write()` from a bounded queue. An error
+    in the thread is raised by the following calls to `write()` and by
+    `close()`.
+        >>> with CompressedWriter(open('out.svgz', 'wb'), 'gzip') as f:
+        ...     f.write(data)
+    """
+
+    mode = "wb"
+
+    def __init__(self, outfile, method="gzip", level=None, threaded=True):
+        """
+        Args:
+            outfile (filehandle): the binary file to write compressed data to
+            method (str): one of the keys of `extensions`
+            level (int): the compression level (None for the default)
+            threaded (bool): compress in a background thread
+        """
+        self.outfile = outfile
+        self.method = method
+        self._compressor = compressor(method, level)
+        self._error = None
+        self._thread = None
+        if threaded:
+            self._queue = queue.Queue(_QUEUE_SIZE)
+            self._thread = threading.Thread(target=self._run,
+                                            name="wav2vec-compress")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed CompressedWriter")
+        self._check()
+        if self._thread is None:
+            self._compress(data)
+        else:
+            self._queue.put(bytes(data))
+        return len(data)
+
+    def close(self):
+        """
+        Compress any remaining data, write the end of the compressed stream
+        and flush `outfile`.
+        """
+        if self.closed:
+            return
+        try:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._check()
+            else:
+                self.outfile.write(self._compressor.flush())
+            if hasattr(self.outfile, "flush"):
+                self.outfile.flush()
+        finally:
+            super(CompressedWriter, self).close()
+
+    def _compress(self, data):
+        compressed = self._compressor.compress(data)
+        if compressed:
+            self.outfile.write(compressed)
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            if self._error is not None:
+                # keep draining the queue so that write() does not block
+                continue
+            try:
+                self._compress(data)
+            except Exception as e:
+                logger.debug("Compression failed: %s" % e)
+                self._error = e
+        if self._error is None:
+            try:
+                self.outfile.write(self._compressor.flush())
+            except Exception as e:
+                self._error = e
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
@@ -5,8 +5,14 @@ New formatters need only to override the five abstract methods.
 """
 
 import abc
+import io
 import sys
 import logging
+import tempfile
+
+from . import DEFAULT_BUFSIZE, DEFAULT_SPOOL_SIZE
+from ..WavDecoder import ChannelBlock, Point
+from ..stats import clock
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +22,170 @@ except ImportError:
     # Python 3:
     from io import StringIO
 
+# number of points formatted by each `%` operation in format_points()
+_FORMAT_CHUNK = 1024
+
+
+def format_points(fmt, xs, ys):
+    """
+    Format every (x, y) pair of the sequences `xs` and `ys` with the format
+    string `fmt` (which must contain exactly two conversions, e.g. "%f, %f\n")
+    and return the concatenated result.
+
+    This is equivalent to `"".join(fmt % (x, y) for x, y in zip(xs, ys))`, but
+    formats many points with each `%` operation.
+    """
+    # array('d') or NumPy arrays: convert to lists of floats in one go
+    if hasattr(xs, "tolist"):
+        xs = xs.tolist()
+    if hasattr(ys, "tolist"):
+        ys = ys.tolist()
+    n = len(xs)
+    chunk_fmt = fmt * _FORMAT_CHUNK
+    parts = []
+    for start in range(0, n, _FORMAT_CHUNK):
+        end = min(start + _FORMAT_CHUNK, n)
+        flat = [None] * (2 * (end - start))
+        flat[0::2] = xs[start:end]
+        flat[1::2] = ys[start:end]
+        if end - start < _FORMAT_CHUNK:
+            chunk_fmt = fmt * (end - start)
+        parts.append(chunk_fmt % tuple(flat))
+    return "".join(parts)
+
+
+def is_binary(outfile):
+    """
+    True if `outfile` expects bytes rather than str.
+    """
+    if isinstance(outfile, (io.RawIOBase, io.BufferedIOBase)):
+        return True
+    if isinstance(outfile, io.TextIOBase):
+        return False
+    return "b" in getattr(outfile, "mode", "")
+
+
+class OutputBuffer(object):
+    """
+    Collects output strings and writes them to `outfile` with a single call
+    once at least `bufsize` characters have accumulated (and on `flush()`).
+
+    If `outfile` is a binary file (like `sys.stdout.buffer` or a file opened
+    with 'wb'), the collected text is encoded as UTF-8 once per write instead
+    of once per string. (The output of binary formatters is collected as bytes
+    and written as is.)
+
+    If a `wav2vec.stats.Stats` object is given as `stats`, the time spent
+    writing (in the "write" stage) and the bytes written are added to it.
+    """
+
+    def __init__(self, outfile, bufsize=DEFAULT_BUFSIZE, stats=None):
+        self.outfile = outfile
+        self.bufsize = bufsize
+        self.stats = stats
+        self.binary = is_binary(outfile)
+        self._parts = []
+        self._size = 0
+
+    def write(self, string):
+        self._parts.append(string)
+        self._size += len(string)
+        if self._size >= self.bufsize:
+            self.flush()
+
+    def flush(self):
+        if not self._parts:
+            return
+        stats = self.stats
+        if stats is not None:
+            t = clock()
+        data = self._parts[0][:0].join(self._parts)
+        if self.binary and not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        self.outfile.write(data)
+        if stats is not None:
+            stats.time("write", clock() - t)
+            stats.count("bytes_written", len(data))
+        self._parts = []
+        self._size = 0
+
+
+def _tell(outfile):
+    """
+    Return the current position in `outfile`, or None if it is not seekable.
+    """
+    try:
+        if hasattr(outfile, "seekable") and not outfile.seekable():
+            return None
+        return outfile.tell()
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+
+class ChannelSpools(object):
+    """
+    Collects the formatted points of each channel in its own spool (a
+    `SpooledTemporaryFile` which keeps up to `max_size` characters in memory
+    and then spills to disk), so that streamed multi-channel data can be
+    written as one continuous path per channel at the end.
+    """
+
+    def __init__(self, max_size=DEFAULT_SPOOL_SIZE, binary=False):
+        self.max_size = max_size
+        self.binary = binary
+        self._spools = None
+        self._first = None
+        self._last = None
+
+    def add(self, block):
+        """
+        Append a block: a list with a (first_sample, last_sample,
+        formatted_points) tuple for each channel (or None for a channel with
+        no new points).
+        """
+        if self._spools is None:
+            if self.binary:
+                self._spools = [tempfile.SpooledTemporaryFile(self.max_size)
+                                for chan in block]
+            else:
+                self._spools = [tempfile.SpooledTemporaryFile(
+                    self.max_size, mode="w+", newline="") for chan in block]
+            self._first = [first for first, last, body in block]
+            self._last = [None] * len(block)
+        for chan, entry in enumerate(block):
+            if entry is None:
+                continue
+            first, last, body = entry
+            self._spools[chan].write(body)
+            self._last[chan] = last
+
+    def continues(self, chan, first):
+        """
+        Return True if the sample `first` is the last sample already spooled
+        for channel `chan` (a block which repeats it to join onto the previous
+        block, see `wav2vec.Simplifier`).
+        """
+        return self._last is not None and self._last[chan] == first
+
+    def write_to(self, formatter, out, bufsize=DEFAULT_BUFSIZE):
+        """
+        Write one path for each channel (with the formatter's path front and
+        end matter) to `out` and close the spools.
+        """
+        if self._spools is None:
+            return
+        for chan, spool in enumerate(self._spools):
+            out.write(formatter.path_front_matter(self._first[chan], chan))
+            spool.seek(0)
+            while True:
+                data = spool.read(bufsize)
+                if not data:
+                    break
+                out.write(data)
+            out.write(formatter.path_end_matter(self._last[chan], chan))
+            spool.close()
+        self._spools = None
+
 
 class Formatter(object):
     """
@@ -37,6 +207,23 @@ class Formatter(object):
     # name of the formatter (subclasses should override this)
     backend = "Abstract"
 
+    # file name extension for the output (subclasses should override this)
+    extension = "txt"
+
+    # True if the formatted points depend on the points around them (e.g.
+    # relative coordinates, or a count of the points in a block), so that
+    # ranges of points cannot be formatted independently and joined (as
+    # parallel output does)
+    relative = False
+
+    # True if the output is bytes rather than text (it must then be written to
+    # a binary file)
+    binary = False
+
+    # True if the points of each channel must be written contiguously: when
+    # streaming multi-channel data, the output is then always spooled
+    contiguous = False
+
     @abc.abstractmethod
     def doc_front_matter(self, params):
         """
@@ -95,6 +282,27 @@ class Formatter(object):
         """
         return "%f, %f" % sample
 
+    def block_to_str(self, xs, ys, chan):
+        """
+        This method is an optional, faster alternative to `points_to_str()`:
+        it takes all of the samples of one channel in a block at once and
+        returns the formatted string for all of them. `output()` calls it
+        whenever the decoder produces columnar data (ChannelBlocks).
+
+        The default implementation calls `points_to_str()` for each sample.
+        Subclasses can override it to format whole arrays at once (see
+        `format_points()`), but the result must be the same (unless the
+        output depends on how the points are grouped, in which case the
+        formatter must be marked `relative`).
+
+        xs, ys (sequence): The x and y values of the samples (`array('d')` or
+            NumPy arrays).
+        chan (int): The channel number corresponding to the samples.
+        """
+        points_to_str = self.points_to_str
+        return "".join([points_to_str(Point(x, y), chan)
+                        for x, y in zip(xs, ys)])
+
     def __init__(self, decoder):
         """
         Args:
@@ -111,29 +319,145 @@ class Formatter(object):
         """
         return self.decoder.height*chan + self.decoder.height/2.0
 
-    def output(self, outfile=sys.stdout):
+    def output(self, outfile=sys.stdout, workers=None,
+               bufsize=DEFAULT_BUFSIZE, spool=None, compress=None,
+               compresslevel=None):
         """
-        outfile (filehandle): The file to output formatted data to.
+        outfile (filehandle): The file to output formatted data to. It may be
+            a text file or a binary file (in which case the output is encoded
+            as UTF-8).
+        workers (int): If given, decode and format the file in parallel with
+            this many worker processes (see `wav2vec.parallel`). The output is
+            the same as a serial run.
+        bufsize (int): The output of each block is built in memory and
+            written to `outfile` once at least this many characters have
+            accumulated.
+        spool (int): If given, streamed (bs > 0) multi-channel data is not
+            split into a path per block: instead each channel's points are
+            collected in a spool which keeps up to `spool` characters in
+            memory (and the rest in a temporary file), and one continuous path
+            per channel is written at the end, just like when bs == 0.
+        compress (str): If given, compress the output with this method (one
+            of 'gzip', 'bz2', 'xz' or 'zstd') in a background thread (see
+            `wav2vec.compressed`). `outfile` must then be a binary file.
+        compresslevel (int): The compression level (None for the default of
+            the method).
+
+        If the decoder has a `stats` object (see `wav2vec.stats`), the time
+        spent formatting and writing, the number of points formatted and the
+        total time are added to it, and its observers are notified at the end.
+        (With `workers`, only writing is measured.)
         """
+        if compress is not None:
+            from ..compressed import CompressedWriter
+            writer = CompressedWriter(outfile, compress, compresslevel)
+            try:
+                self.output(writer, workers, bufsize, spool)
+            finally:
+                writer.close()
+            return
+        if workers is not None:
+            from .. import parallel
+            return parallel.output(self, outfile, workers, bufsize, spool)
         logger.debug("Outputting data to %s" % outfile)
+        stats = getattr(self.decoder, "stats", None)
+        if stats is not None:
+            started = clock()
+        out = OutputBuffer(outfile, bufsize, stats)
+        spools = None
+        if self.contiguous and spool is None:
+            spool = DEFAULT_SPOOL_SIZE
+        if spool is not None and self.decoder.bs:
+            spools = ChannelSpools(spool, self.binary)
+        start = _tell(outfile)
         with self.decoder as data:
-            outfile.write(self.doc_front_matter(self.decoder.params))
+            out.write(self.doc_front_matter(self.decoder.params))
             for paths in data:
-                is_opening = (self.decoder.bs == 0) or\
-                    (self.decoder.index - self.decoder.bs == 0)
-                is_closing = self.decoder.index == self.decoder.params.nframes
-                nchannels = len(paths)
-                for chan, chan_data in enumerate(paths):
-                    if is_opening or nchannels > 1:
-                        # beginning of channel chunk
-                        sample = chan_data[0]
-                        outfile.write(self.path_front_matter(sample, chan))
-                    for sample in chan_data:
-                        outfile.write(self.points_to_str(sample, chan))
-                    if is_closing or nchannels > 1:
-                        # end ofchannel chunk
-                        outfile.write(self.path_end_matter(sample, chan))
-            outfile.write(self.doc_end_matter(self.decoder.params))
+                self._write_block(paths, out, spools, stats)
+            if spools is not None:
+                spools.write_to(self, out, bufsize)
+            out.write(self.doc_end_matter(self.decoder.params))
+        out.flush()
+        self.patch_output(outfile, start)
+        if stats is not None:
+            stats.time("total", clock() - started)
+            stats.finish()
+
+    def output_async(self, writer, bufsize=DEFAULT_BUFSIZE, spool=None,
+                     executor=None):
+        """
+        Return a coroutine which writes the output to `writer` (an
+        `asyncio.StreamWriter`, or any object with `write()` and a coroutine
+        `drain()`) like `output()`, without blocking the event loop: the
+        decoding and formatting of each block run in `executor` (the loop's
+        default executor if None), and the output of each block is written
+        and drained before the next block is decoded. See `wav2vec.aio`.
+            >>> await SVGFormatter(wd).output_async(writer)
+        """
+        from .. import aio
+        return aio.output(self, writer, bufsize, spool, executor)
+
+    def _write_block(self, paths, out, spools=None, stats=None):
+        """
+        Format one block from the decoder and write it to `out` (an
+        OutputBuffer), or add it to `spools`.
+        """
+        if stats is not None:
+            t = clock()
+            written = stats.timers.get("write", 0.0)
+        is_opening = self.decoder.first_block
+        is_closing = self.decoder.last_block
+        nchannels = len(paths)
+        if spools is not None and nchannels > 1:
+            block = []
+            for chan, chan_data in enumerate(paths):
+                if len(chan_data) and spools.continues(chan, chan_data[0]):
+                    # the spooled path is already continuous
+                    chan_data = chan_data[1:]
+                if not len(chan_data):
+                    block.append(None)
+                    continue
+                block.append((chan_data[0], chan_data[-1],
+                              self._chan_to_str(chan_data, chan)))
+            spools.add(block)
+        else:
+            for chan, chan_data in enumerate(paths):
+                if not len(chan_data):
+                    continue
+                if is_opening or nchannels > 1:
+                    # beginning of channel chunk
+                    out.write(self.path_front_matter(chan_data[0], chan))
+                out.write(self._chan_to_str(chan_data, chan))
+                if is_closing or nchannels > 1:
+                    # end ofchannel chunk
+                    out.write(self.path_end_matter(chan_data[-1], chan))
+        if stats is not None:
+            # the time spent writing is counted separately
+            stats.time("format", clock() - t -
+                       (stats.timers.get("write", 0.0) - written))
+            stats.count("points", sum(len(c) for c in paths))
+
+    def patch_output(self, outfile, start):
+        """
+        This method is called once all of the output has been written to
+        `outfile`. Formatters whose front matter depends on the whole output
+        (like its length) can override it to seek back and rewrite it.
+
+        start (int): the position in `outfile` at which the output started,
+            or None if `outfile` is not seekable.
+        """
+        pass
+
+    def _chan_to_str(self, chan_data, chan):
+        """
+        Format all samples of one channel of a block, using the block-level
+        `block_to_str()` for columnar data.
+        """
+        if isinstance(chan_data, ChannelBlock):
+            return self.block_to_str(chan_data.xs, chan_data.ys, chan)
+        points_to_str = self.points_to_str
+        parts = [points_to_str(sample, chan) for sample in chan_data]
+        return parts[0][:0].join(parts) if parts else ""
 
     def __str__(self):
         string = StringIO()
@@ -1,8 +1,22 @@
+# default number of characters collected before writing them to the output file
+DEFAULT_BUFSIZE = 65536
+
+# default number of characters of each channel's path kept in memory when
+# spooling streamed multi-channel output (see ChannelSpools)
+DEFAULT_SPOOL_SIZE = 2**20
+
+# default number of decimal places of the formatters with a precision
+DEFAULT_PRECISION = 2
+
 from .formatters import *
 
 # List of available formatters
 formatters = {
     "SVG": SVGFormatter,
+    "SVGPath": SVGPathFormatter,
     "CSV": CSVFormatter,
     "PostScript": PSFormatter,
+    "PostScriptCompact": PSCompactFormatter,
+    "NPY": NPYFormatter,
+    "Float32": Float32Formatter,
 }
@@ -1,11 +1,18 @@
-from .Formatter import Formatter
-from ..WavDecoder import Point
+import struct
+import sys
+from array import array
+
+from . import DEFAULT_PRECISION
+from .Formatter import Formatter, format_points
+from ..WavDecoder import (Point, WavDecoder, _array_frombytes, _array_tobytes,
+                          np)
 
 
 class CSVFormatter(Formatter):
     """
     """
     backend = "CSV"
+    extension = "csv"
 
     def doc_front_matter(self, *args):
         return super(CSVFormatter, self).doc_front_matter(*args)
@@ -24,12 +31,16 @@ class CSVFormatter(Formatter):
     def points_to_str(self, sample, chan):
         return "%f, %f\n" % sample
 
+    def block_to_str(self, xs, ys, chan):
+        return format_points("%f, %f\n", xs, ys)
+
 
 class SVGFormatter(Formatter):
     """
     Convert paths to SVG.
     """
     backend = 'SVG'
+    extension = 'svg'
 
     def doc_front_matter(self, params):
         nchannels = params.nchannels
@@ -55,12 +66,114 @@ class SVGFormatter(Formatter):
         (x, y) = sample.x, -1*sample.y + self.y_offset(chan)
         return ' %f, %f' % (x, y)
 
+    def block_to_str(self, xs, ys, chan):
+        return format_points(' %f, %f', xs, _offset(ys, -1, self.y_offset(chan)))
+
+
+class SVGPathFormatter(SVGFormatter):
+    """
+    Convert paths to compact SVG: each channel is a `<path>` whose points are
+    relative `l`, `h` and `v` commands with `precision` decimal places (and
+    no redundant separators), and whose vertical offset is applied with a
+    `transform` rather than to every point.
+
+    The coordinates are rounded to `precision` places before the differences
+    are taken, so rounding errors do not accumulate along the path.
+    """
+    backend = 'SVGPath'
+    relative = True
+    precision = DEFAULT_PRECISION
+
+    def __init__(self, decoder, precision=DEFAULT_PRECISION):
+        """
+        Args:
+            decoder (WavDecoder): the decoder to read data from
+            precision (int): the number of decimal places of the coordinates
+                (0 for integers)
+        """
+        super(SVGPathFormatter, self).__init__(decoder)
+        self.precision = precision
+        self._scale = 10 ** precision
+        # per channel: the last (rounded) point, command and number written
+        self._last = {}
+        self._cmd = {}
+        self._token = {}
+
+    def doc_front_matter(self, params):
+        self._last = {}
+        self._cmd = {}
+        self._token = {}
+        return super(SVGPathFormatter, self).doc_front_matter(params)
+
+    def path_front_matter(self, first, chan):
+        x = int(round(first.x * self._scale))
+        y = int(round(-first.y * self._scale))
+        self._last[chan] = (x, y)
+        self._cmd[chan] = "M"
+        x, y = _fixed(x, self.precision), _fixed(y, self.precision)
+        self._token[chan] = y
+        return '<path stroke="black" stroke-linecap="round"'\
+            ' stroke-linejoin="round" fill="none" transform="translate(0 %s)"'\
+            ' d="M%s%s%s' % (_trim(self.y_offset(chan)), x,
+                             _separator(x, y), y)
+
+    def path_end_matter(self, last, chan):
+        return '" />'
+
+    def points_to_str(self, sample, chan):
+        return self.block_to_str((sample.x,), (sample.y,), chan)
+
+    def block_to_str(self, xs, ys, chan):
+        if hasattr(xs, "tolist"):
+            xs = xs.tolist()
+        if hasattr(ys, "tolist"):
+            ys = ys.tolist()
+        if not xs:
+            return ""
+        scale = self._scale
+        precision = self.precision
+        # y is negated because in the SVG coordinate system positive numbers
+        # move down
+        qxs = [int(round(x * scale)) for x in xs]
+        qys = [int(round(-y * scale)) for y in ys]
+        # (when the path was not started with path_front_matter(), e.g. when
+        # it is spooled, it starts at the first point)
+        px, py = self._last.get(chan, (qxs[0], qys[0]))
+        cmd = self._cmd.get(chan)
+        token = self._token.get(chan, "M")
+        parts = []
+        for qx, qy in zip(qxs, qys):
+            dx = qx - px
+            dy = qy - py
+            if dy == 0:
+                if dx == 0:
+                    continue
+                c, args = "h", (_fixed(dx, precision),)
+            elif dx == 0:
+                c, args = "v", (_fixed(dy, precision),)
+            else:
+                c, args = "l", (_fixed(dx, precision), _fixed(dy, precision))
+            if c != cmd:
+                # a repeated command letter can be left out
+                parts.append(c)
+                cmd = token = c
+            for arg in args:
+                parts.append(_separator(token, arg))
+                parts.append(arg)
+                token = arg
+            px, py = qx, qy
+        self._last[chan] = (px, py)
+        self._cmd[chan] = cmd
+        self._token[chan] = token
+        return "".join(parts)
+
 
 class PSFormatter(Formatter):
     """
     Convert paths to PostScript.
     """
     backend = 'PostScript'
+    extension = 'ps'
 
     def doc_front_matter(self, params):
         # This dict tracks the last point in each channel chunk so we can moveto
@@ -93,3 +206,313 @@ class PSFormatter(Formatter):
     def points_to_str(self, sample, chan):
         (x, y) = sample.x, sample.y - self.y_offset(chan)
         return "%f %f lineto\n" % (x, y)
+
+    def block_to_str(self, xs, ys, chan):
+        return format_points("%f %f lineto\n", xs,
+                             _offset(ys, 1, -self.y_offset(chan)))
+
+
+class PSCompactFormatter(PSFormatter):
+    """
+    Convert paths to compact PostScript: a procedure defined once at the top
+    reads the points that follow it (as bare "x y" pairs with `precision`
+    decimal places) and draws lines to them, and the vertical offset of each
+    channel is applied with `translate` rather than to every point.
+
+    The output renders the same as PSFormatter's (up to the rounding of the
+    coordinates).
+    """
+    backend = 'PostScriptCompact'
+    precision = DEFAULT_PRECISION
+
+    # D draws lines to the coordinates which follow it in the file, up to E
+    procedures = ("/D { { currentfile token pop dup /E eq { pop exit } if "
+                  "currentfile token pop lineto } loop } bind def\n")
+
+    def __init__(self, decoder, precision=DEFAULT_PRECISION):
+        """
+        Args:
+            decoder (WavDecoder): the decoder to read data from
+            precision (int): the number of decimal places of the coordinates
+                (0 for integers)
+        """
+        super(PSCompactFormatter, self).__init__(decoder)
+        self.precision = precision
+        self._scale = 10 ** precision
+
+    def doc_front_matter(self, params):
+        ps = super(PSCompactFormatter, self).doc_front_matter(params)
+        return ps + self.procedures
+
+    def path_front_matter(self, first, chan):
+        last = self.last_point.get(chan, Point(0, 0))
+        return "0 %s translate\n%s %s moveto D\n" % (
+            _trim(-self.y_offset(chan)), self._fixed(last.x),
+            self._fixed(last.y))
+
+    def path_end_matter(self, last, chan):
+        self.last_point[chan] = last
+        return "E\n0 %s translate\n" % _trim(self.y_offset(chan))
+
+    def points_to_str(self, sample, chan):
+        return "%s %s\n" % (self._fixed(sample.x), self._fixed(sample.y))
+
+    def block_to_str(self, xs, ys, chan):
+        if hasattr(xs, "tolist"):
+            xs = xs.tolist()
+        if hasattr(ys, "tolist"):
+            ys = ys.tolist()
+        fixed = self._fixed
+        return "".join(["%s %s\n" % (fixed(x), fixed(y))
+                        for x, y in zip(xs, ys)])
+
+    def _fixed(self, value):
+        return _fixed(int(round(value * self._scale)), self.precision)
+
+
+class NPYFormatter(Formatter):
+    """
+    Convert paths to a NumPy `.npy` file holding a float32 array of shape
+    (nchannels, npoints, 2): the (x, y) points of each channel.
+
+    When streaming multi-channel data the points are spooled so that each
+    channel is written contiguously. The header is written with the number of
+    points the decoder is expected to produce, and patched at the end if the
+    actual number differs (which requires a seekable output file). Every
+    channel must have the same number of points.
+        >>> points = numpy.load('output.npy')
+        >>> xs, ys = points[chan, :, 0], points[chan, :, 1]
+    """
+    backend = 'NPY'
+    extension = 'npy'
+    binary = True
+    contiguous = True
+
+    # the header (including the magic string) is padded to this length, so
+    # that it can be rewritten in place
+    header_size = 128
+
+    def doc_front_matter(self, params):
+        self.nchannels = params.nchannels
+        self.counts = {}
+        self.expected = _expected_points(self.decoder)
+        return self._header(self.expected)
+
+    def doc_end_matter(self, params):
+        return b''
+
+    def path_front_matter(self, first, chan):
+        return b''
+
+    def path_end_matter(self, last, chan):
+        return b''
+
+    def points_to_str(self, sample, chan):
+        self.counts[chan] = self.counts.get(chan, 0) + 1
+        return struct.pack("<ff", sample.x, sample.y)
+
+    def block_to_str(self, xs, ys, chan):
+        self.counts[chan] = self.counts.get(chan, 0) + len(xs)
+        if np is not None and isinstance(xs, np.ndarray):
+            points = np.empty((len(xs), 2), "<f4")
+            points[:, 0] = xs
+            points[:, 1] = ys
+            return points.tobytes()
+        points = array("f", [0.0]) * (2 * len(xs))
+        points[0::2] = array("f", xs)
+        points[1::2] = array("f", ys)
+        return _little_endian(points)
+
+    def patch_output(self, outfile, start):
+        # (with wav2vec.parallel the counts of the workers are added up)
+        counts = set(self.counts.values())
+        if len(counts) > 1:
+            raise ValueError("NPY output requires the same number of points in"
+                             " every channel (got %s)" % sorted(counts))
+        count = counts.pop() if counts else 0
+        if count == self.expected:
+            return
+        if start is None:
+            raise IOError("Cannot rewrite the NPY header of a non-seekable "
+                          "output (expected %d points, got %d)"
+                          % (self.expected, count))
+        end = outfile.tell()
+        outfile.seek(start)
+        outfile.write(self._header(count))
+        outfile.seek(end)
+
+    def _header(self, count):
+        header = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d, 2), }"\
+            % (self.nchannels, count)
+        # magic string, version 1.0, header length, header padded with spaces
+        # and terminated with a newline
+        header = header.ljust(self.header_size - 11) + "\n"
+        return (b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) +
+                header.encode("latin1"))
+
+
+class Float32Formatter(Formatter):
+    """
+    Convert paths to raw little-endian float32 data with a small JSON header.
+
+    The first line of the output is a JSON object describing the input and
+    the output size. It is followed by a chunk for every block of each
+    channel: a 6-byte header (the channel number as an unsigned 16-bit and the
+    number of points N as an unsigned 32-bit integer, little-endian), then N
+    float32 x values and N float32 y values. Chunks can be written without
+    knowing the length of the output, so this format streams to pipes. (When
+    the data is not columnar, `points_to_str()` writes a chunk for every
+    point.) Use `load_float32()` to read it.
+    """
+    backend = 'Float32'
+    extension = 'f32'
+    binary = True
+    relative = True
+
+    magic = "wav2vec-float32"
+    version = 1
+    _chunk = struct.Struct("<HI")
+
+    def doc_front_matter(self, params):
+        header = dict(format=self.magic, version=self.version,
+                      nchannels=params.nchannels, framerate=params.framerate,
+                      nframes=params.nframes, width=self.decoder.width,
+                      height=self.decoder.height,
+                      chunk="<HI channel, npoints; <f4 xs; <f4 ys")
+        import json
+        return (json.dumps(header, sort_keys=True) + "\n").encode("utf-8")
+
+    def doc_end_matter(self, params):
+        return b''
+
+    def path_front_matter(self, first, chan):
+        return b''
+
+    def path_end_matter(self, last, chan):
+        return b''
+
+    def points_to_str(self, sample, chan):
+        return self._chunk.pack(chan, 1) + struct.pack("<ff", sample.x,
+                                                       sample.y)
+
+    def block_to_str(self, xs, ys, chan):
+        header = self._chunk.pack(chan, len(xs))
+        if np is not None and isinstance(xs, np.ndarray):
+            return (header + xs.astype("<f4").tobytes() +
+                    ys.astype("<f4").tobytes())
+        return (header + _little_endian(array("f", xs)) +
+                _little_endian(array("f", ys)))
+
+
+def load_float32(infile):
+    """
+    Read the output of Float32Formatter from the binary file `infile`.
+
+    Returns the header (a dict) and a list with an (xs, ys) tuple of
+    `array('f')` (or NumPy arrays, if NumPy is installed) for each channel.
+    """
+    import json
+    header = json.loads(infile.readline().decode("utf-8"))
+    if header.get("format") != Float32Formatter.magic:
+        raise ValueError("Not a wav2vec float32 file")
+    chunk = Float32Formatter._chunk
+    columns = [([], []) for chan in range(header["nchannels"])]
+    while True:
+        data = infile.read(chunk.size)
+        if not data:
+            break
+        chan, npoints = chunk.unpack(data)
+        for column in columns[chan]:
+            column.append(infile.read(4 * npoints))
+    channels = []
+    for xs, ys in columns:
+        xs, ys = b"".join(xs), b"".join(ys)
+        if np is not None:
+            channels.append((np.frombuffer(xs, "<f4"), np.frombuffer(ys, "<f4")))
+        else:
+            channels.append((_from_little_endian(xs),
+                             _from_little_endian(ys)))
+    return header, channels
+
+
+def _little_endian(values):
+    """
+    Return the bytes of the array `values` in little-endian byte order.
+    """
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return _array_tobytes(values)
+
+
+def _from_little_endian(data):
+    values = array("f")
+    _array_frombytes(values, data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _expected_points(decoder):
+    """
+    Return the number of points per channel that the (open) `decoder` will
+    produce from its selected range of frames, or 0 if it cannot be known in
+    advance (e.g. in peaks mode).
+    """
+    if not isinstance(decoder, WavDecoder) or decoder.peaks:
+        return 0
+    nframes = decoder._end_frame - decoder._first_frame
+    bs = decoder.bs or nframes
+    downtoss = decoder._downtoss
+    if not bs:
+        return 0
+    blocks, rest = divmod(nframes, bs)
+    return blocks * -(-bs // downtoss) + -(-rest // downtoss)
+
+
+def _offset(ys, sign, offset):
+    """
+    Return `sign*y + offset` for every y in `ys` (computed the same way as
+    points_to_str() does, so that the output is identical).
+    """
+    if np is not None and isinstance(ys, np.ndarray):
+        return sign * ys + offset
+    if sign < 0:
+        return [offset - y for y in ys]
+    return [y + offset for y in ys]
+
+
+def _fixed(q, precision):
+    """
+    Format the integer `q` divided by 10**precision as a short decimal: no
+    trailing zeros, and no leading zero before the decimal point.
+    """
+    if not precision:
+        return "%d" % q
+    digits = "%0*d" % (precision + 1, abs(q))
+    whole, frac = digits[:-precision], digits[-precision:].rstrip("0")
+    if whole == "0":
+        whole = ""
+    s = whole + "." + frac if frac else whole
+    if not s:
+        return "0"
+    return "-" + s if q < 0 else s
+
+
+def _separator(prev, token):
+    """
+    Return the separator needed between two tokens of SVG path data: none
+    after a command letter, before a minus sign, or between two numbers where
+    the second starts with the decimal point and the first already has one.
+    """
+    if (prev.isalpha() or token[0] == "-" or
+            (token[0] == "." and "." in prev)):
+        return ""
+    return " "
+
+
+def _trim(value):
+    """
+    Format a float without trailing zeros.
+    """
+    return ("%f" % value).rstrip("0").rstrip(".") or "0"
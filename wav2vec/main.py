@@ -1,36 +1,338 @@
 import argparse
+import glob
+import io
 import logging
+import os
+import struct
 import sys
 import wave
 
 from . import WavDecoder
-from .formatter import formatters
+from . import mmapreader
+from .stats import Stats
+from .formatter import (DEFAULT_BUFSIZE, DEFAULT_PRECISION,
+                        DEFAULT_SPOOL_SIZE, formatters)
 
+# The cache, compression, peak index, simplification and stdin modules are
+# only imported when their options are used. The command line options need
+# these values from them up front:
+# the keys of wav2vec.compressed.extensions
+compress_methods = ("bz2", "gzip", "xz", "zstd")
+# the keys of wav2vec.Simplifier.methods
+simplify_methods = ("rdp", "vw")
+# wav2vec.cache.DEFAULT_DISK_SIZE
+DEFAULT_CACHE_SIZE = 512 * 2**20
 
-# returns either 'wav' or 'aiff'
-def get_file_type(filename):
+
+# the number of bytes get_file_type() reads: the RIFF/FORM id, the chunk size
+# and the WAVE/AIFF/AIFC form type
+_MAGIC_SIZE = 12
+
+
+def get_file_type(f):
+    """
+    Return 'wav', 'aiff' or 'aifc' according to the first 12 bytes of `f` (a
+    file name, or a binary file which is read from its current position and
+    then seeked back), or None if it is neither a WAV nor an AIFF file.
+    """
+    if hasattr(f, "read"):
+        pos = f.tell()
+        magic = f.read(_MAGIC_SIZE)
+        f.seek(pos)
+    else:
+        with io.open(f, "rb") as infile:
+            magic = infile.read(_MAGIC_SIZE)
+    if magic[:4] == b"RIFF" and magic[8:12] == b"WAVE":
+        return "wav"
+    if magic[:4] == b"FORM" and magic[8:12] == b"AIFF":
+        return "aiff"
+    if magic[:4] == b"FORM" and magic[8:12] == b"AIFC":
+        return "aifc"
+    return None
+
+
+# the file name which reads the input from stdin
+STDIN = "-"
+
+# extensions of the files picked up when a directory is given in batch mode
+audio_extensions = ('.wav', '.wave', '.aif', '.aiff', '.aifc')
+
+
+def get_decoder_class(filename, use_mmap=False):
+    """
+    Return the module to decode `filename` with (wave, aifc, or mmapreader if
+    `use_mmap` is set or the file has float samples or other formats which
+    the standard library cannot read).
+
+    Raises ValueError if the file is neither a WAV nor an AIFF file.
+    """
+    with io.open(filename, "rb") as f:
+        sndtype = get_file_type(f)
+        if sndtype is None:
+            raise ValueError(
+                "Unknown file type (should be either WAV or AIFF): %s"
+                % filename)
+        logging.debug("sndtype: %s" % sndtype)
+        if use_mmap:
+            return mmapreader
+        if not _stdlib_readable(f, sndtype):
+            if not _mmap_readable(f):
+                raise ValueError("Unsupported %s file: %s"
+                                 % (sndtype.upper(), filename))
+            return mmapreader
+    if sndtype == 'aiff' or sndtype == 'aifc':
+        try:
+            import aifc
+            return aifc
+        except ImportError:
+            raise ImportError("The aifc module was removed in Python 3.13 (https://peps.python.org/pep-0594/). To install it as a module run `pip install standard-aifc`")
+    return wave
+
+
+def _stdlib_readable(f, sndtype):
+    """
+    True if the wave or aifc module can read the open file `f` of type
+    `sndtype`: PCM WAV files (whose fmt chunk comes first, as in nearly every
+    file) and integer AIFF files. The rest (such as IEEE float and
+    WAVE_FORMAT_EXTENSIBLE files) are left to mmapreader.
+    """
+    if sndtype == "wav":
+        # the fmt chunk's id and size, then its format tag
+        f.seek(_MAGIC_SIZE)
+        fmt = f.read(10)
+        return (len(fmt) == 10 and fmt[:4] == b"fmt "
+                and struct.unpack("<H", fmt[8:10])[0]
+                == mmapreader.WAVE_FORMAT_PCM)
+    if sndtype == "aifc":
+        # the compression type is in the COMM chunk, which may come after
+        # others
+        try:
+            with mmapreader.open(f) as wf:
+                return wf.getsampleformat() == "int"
+        except (mmapreader.Error, ValueError, struct.error):
+            # let the aifc module report what is wrong with it
+            return True
+    return True
+
+
+def _mmap_readable(f):
+    """
+    True if `f` (a file name or an open binary file) can be read by
+    `wav2vec.mmapreader`.
+    """
     try:
-        import sndhdr
-        kind = sndhdr.what(filename)
-        if kind is None:
-            return None
-        return kind[0]
+        mmapreader.open(f).close()
+    except (mmapreader.Error, IOError, ValueError, struct.error):
+        return False
+    return True
+
+
+def make_formatter(filename, args):
+    """
+    Return a formatter (configured from the parsed command line `args`)
+    which converts `filename` (or stdin, if it is STDIN).
+    """
+    if filename == STDIN:
+        # parse the header and decode the frames as they arrive
+        from . import streamreader
+        source = getattr(sys.stdin, 'buffer', sys.stdin)
+        decoder_class = streamreader
+    else:
+        source = filename
+        decoder_class = get_decoder_class(filename, args.mmap)
+    decoder = WavDecoder(source, decoder_class=decoder_class, bs=args.stream,
+                         max_width=args.width, max_height=args.height,
+                         downtoss=args.downtoss, columnar=True,
+                         peaks=args.peaks,
+                         stats=Stats() if args.stats else None,
+                         start=args.start, end=args.end,
+                         unit="frames" if args.frames else "seconds",
+                         prefetch=args.prefetch, length=args.length)
+    if args.peak_index:
+        from .PeakIndex import PeakDecoder
+        decoder = PeakDecoder(decoder)
+    if args.simplify is not None:
+        from .Simplifier import Simplifier
+        decoder = Simplifier(decoder, args.simplify, args.simplify_method)
+    formatter_class = formatters[args.format]
+    logging.debug("formatter_class: %s" % formatter_class)
+    if hasattr(formatter_class, "precision"):
+        return formatter_class(decoder, precision=args.precision)
+    return formatter_class(decoder)
+
+
+def convert_file(filename, outname, args):
+    """
+    Convert `filename` and write the result to the file `outname`.
+    """
+    formatter = make_formatter(filename, args)
+    with open(outname, 'wb') as outfile:
+        write_output(formatter, outfile, args, make_cache(args))
+    return outname
+
+
+def make_cache(args):
+    """
+    Return the RenderCache configured by the command line `args` (or None if
+    caching is not enabled).
+    """
+    if args.cache is None:
+        return None
+    from .cache import RenderCache
+    return RenderCache(args.cache, max_size=args.cache_size * 2**20,
+                       ttl=args.cache_ttl, hash_content=args.cache_hash)
 
-    except ImportError:
-        # no sndhdr means we're on python >= 3.13
-        # https://peps.python.org/pep-0594/#sndhdr
-        raise ImportError("Please install sndhdr with `pip install standard-sndhdr`")
+
+def write_output(formatter, outfile, args, cache=None, workers=None):
+    """
+    Write the output of `formatter` to the binary file `outfile` with the
+    options in `args`, through `cache` if it is given.
+
+    Returns True if the output came from the cache.
+    """
+    kwargs = dict(workers=workers, bufsize=args.bufsize, spool=args.spool,
+                  compress=args.compress, compresslevel=args.compress_level)
+    if cache is None:
+        formatter.output(outfile, **kwargs)
+        return False
+    return cache.output(formatter, outfile, **kwargs)
+
+
+def expand_inputs(paths):
+    """
+    Expand the input arguments of batch mode into a list of files: glob
+    patterns are expanded and directories are searched (recursively) for files
+    with one of the `audio_extensions`. A warning is written to stderr for
+    each pattern or directory which matches no files.
+    """
+    files = []
+    for path in paths:
+        matches = glob.glob(path) if glob.has_magic(path) else [path]
+        count = len(files)
+        for match in sorted(matches):
+            if os.path.isdir(match):
+                for root, dirs, names in os.walk(match):
+                    dirs.sort()
+                    for name in sorted(names):
+                        if name.lower().endswith(audio_extensions):
+                            files.append(os.path.join(root, name))
+            else:
+                files.append(match)
+        if len(files) == count:
+            sys.stderr.write("Warning: %s matched no input files\n" % path)
+    return files
+
+
+def output_names(files, outdir, extension):
+    """
+    Return an output file name in `outdir` for each input file, named after
+    the input file but with `extension`. Inputs which share a name get a
+    numeric suffix so that no output is overwritten.
+    """
+    names = []
+    used = set()
+    for filename in files:
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        name = "%s.%s" % (stem, extension)
+        n = 1
+        while name in used:
+            name = "%s-%d.%s" % (stem, n, extension)
+            n += 1
+        used.add(name)
+        names.append(os.path.join(outdir, name))
+    return names
+
+
+def batch(files, args):
+    """
+    Convert every file in `files` (see `expand_inputs()`) into its own file
+    in `args.outdir`, using a pool of `args.jobs` worker processes. Progress
+    and failures are reported on stderr; a failed file does not stop the rest
+    of the batch.
+
+    Returns the number of files which failed.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from .compressed import output_extension
+
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+    extension = output_extension(formatters[args.format].extension,
+                                 args.compress)
+    jobs = list(zip(files, output_names(files, args.outdir, extension)))
+    failures = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = dict((executor.submit(convert_file, infile, outname, args),
+                        infile) for infile, outname in jobs)
+        for done, future in enumerate(as_completed(futures), 1):
+            infile = futures[future]
+            try:
+                outname = future.result()
+                sys.stderr.write("[%d/%d] %s -> %s\n"
+                                 % (done, len(jobs), infile, outname))
+            except Exception as e:
+                failures += 1
+                sys.stderr.write("[%d/%d] %s FAILED: %s\n"
+                                 % (done, len(jobs), infile, e))
+    sys.stderr.write("Converted %d of %d files\n"
+                     % (len(jobs) - failures, len(jobs)))
+    return failures
+
+
+def check_npy_options(aparser, args, filename=None, outfile=None):
+    """
+    Exit with a usage error if the NPY output configured by `args` could only
+    fail after all of its data has been written: its header holds the number
+    of points per channel, which must be the same in every channel and can
+    only be corrected afterwards if `outfile` is seekable (`outfile` None
+    means a regular file).
+    """
+    if args.format != "NPY":
+        return
+    if args.simplify is not None:
+        aparser.error("--simplify cannot be used with NPY output (it leaves "
+                      "a different number of points in each channel)")
+    seekable = args.compress is None and (
+        outfile is None or _seekable(outfile))
+    if seekable:
+        return
+    for flag, value in (("--peaks", args.peaks),
+                        ("--peak-index", args.peak_index),
+                        ("--length", filename == STDIN and
+                         args.length is not None)):
+        if value:
+            aparser.error("NPY output with %s needs a seekable output file "
+                          "(and no --compress), because the number of points "
+                          "is only known at the end" % flag)
+
+
+def _seekable(f):
+    try:
+        return f.seekable()
+    except (AttributeError, IOError, OSError, ValueError):
+        return False
 
 
 def main():
     aparser = argparse.ArgumentParser(description=("Convert WAV and AIFF files "
                                                    "to vector (SVG, PostScript,"
                                                    " CVS) graphics."),
-                                      epilog="The output is sent to stdout.")
-    aparser.add_argument("filename", help="The WAV file to read")
+                                      epilog=("The output is sent to stdout, or "
+                                              "to OUTDIR in batch mode."))
+    aparser.add_argument("filename", nargs="+",
+                         help=("The WAV file to read ('-' to read a stream "
+                               "from stdin). In batch mode (see "
+                               "--outdir), any number of files, directories "
+                               "or glob patterns."))
     aparser.add_argument("--format", "-f", default="SVG", type=str,
                          choices=formatters.keys(),
-                         help="The output format, one of: SVG, CSV, PostScript. Default is SVG.")
+                         help="The output format, one of: SVG, SVGPath, CSV, PostScript, PostScriptCompact, NPY, Float32. Default is SVG.")
+    aparser.add_argument("--precision", default=DEFAULT_PRECISION, type=int,
+                         metavar="N",
+                         help=("The number of decimal places of the "
+                               "coordinates in SVGPath and PostScriptCompact "
+                               "output (0 for integers). Default is %d."
+                               % DEFAULT_PRECISION))
     aparser.add_argument("--width", default=1000,
                          type=int, help=("Maximum width of generated SVG "
                                          "(graphic will be scaled down to "
@@ -46,8 +348,119 @@ def main():
                                "BS-sized chunks. By default BS=0, which causes "
                                "the entire file to be read into memory before "
                                "processing."))
+    aparser.add_argument("--spool", nargs="?", type=int, default=None,
+                         const=DEFAULT_SPOOL_SIZE, metavar="CHARS",
+                         help=("With --stream, keep one continuous path per "
+                               "channel (so the output is the same as without "
+                               "--stream) by collecting each channel's points "
+                               "in a spool which holds up to CHARS characters "
+                               "in memory (default %d) and the rest in a "
+                               "temporary file." % DEFAULT_SPOOL_SIZE))
+    aparser.add_argument("--prefetch", type=int, default=0, metavar="N",
+                         help=("With --stream, read up to N blocks ahead in a "
+                               "background thread, so that reading the input "
+                               "overlaps with formatting it. Helps most on "
+                               "slow disks and network filesystems."))
     aparser.add_argument("--downtoss", default=1,
                          type=int, help="Downsample by keeping only 1 out of every N samples.", metavar="N")
+    aparser.add_argument("--start", type=float, default=None, metavar="TIME",
+                         help=("Only convert the audio from TIME seconds "
+                               "after the beginning of the file. The input is"
+                               " seeked rather than decoded up to TIME, and "
+                               "--width applies to the selected range."))
+    aparser.add_argument("--end", type=float, default=None, metavar="TIME",
+                         help=("Only convert the audio up to TIME seconds "
+                               "after the beginning of the file."))
+    aparser.add_argument("--length", type=float, default=None,
+                         metavar="TIME",
+                         help=("The expected length in seconds of an input "
+                               "whose header does not say how long it is "
+                               "(like a stream from ffmpeg). It is scaled to "
+                               "--width as if it had this length and "
+                               "converted as it arrives; without --length the "
+                               "whole stream is read first."))
+    aparser.add_argument("--frames", action="store_true",
+                         help=("Interpret --start, --end and --length as "
+                               "frame numbers instead of seconds."))
+    aparser.add_argument("--peaks", action="store_true",
+                         help=("Instead of outputting every sample, divide "
+                               "the frames into WIDTH columns and output only "
+                               "the minimum and maximum sample of each column. "
+                               "Unlike --downtoss this keeps transients, and "
+                               "the output size depends only on WIDTH."))
+    aparser.add_argument("--peak-index", action="store_true",
+                         help=("Like --peaks, but render from a multi-"
+                               "resolution peak index stored next to the input"
+                               " file (as FILENAME.peaks). The index is built "
+                               "on first use and rebuilt when the input "
+                               "changes; later renders at any width only read "
+                               "the part of the index they need."))
+    aparser.add_argument("--simplify", type=float, default=None, metavar="PX",
+                         help=("Simplify each channel's path, dropping points "
+                               "which are less than PX pixels away from it, "
+                               "and report the point-reduction ratio on "
+                               "stderr. Works block by block with --stream."))
+    aparser.add_argument("--simplify-method", default="rdp",
+                         choices=simplify_methods,
+                         help=("The simplification algorithm: rdp (Ramer-"
+                               "Douglas-Peucker, the default) or vw "
+                               "(Visvalingam-Whyatt, which drops points "
+                               "forming triangles smaller than PX squared)."))
+    aparser.add_argument("--mmap", action="store_true",
+                         help=("Read the input file through a memory map "
+                               "instead of the wave/aifc modules. This avoids "
+                               "copying each block and only pages in the parts"
+                               " of the file which are decoded."))
+    aparser.add_argument("--outdir", "-o", metavar="OUTDIR",
+                         help=("Batch mode: convert every input file into its "
+                               "own file in OUTDIR (named after the input, with"
+                               " the extension of the output format) using a "
+                               "pool of worker processes."))
+    aparser.add_argument("--jobs", "-j", type=int, default=None, metavar="N",
+                         help=("The number of worker processes in batch mode. "
+                               "Defaults to the number of CPUs."))
+    aparser.add_argument("--parallel", type=int, default=None, metavar="N",
+                         help=("Decode and format the input file with N "
+                               "worker processes. The output is the same as "
+                               "without this flag. Not supported with --peaks "
+                               "or --peak-index, and ignored in batch mode."))
+    aparser.add_argument("--bufsize", type=int, default=DEFAULT_BUFSIZE,
+                         metavar="CHARS",
+                         help=("Collect at least CHARS characters of output "
+                               "before writing them. Default is %d."
+                               % DEFAULT_BUFSIZE))
+    aparser.add_argument("--compress", choices=compress_methods,
+                         help=("Compress the output (in a background thread) "
+                               "with gzip (e.g. for .svgz), bz2, xz or zstd "
+                               "(which requires Python 3.14 or the zstandard "
+                               "package)."))
+    aparser.add_argument("--compress-level", type=int, default=None,
+                         metavar="N",
+                         help=("The compression level. The default depends on"
+                               " the method."))
+    aparser.add_argument("--stats", action="store_true",
+                         help=("Print the time spent reading, unpacking, "
+                               "scaling, formatting and writing, and counts "
+                               "of frames, points and bytes to stderr. "
+                               "Ignored in batch mode."))
+    aparser.add_argument("--cache", metavar="DIR", default=None,
+                         help=("Cache the output in DIR, so that converting "
+                               "the same file with the same options again "
+                               "only copies the cached output. DIR can be "
+                               "shared by concurrent processes."))
+    aparser.add_argument("--cache-size", type=int,
+                         default=DEFAULT_CACHE_SIZE // 2**20, metavar="MB",
+                         help=("The maximum size of the cache directory; the "
+                               "least recently used entries are evicted "
+                               "first. Default is %d."
+                               % (DEFAULT_CACHE_SIZE // 2**20)))
+    aparser.add_argument("--cache-ttl", type=float, default=None,
+                         metavar="SECONDS",
+                         help="Evict cache entries older than SECONDS.")
+    aparser.add_argument("--cache-hash", action="store_true",
+                         help=("Identify input files in the cache by a hash "
+                               "of their content instead of their size, "
+                               "modification time and inode."))
     aparser.add_argument("--log", dest="loglevel",
                          choices=['DEBUG', 'INFO', 'WARNING', 'ERROR',
                                   'CRITICAL'], help="Set the logging level.",
@@ -58,29 +471,55 @@ def main():
     # setup logging
     logging.basicConfig(level=logging.getLevelName(args.loglevel))
 
-    # Test whether WAV or AIFF
-    decoder_class = wave
-    sndtype = get_file_type(args.filename)
-    if sndtype is None:
-        logging.error(
-            "Unknown file type (should be either WAV or AIFF): %s" % args.filename)
-        sys.exit(1)
-    logging.debug("sndtype: ",  sndtype)
-    if sndtype == 'aiff' or sndtype == 'aifc':
-        try:
-            import aifc
-            decoder_class = aifc
-        except ImportError:
-            logging.error("The aifc module was removed in Python 3.13 (https://peps.python.org/pep-0594/). To install it as a module run `pip install standard-aifc`")
-            sys.exit(1)
+    if args.outdir is not None:
+        if STDIN in args.filename:
+            aparser.error("stdin cannot be converted in batch mode")
+        check_npy_options(aparser, args)
+        files = expand_inputs(args.filename)
+        if not files:
+            aparser.error("no input files to convert")
+        failures = batch(files, args)
+        sys.exit(1 if failures else 0)
+    if len(args.filename) > 1:
+        aparser.error("converting more than one file requires --outdir")
+    filename = args.filename[0]
+    if filename == STDIN:
+        for flag, value in (("--parallel", args.parallel),
+                            ("--peak-index", args.peak_index),
+                            ("--cache", args.cache)):
+            if value:
+                aparser.error("%s cannot be used with stdin" % flag)
 
     # setup decoder and formatter
-    decoder = WavDecoder(args.filename, decoder_class=decoder_class, bs=args.stream,
-                         max_width=args.width, max_height=args.height,
-                         downtoss=args.downtoss)
-    formatter_class = formatters[args.format]
-    logging.debug("formatter_class: %s" % formatter_class)
-    formatter = formatter_class(decoder)
+    try:
+        formatter = make_formatter(filename, args)
+    except (ValueError, ImportError) as e:
+        logging.error(e)
+        sys.exit(1)
 
     # decode and format
-    formatter.output(sys.stdout)
+    if args.parallel is not None and (args.peaks or args.peak_index):
+        aparser.error("--parallel cannot be used with --peaks or --peak-index")
+    if args.parallel is not None and args.simplify is not None:
+        aparser.error("--parallel cannot be used with --simplify")
+    if args.parallel is not None and formatters[args.format].relative:
+        aparser.error("--parallel cannot be used with %s output" % args.format)
+    # write bytes to stdout (so output is only encoded once per buffer)
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    check_npy_options(aparser, args, filename, stdout)
+    try:
+        cached = write_output(formatter, stdout, args,
+                              make_cache(args), workers=args.parallel)
+    except (ValueError, IOError, OSError, ImportError,
+            mmapreader.Error) as e:
+        logging.error(e)
+        sys.exit(1)
+    if cached:
+        logging.info("Output of %s was cached" % filename)
+    elif args.simplify is not None:
+        decoder = formatter.decoder
+        sys.stderr.write("Simplified %d points to %d (%.1fx reduction)\n"
+                         % (decoder.points_in, decoder.points_out,
+                            decoder.ratio))
+    if args.stats and not cached:
+        sys.stderr.write(formatter.decoder.stats.summary())
@@ -0,0 +1,315 @@
+"""
+This module reads WAV (RIFF) and AIFF/AIFF-C files through a memory map. It
+parses the `fmt `/`data` (RIFF) or `COMM`/`SSND` (AIFF) chunks itself and then
+returns every block of frames as a zero-copy `memoryview` slice of the mapped
+data chunk, so pages of a large file are only read from disk when they are
+decoded and seeking is free.
+
+It mirrors the interface of the standard library's wave and aifc modules, so
+the module itself can be used as the `decoder_class` of a WavDecoder:
+    >>> from wav2vec import mmapreader
+    >>> wd = WavDecoder('filename', decoder_class=mmapreader)
+
+Unlike the standard library modules it also reads IEEE float samples (32- and
+64-bit WAVE_FORMAT_IEEE_FLOAT and AIFF-C 'fl32'/'fl64' files) and
+WAVE_FORMAT_EXTENSIBLE files; `getsampleformat()` tells integer and float
+samples apart.
+"""
+
+import io
+import logging
+import mmap
+import struct
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+_params = namedtuple(
+    "_params", "nchannels sampwidth framerate nframes comptype compname"
+)
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# AIFF-C compression types of uncompressed float samples (by sample width)
+_aifc_float_types = {b"fl32": 4, b"FL32": 4, b"fl64": 8, b"FL64": 8}
+
+
+class Error(Exception):
+    pass
+
+
+def _read_extended(data):
+    """
+    Decode the 80-bit IEEE 754 extended precision float used for the sample
+    rate in AIFF COMM chunks.
+    """
+    expon, himant, lomant = struct.unpack(">hLL", data)
+    sign = 1
+    if expon < 0:
+        sign = -1
+        expon = expon + 0x8000
+    if expon == himant == lomant == 0:
+        return 0.0
+    if expon == 0x7FFF:
+        raise Error("invalid sample rate")
+    expon = expon - 16383
+    f = (himant * 0x100000000 + lomant) * pow(2.0, expon - 63)
+    return sign * f
+
+
+def _chunks(buf, start, end, endchar):
+    """
+    Iterate over the (chunk_id, data_offset, data_size) of the IFF chunks
+    found in buf[start:end].
+    """
+    pos = start
+    while pos + 8 <= end:
+        chunk_id = bytes(buf[pos : pos + 4])
+        (size,) = struct.unpack(endchar + "L", buf[pos + 4 : pos + 8])
+        yield chunk_id, pos + 8, size
+        # chunks are padded to an even number of bytes
+        pos += 8 + size + (size & 1)
+
+
+def _parse_fmt(fmt):
+    """
+    Return (nchannels, framerate, sampwidth, sampleformat) from the body of
+    a RIFF fmt chunk.
+    """
+    (wFormatTag, nchannels, framerate, _, blockalign,
+     bits) = struct.unpack("<HHLLHH", fmt[:16])
+    if wFormatTag == WAVE_FORMAT_EXTENSIBLE:
+        if len(fmt) < 40:
+            raise Error("WAVE_FORMAT_EXTENSIBLE fmt chunk too short")
+        # the first two bytes of the SubFormat GUID are the format tag
+        (wFormatTag,) = struct.unpack("<H", fmt[24:26])
+    if wFormatTag == WAVE_FORMAT_PCM:
+        sampleformat = "int"
+    elif wFormatTag == WAVE_FORMAT_IEEE_FLOAT and bits in (32, 64):
+        sampleformat = "float"
+    else:
+        raise Error("unknown format: %r" % (wFormatTag,))
+    # samples are stored in whole bytes (e.g. 20-bit samples in 3 bytes)
+    sampwidth = (bits + 7) // 8
+    if blockalign and blockalign != nchannels * sampwidth:
+        raise Error("unsupported block alignment: %d" % blockalign)
+    return nchannels, framerate, sampwidth, sampleformat
+
+
+def _parse_comm(comm, aifc):
+    """
+    Return (nchannels, nframes, framerate, sampwidth, sampleformat, endchar,
+    comptype, compname) from the body of an AIFF (or AIFF-C if `aifc` is
+    set) COMM chunk.
+    """
+    (nchannels, nframes, bits) = struct.unpack(">hLh", comm[:8])
+    framerate = int(_read_extended(comm[8:18]))
+    sampwidth = (bits + 7) // 8
+    endchar = ">"
+    comptype = b"NONE"
+    compname = b"not compressed"
+    sampleformat = "int"
+    if aifc:
+        comptype = bytes(comm[18:22])
+        namelen = comm[22] if len(comm) > 22 else 0
+        compname = bytes(comm[23 : 23 + namelen])
+        if comptype in (b"sowt", b"SOWT"):
+            # byte-swapped (little-endian) PCM
+            endchar = "<"
+        elif comptype in _aifc_float_types:
+            sampleformat = "float"
+            sampwidth = _aifc_float_types[comptype]
+        elif comptype not in (b"NONE", b"twos"):
+            raise Error("unsupported compression type: %r" % (comptype,))
+    return (nchannels, nframes, framerate, sampwidth, sampleformat, endchar,
+            comptype, compname)
+
+
+class Mmap_read(object):
+    """
+    A memory-mapped reader with the same interface as `wave.Wave_read`, except
+    that `readframes()` returns a memoryview into the mapped file instead of a
+    new bytes object.
+    """
+
+    def __init__(self, f):
+        self._i_opened_the_file = None
+        if isinstance(f, str):
+            f = io.open(f, "rb")
+            self._i_opened_the_file = f
+        try:
+            self._map(f)
+            self._parse()
+        except Exception:
+            self.close()
+            raise
+
+    def _map(self, f):
+        self._mmap = None
+        try:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._buf = memoryview(self._mmap)
+        except (AttributeError, IOError, OSError, ValueError):
+            # not a real file (e.g. BytesIO) or an empty file: read it instead
+            logger.debug("Could not mmap %s; reading it into memory" % f)
+            self._buf = memoryview(f.read())
+
+    def _parse(self):
+        buf = self._buf
+        magic = bytes(buf[0:4])
+        form = bytes(buf[8:12])
+        if magic == b"RIFF" and form == b"WAVE":
+            self._parse_riff()
+        elif magic == b"FORM" and form in (b"AIFF", b"AIFC"):
+            self._parse_aiff(form == b"AIFC")
+        else:
+            raise Error("file does not start with a RIFF/WAVE or FORM/AIFF id")
+        self._nframes = self._data_size // self._framesize
+        self._data = buf[self._data_start : self._data_start
+                         + self._nframes * self._framesize]
+        self._soundpos = 0
+
+    def _parse_riff(self):
+        self._filetype = "wav"
+        self._endchar = "<"
+        fmt = None
+        for chunk_id, offset, size in _chunks(self._buf, 12, len(self._buf),
+                                              "<"):
+            if chunk_id == b"fmt ":
+                fmt = self._buf[offset : offset + size]
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise Error("data chunk before fmt chunk")
+                self._data_start = offset
+                # tolerate truncated files
+                self._data_size = min(size, len(self._buf) - offset)
+                break
+        else:
+            raise Error("fmt chunk and/or data chunk missing")
+        (self._nchannels, self._framerate, self._sampwidth,
+         self._sampleformat) = _parse_fmt(fmt)
+        self._framesize = self._nchannels * self._sampwidth
+        self._comptype = "NONE"
+        self._compname = "not compressed"
+
+    def _parse_aiff(self, aifc):
+        self._filetype = "aifc" if aifc else "aiff"
+        comm = None
+        ssnd = None
+        for chunk_id, offset, size in _chunks(self._buf, 12, len(self._buf),
+                                              ">"):
+            if chunk_id == b"COMM":
+                comm = self._buf[offset : offset + size]
+            elif chunk_id == b"SSND":
+                ssnd = (offset, min(size, len(self._buf) - offset))
+        if comm is None or ssnd is None:
+            raise Error("COMM chunk and/or SSND chunk missing")
+        (self._nchannels, nframes, self._framerate, self._sampwidth,
+         self._sampleformat, self._endchar, self._comptype,
+         self._compname) = _parse_comm(comm, aifc)
+        self._framesize = self._nchannels * self._sampwidth
+        offset, size = ssnd
+        (data_offset, _) = struct.unpack(">LL", self._buf[offset : offset + 8])
+        self._data_start = offset + 8 + data_offset
+        self._data_size = min(size - 8 - data_offset,
+                              nframes * self._framesize)
+
+    #
+    # wave.Wave_read compatible interface
+    #
+
+    def getnchannels(self):
+        return self._nchannels
+
+    def getsampwidth(self):
+        return self._sampwidth
+
+    def getframerate(self):
+        return self._framerate
+
+    def getnframes(self):
+        return self._nframes
+
+    def getcomptype(self):
+        return self._comptype
+
+    def getcompname(self):
+        return self._compname
+
+    def getparams(self):
+        return _params(self._nchannels, self._sampwidth, self._framerate,
+                       self._nframes, self._comptype, self._compname)
+
+    def getfiletype(self):
+        """
+        Return 'wav', 'aiff' or 'aifc' according to the file's header.
+        """
+        return self._filetype
+
+    def getsampleformat(self):
+        """
+        Return 'int' for PCM (integer) samples or 'float' for IEEE float
+        samples.
+        """
+        return self._sampleformat
+
+    def getendchar(self):
+        """
+        Return the `struct` character for the endianness of the sample data
+        ('<' for little-endian, '>' for big-endian).
+        """
+        return self._endchar
+
+    def rewind(self):
+        self._soundpos = 0
+
+    def tell(self):
+        return self._soundpos
+
+    def setpos(self, pos):
+        if pos < 0 or pos > self._nframes:
+            raise Error("position not in range")
+        self._soundpos = pos
+
+    def readframes(self, nframes):
+        """
+        Return a memoryview of the next `nframes` frames (fewer at the end of
+        the data). No data is copied.
+        """
+        start = self._soundpos * self._framesize
+        end = min(self._soundpos + nframes, self._nframes) * self._framesize
+        self._soundpos = end // self._framesize
+        return self._data[start:end]
+
+    def close(self):
+        self._data = None
+        self._buf = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # a caller still holds a view of the map; it will be unmapped
+                # when the last view is garbage collected
+                logger.debug("mmap still exported; leaving it to the GC")
+            self._mmap = None
+        if self._i_opened_the_file:
+            self._i_opened_the_file.close()
+            self._i_opened_the_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open(f, mode="rb"):
+    """
+    Open `f` (a file name or a binary file object) for memory-mapped reading.
+    Only reading is supported.
+    """
+    if mode not in ("r", "rb"):
+        raise Error("mode must be 'r' or 'rb'")
+    return Mmap_read(f)
@@ -0,0 +1,236 @@
+"""
+This module decodes and formats a single waveform file with several worker
+processes.
+
+The frames [0, nframes) are split into ranges. Each worker opens the file
+itself, seeks to its range and runs the usual decode, scale and
+`points_to_str()` pipeline, returning the formatted points of each block along
+with the first and last sample of each channel. The parent process then
+stitches the fragments together in order, writing the document and path front
+and end matter exactly where `Formatter.output()` would, so the result is the
+same as a serial run.
+
+Use it through `Formatter.output()`:
+    >>> wd = WavDecoder('filename', bs=4096)
+    >>> SVGFormatter(wd).output(outfile, workers=4)
+"""
+
+import importlib
+import logging
+import os
+
+from .formatter.Formatter import (DEFAULT_BUFSIZE, DEFAULT_SPOOL_SIZE,
+                                  ChannelSpools, OutputBuffer, _tell)
+from .stats import clock
+
+logger = logging.getLogger(__name__)
+
+
+def _decoder_spec(decoder):
+    """
+    Return the (picklable) keyword arguments to create a WavDecoder like
+    `decoder` in a worker process.
+    """
+    return dict(
+        filename=decoder._filename,
+        decoder_class=decoder.decoder.__name__,
+        endchar=decoder._endchar,
+        max_width=decoder.max_width,
+        max_height=decoder.max_height,
+        bs=decoder.bs,
+        downtoss=decoder._downtoss,
+        signed=decoder.signed,
+        use_numpy=decoder.use_numpy,
+        columnar=decoder.columnar,
+        start=decoder.start,
+        end=decoder.end,
+        unit=decoder.unit,
+        prefetch=decoder.prefetch,
+    )
+
+
+def _formatter_kwargs(formatter):
+    """
+    Return the keyword arguments (besides the decoder) to create a formatter
+    like `formatter` in a worker process.
+    """
+    if hasattr(formatter.__class__, "precision"):
+        return dict(precision=formatter.precision)
+    return {}
+
+
+def _format_range(formatter_class, formatter_kwargs, spec, start, stop,
+                  x_shift):
+    """
+    Decode and format the frames [start, stop) in a worker process.
+
+    Returns a list with an entry for every block, each of which is a list of
+    (first_sample, last_sample, formatted_points) tuples, one per channel,
+    and the number of points formatted for each channel (the `counts` of
+    formatters which keep them, like NPYFormatter; otherwise None).
+    """
+    from .WavDecoder import WavDecoder
+
+    spec = dict(spec)
+    spec["decoder_class"] = importlib.import_module(spec["decoder_class"])
+    decoder = WavDecoder(**spec)
+    formatter = formatter_class(decoder, **formatter_kwargs)
+    blocks = []
+    with decoder:
+        decoder._seek_range(start, stop, x_shift)
+        # let the formatter initialize any state it keeps
+        formatter.doc_front_matter(decoder.params)
+        for paths in decoder:
+            block = []
+            for chan, chan_data in enumerate(paths):
+                parts = [formatter.points_to_str(sample, chan)
+                         for sample in chan_data]
+                body = parts[0][:0].join(parts)
+                block.append((chan_data[0], chan_data[-1], body))
+            blocks.append(block)
+    return blocks, getattr(formatter, "counts", None)
+
+
+def _ranges(first, end, workers, unit):
+    """
+    Split [first, end) into about four ranges per worker, with every range
+    boundary a multiple of `unit` frames after `first`.
+    """
+    size = -(-(end - first) // (workers * 4))
+    size = max(unit, -(-size // unit) * unit)
+    return [(start, min(start + size, end))
+            for start in range(first, end, size)]
+
+
+def output(formatter, outfile, workers=None, bufsize=None, spool=None):
+    """
+    Write the output of `formatter` to `outfile` like `Formatter.output()`,
+    decoding and formatting with a pool of `workers` processes (defaults to
+    the number of CPUs). Output is buffered and spooled as described for
+    `Formatter.output()`.
+
+    The formatter's decoder must be a WavDecoder reading a named file, and
+    peaks mode and relative formatters are not supported.
+    """
+    from .WavDecoder import WavDecoder
+
+    decoder = formatter.decoder
+    if not isinstance(decoder, WavDecoder) or decoder.peaks:
+        raise ValueError("parallel output requires a WavDecoder without peaks")
+    if formatter.relative:
+        raise ValueError("parallel output does not support %s output"
+                         % formatter.backend)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if bufsize is None:
+        bufsize = DEFAULT_BUFSIZE
+    stats = getattr(decoder, "stats", None)
+    if stats is not None:
+        started = clock()
+    out = OutputBuffer(outfile, bufsize, stats)
+    if formatter.contiguous and spool is None:
+        spool = DEFAULT_SPOOL_SIZE
+    spools = None
+    if spool is not None and decoder.bs:
+        spools = ChannelSpools(spool, formatter.binary)
+    start = _tell(outfile)
+    with decoder:
+        _output(formatter, decoder, out, workers, spools)
+    out.flush()
+    formatter.patch_output(outfile, start)
+    if stats is not None:
+        # the stages before writing run in the workers and are not measured
+        stats.time("total", clock() - started)
+        stats.finish()
+
+
+def _output(formatter, decoder, outfile, workers, spools):
+    from concurrent.futures import ProcessPoolExecutor
+
+    params = decoder.params
+    spec = _decoder_spec(decoder)
+    downtoss = decoder._downtoss
+    bs = decoder.bs
+    first = decoder._first_frame
+    ranges = _ranges(first, decoder._end_frame, workers,
+                     bs if bs > 0 else downtoss)
+    logger.debug("Formatting %d ranges with %d workers"
+                 % (len(ranges), workers))
+
+    # with bs == 0 the whole file is a single block, and x values count the
+    # samples kept by downtoss from the beginning of the selected range
+    shifts = [0 if bs > 0 else (start - first) - (start - first) // downtoss
+              for start, stop in ranges]
+
+    outfile.write(formatter.doc_front_matter(params))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_format_range,
+                               [formatter.__class__] * len(ranges),
+                               [_formatter_kwargs(formatter)] * len(ranges),
+                               [spec] * len(ranges),
+                               [start for start, stop in ranges],
+                               [stop for start, stop in ranges],
+                               shifts)
+        results = _merge_counts(formatter, results)
+        if bs > 0:
+            blocks = (block for result in results for block in result)
+        else:
+            blocks = [_join_blocks([block for result in results
+                                    for block in result])]
+        _write_blocks(formatter, outfile, blocks, spools)
+    if spools is not None:
+        spools.write_to(formatter, outfile)
+    outfile.write(formatter.doc_end_matter(params))
+
+
+def _merge_counts(formatter, results):
+    """
+    Add the point counts of each worker's result to the formatter's `counts`
+    (so that it can check its output, see NPYFormatter.patch_output()) and
+    yield the blocks of each result.
+    """
+    for blocks, counts in results:
+        if counts is not None:
+            for chan, count in counts.items():
+                formatter.counts[chan] = formatter.counts.get(chan, 0) + count
+        yield blocks
+
+
+def _join_blocks(blocks):
+    """
+    Join the blocks of every range into a single block.
+    """
+    joined = []
+    for chan in range(len(blocks[0])):
+        first = blocks[0][chan][0]
+        last = blocks[-1][chan][1]
+        parts = [block[chan][2] for block in blocks]
+        body = parts[0][:0].join(parts)
+        joined.append((first, last, body))
+    return joined
+
+
+def _write_blocks(formatter, outfile, blocks, spools=None):
+    """
+    Write formatted blocks with the same path boundaries as
+    `Formatter.output()` (or add them to `spools`).
+    """
+    blocks = iter(blocks)
+    block = next(blocks, None)
+    is_opening = True
+    while block is not None:
+        next_block = next(blocks, None)
+        is_closing = next_block is None
+        nchannels = len(block)
+        if spools is not None and nchannels > 1:
+            spools.add(block)
+            block = next_block
+            continue
+        for chan, (first, last, body) in enumerate(block):
+            if is_opening or nchannels > 1:
+                outfile.write(formatter.path_front_matter(first, chan))
+            outfile.write(body)
+            if is_closing or nchannels > 1:
+                outfile.write(formatter.path_end_matter(last, chan))
+        block = next_block
+        is_opening = False
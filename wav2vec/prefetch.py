@@ -0,0 +1,147 @@
+"""
+This module defines the Prefetcher class, which reads blocks of frames ahead
+in a background thread so that reading from disk overlaps with decoding and
+formatting the previous blocks. WavDecoder uses it when `prefetch` is set:
+    >>> wd = WavDecoder('filename', bs=4096, prefetch=4)
+"""
+
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    # Python 2
+    import Queue as queue
+
+logger = logging.getLogger(__name__)
+
+# how often (in seconds) a blocked thread checks whether it should stop
+_POLL = 0.1
+
+# queued after the last block of a stream of unknown length
+_END = object()
+
+
+class Prefetcher(object):
+    """
+    Reads blocks of up to `bs` frames of [start, stop) (or from `start` to
+    the end of a stream of unknown length, if `stop` is None) from `reader` (a
+    Wave_read or compatible object, which must not be used by anything else
+    until `close()`) in a background thread, keeping up to `depth` blocks
+    ready in a bounded queue.
+
+    Blocks which a reader returns as memoryviews (like `wav2vec.mmapreader`,
+    whose pages are only read from disk when they are touched) are copied
+    into a pool of `depth + 2` recycled bytearrays, so the disk is read in
+    the background without allocating a buffer per block. A block returned by
+    `get()` is only valid until the next call to `get()`.
+    """
+
+    def __init__(self, reader, start, stop, bs, depth, framesize=None):
+        """
+        Args:
+            reader (Wave_read): the reader to read from (it is positioned at
+                `start` first)
+            start (int): the first frame to read
+            stop (int): the frame to stop reading at (None to read until
+                `readframes()` returns nothing)
+            bs (int): the number of frames per block
+            depth (int): the maximum number of blocks read ahead
+            framesize (int): the size of a frame in bytes (needed to count
+                the frames of the last block if `stop` is None)
+        """
+        self.bs = bs
+        self.stop = stop
+        self.framesize = framesize
+        # the first frame of the block which get() returns next
+        self.position = start
+        self._reader = reader
+        self._ready = queue.Queue(depth)
+        self._free = [bytearray() for i in range(depth + 2)]
+        self._free_lock = threading.Lock()
+        self._in_use = None
+        self._stopping = threading.Event()
+        self._ended = False
+        reader.setpos(start)
+        self._thread = threading.Thread(target=self._run, args=(start,),
+                                        name="wav2vec-prefetch")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, index):
+        try:
+            while not self._stopping.is_set():
+                if self.stop is None:
+                    frames = self.bs
+                elif index < self.stop:
+                    frames = min(self.bs, self.stop - index)
+                else:
+                    break
+                data = self._reader.readframes(frames)
+                if self.stop is None:
+                    frames = len(data) // self.framesize
+                    if frames == 0:
+                        self._put(_END)
+                        break
+                if isinstance(data, memoryview):
+                    data = self._copy(data)
+                index += frames
+                self._put((data, frames))
+        except Exception as e:
+            logger.debug("Prefetching failed: %r" % e)
+            self._put(e)
+
+    def _copy(self, data):
+        with self._free_lock:
+            buf = self._free.pop()
+        if len(buf) != len(data):
+            # only the first and last blocks differ in size (and a buffer may
+            # not be resized while arrays created from it still exist)
+            return bytearray(data)
+        buf[:] = data
+        return buf
+
+    def _put(self, item):
+        while not self._stopping.is_set():
+            try:
+                self._ready.put(item, timeout=_POLL)
+                return
+            except queue.Full:
+                continue
+
+    def get(self):
+        """
+        Return the next (wav_bytes, frames) block. Raises StopIteration after
+        the last block, and any error the reader raised.
+        """
+        self._recycle()
+        if self._ended or (self.stop is not None
+                           and self.position >= self.stop):
+            raise StopIteration
+        item = self._ready.get()
+        if item is _END:
+            self._ended = True
+            raise StopIteration
+        if isinstance(item, Exception):
+            raise item
+        data, frames = item
+        if isinstance(data, bytearray):
+            self._in_use = data
+        self.position += frames
+        return data, frames
+
+    def _recycle(self):
+        if self._in_use is not None:
+            with self._free_lock:
+                self._free.append(self._in_use)
+            self._in_use = None
+
+    def close(self):
+        """
+        Stop the thread and wait for it to finish its current read. The
+        reader's position is then undefined.
+        """
+        self._stopping.set()
+        self._thread.join()
+        self._recycle()
@@ -0,0 +1,500 @@
+"""
+This module is an HTTP rendering service built on asyncio (Python 3.7+, no
+third-party packages). Each request is decoded and formatted in a bounded
+pool of worker threads, and the output is streamed back (with chunked
+transfer encoding) as the formatter produces it:
+    $ python -m wav2vec.server --root /srv/audio --port 8000
+    $ curl 'http://localhost:8000/render?path=take1.wav&width=800' > take1.svg
+    $ curl --data-binary @take1.wav 'http://localhost:8000/render?format=CSV'
+
+Endpoints:
+    GET /render?path=FILE&OPTIONS: render FILE (relative to the root
+        directory; only available if the server has one)
+    POST /render?OPTIONS: render the WAV or AIFF file in the request body
+    GET /health: returns 200 with a small JSON document
+    GET /metrics: counters and gauges in the Prometheus text format
+
+The options are `format` (SVG by default), `width`, `height`, `downtoss`,
+`bs`, `peaks`, `start`, `end`, `frames` and `precision`, with the same
+meaning as the command line options of the same names.
+
+At most `workers` renders run at once, and at most `max_queue` more wait for
+a worker; further requests are rejected with 503 (Service Unavailable) right
+after their headers are read. A client which reads the output slowly blocks
+its worker (through a bounded chunk queue) rather than letting the output
+pile up in memory.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from . import WavDecoder, mmapreader
+from .formatter import DEFAULT_BUFSIZE, formatters
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_QUEUE = 16
+DEFAULT_MAX_UPLOAD = 256 * 2**20
+# seconds to wait for the request line, headers and body
+DEFAULT_TIMEOUT = 30.0
+# chunks of output waiting to be sent, per request
+_CHUNK_QUEUE_SIZE = 4
+_MAX_HEADER_SIZE = 2**16
+
+_content_types = {
+    "svg": "image/svg+xml",
+    "ps": "application/postscript",
+    "csv": "text/csv; charset=utf-8",
+}
+
+_reasons = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+_true = ("1", "true", "yes", "on")
+
+
+class HTTPError(Exception):
+    """
+    An error which is sent to the client as a response with `status`.
+    """
+
+    def __init__(self, status, message=None):
+        super(HTTPError, self).__init__(message or _reasons[status])
+        self.status = status
+
+
+def parse_options(query):
+    """
+    Parse the options in a query string into (format name, WavDecoder
+    keyword arguments, formatter keyword arguments).
+
+    Raises ValueError for unknown or invalid options.
+    """
+    values = dict((key, value[-1]) for key, value in
+                  parse_qs(query, keep_blank_values=True).items())
+    unknown = set(values) - set(("path", "format", "width", "height",
+                                 "downtoss", "bs", "peaks", "start", "end",
+                                 "frames", "precision"))
+    if unknown:
+        raise ValueError("Unknown option: %s" % ", ".join(sorted(unknown)))
+    name = values.get("format", "SVG")
+    if name not in formatters:
+        raise ValueError("Unknown format: %s" % name)
+    decoder_kwargs = dict(
+        max_width=int(values.get("width", 1000)),
+        max_height=int(values.get("height", 500)),
+        downtoss=int(values.get("downtoss", 1)),
+        bs=int(values.get("bs", 0)),
+        peaks=values.get("peaks", "").lower() in _true,
+        unit="frames" if values.get("frames", "").lower() in _true
+        else "seconds",
+        columnar=True,
+    )
+    if decoder_kwargs["downtoss"] < 1 or decoder_kwargs["bs"] < 0:
+        raise ValueError("downtoss must be at least 1 and bs at least 0")
+    for key in ("start", "end"):
+        if key in values:
+            decoder_kwargs[key] = float(values[key])
+    formatter_kwargs = {}
+    if "precision" in values and hasattr(formatters[name], "precision"):
+        formatter_kwargs["precision"] = int(values["precision"])
+    return name, decoder_kwargs, formatter_kwargs
+
+
+class _ChunkWriter(io.RawIOBase):
+    """
+    A binary file-like object (written to by a worker thread) which passes
+    every chunk written to it to an asyncio queue, blocking while the queue
+    is full.
+    """
+
+    def __init__(self, queue, loop):
+        self._queue = queue
+        self._loop = loop
+        self.cancelled = False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.cancelled:
+            raise IOError("the client disconnected")
+        self.put(bytes(data))
+        return len(data)
+
+    def put(self, item):
+        asyncio.run_coroutine_threadsafe(self._queue.put(item),
+                                         self._loop).result()
+
+
+class RenderServer(object):
+    """
+    The rendering service. Call `run()` to serve until `shutdown()` is called
+    (from any thread).
+        >>> server = RenderServer(port=8000, root='/srv/audio')
+        >>> server.run()
+    """
+
+    def __init__(self, host="127.0.0.1", port=8000, root=None,
+                 workers=DEFAULT_WORKERS, max_queue=DEFAULT_MAX_QUEUE,
+                 max_upload=DEFAULT_MAX_UPLOAD, bufsize=DEFAULT_BUFSIZE,
+                 timeout=DEFAULT_TIMEOUT, cache=None):
+        """
+        Args:
+            host (str): the address to listen on
+            port (int): the port to listen on (0 for any free port; the port
+                is set once the server is listening)
+            root (str): the directory which files given by `path` are looked
+                up in (None to only accept uploaded files)
+            workers (int): the number of renders which run at once
+            max_queue (int): the number of requests which may wait for a
+                worker
+            max_upload (int): the maximum size of an uploaded file in bytes
+            bufsize (int): the size of the chunks of output (see
+                `Formatter.output()`)
+            timeout (Number): seconds to wait for a request to arrive
+            cache (RenderCache): if given, render files given by `path`
+                through this `wav2vec.cache.RenderCache`
+        """
+        self.host = host
+        self.port = port
+        self.root = os.path.realpath(root) if root is not None else None
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_upload = max_upload
+        self.bufsize = bufsize
+        self.timeout = timeout
+        self.cache = cache
+        self.metrics = dict(requests=0, rejected=0, errors=0, bytes_sent=0,
+                            render_seconds=0.0)
+        self.pending = 0
+        self.active = 0
+        self._loop = None
+        self._stop = None
+
+    def run(self, ready=None):
+        """
+        Serve until `shutdown()` is called. `ready` (a threading.Event) is
+        set once the server is listening.
+        """
+        asyncio.run(self._serve(ready))
+
+    def shutdown(self):
+        """
+        Stop the server (thread-safe).
+        """
+        self._loop.call_soon_threadsafe(self._stop.set)
+
+    async def _serve(self, ready):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._handlers = set()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        server = await asyncio.start_server(self._handle, self.host,
+                                            self.port,
+                                            limit=_MAX_HEADER_SIZE)
+        self.port = server.sockets[0].getsockname()[1]
+        logger.info("Listening on %s:%d" % (self.host, self.port))
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await self._stop.wait()
+            # let the requests in progress finish
+            if self._handlers:
+                await asyncio.wait(self._handlers, timeout=self.timeout)
+        finally:
+            self._executor.shutdown(wait=False)
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            try:
+                method, target, headers = await asyncio.wait_for(
+                    _read_head(reader), self.timeout)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError, ValueError) as e:
+                logger.debug("Bad request: %r" % e)
+                return
+            self.metrics["requests"] += 1
+            try:
+                await self._route(method, target, headers, reader, writer)
+            except HTTPError as e:
+                if e.status >= 500:
+                    self.metrics["errors"] += 1
+                await self._respond(writer, e.status, str(e) + "\n")
+        except (ConnectionError, IOError) as e:
+            logger.debug("Connection lost: %s" % e)
+        finally:
+            writer.close()
+            self._handlers.discard(task)
+
+    async def _route(self, method, target, headers, reader, writer):
+        url = urlsplit(target)
+        if url.path == "/health":
+            await self._respond(writer, 200, json.dumps(dict(status="ok")),
+                                "application/json")
+        elif url.path == "/metrics":
+            await self._respond(writer, 200, self.metrics_text(),
+                                "text/plain; version=0.0.4")
+        elif url.path == "/render":
+            if method not in ("GET", "POST"):
+                raise HTTPError(405)
+            await self._render_request(method, url.query, headers, reader,
+                                       writer)
+        else:
+            raise HTTPError(404)
+
+    async def _render_request(self, method, query, headers, reader, writer):
+        if self.pending >= self.workers + self.max_queue:
+            self.metrics["rejected"] += 1
+            raise HTTPError(503, "Too many requests; try again later")
+        self.pending += 1
+        try:
+            try:
+                name, decoder_kwargs, formatter_kwargs = parse_options(query)
+            except ValueError as e:
+                raise HTTPError(400, str(e))
+            if method == "POST":
+                source = io.BytesIO(await self._read_body(headers, reader))
+                decoder_class = mmapreader
+            else:
+                source = self._resolve(query)
+                decoder_class = None
+            async with self._slots:
+                self.active += 1
+                try:
+                    await self._stream(writer, name, source, decoder_class,
+                                       decoder_kwargs, formatter_kwargs)
+                finally:
+                    self.active -= 1
+        finally:
+            self.pending -= 1
+
+    def _resolve(self, query):
+        """
+        Return the absolute name of the file in the `path` option.
+        """
+        if self.root is None:
+            raise HTTPError(403, "This server only renders uploaded files")
+        values = parse_qs(query)
+        if "path" not in values:
+            raise HTTPError(400, "The path option is required")
+        path = os.path.realpath(os.path.join(self.root, values["path"][-1]))
+        if not path.startswith(self.root + os.sep):
+            raise HTTPError(403, "The path is outside the root directory")
+        if not os.path.isfile(path):
+            raise HTTPError(404)
+        return path
+
+    async def _read_body(self, headers, reader):
+        if "content-length" not in headers:
+            raise HTTPError(411)
+        try:
+            length = int(headers["content-length"])
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length > self.max_upload:
+            raise HTTPError(413)
+        try:
+            return await asyncio.wait_for(reader.readexactly(length),
+                                          self.timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            raise HTTPError(400, "Incomplete request body")
+
+    async def _stream(self, writer, name, source, decoder_class,
+                      decoder_kwargs, formatter_kwargs):
+        """
+        Render in a worker thread and send each chunk of output as it is
+        produced. Errors before the first chunk become error responses;
+        later errors abort the response.
+        """
+        queue = asyncio.Queue(_CHUNK_QUEUE_SIZE)
+        out = _ChunkWriter(queue, self._loop)
+        started = time.time()
+        future = self._loop.run_in_executor(
+            self._executor, self._render, out, name, source, decoder_class,
+            decoder_kwargs, formatter_kwargs)
+        headers_sent = False
+        finished = False
+        try:
+            while True:
+                item = await queue.get()
+                # None or an exception is the last item the worker sends
+                finished = item is None or isinstance(item, Exception)
+                if isinstance(item, Exception):
+                    if headers_sent:
+                        logger.error("Render failed: %s" % item)
+                        self.metrics["errors"] += 1
+                        return
+                    status = 400 if isinstance(
+                        item, (ValueError, mmapreader.Error)) else 500
+                    raise HTTPError(status, str(item))
+                if not headers_sent:
+                    extension = formatters[name].extension
+                    writer.write(_head(200, _content_types.get(
+                        extension, "application/octet-stream"),
+                        [("Transfer-Encoding", "chunked")]))
+                    headers_sent = True
+                if item is None:
+                    writer.write(b"0\r\n\r\n")
+                    await writer.drain()
+                    return
+                writer.write(b"%x\r\n" % len(item) + item + b"\r\n")
+                self.metrics["bytes_sent"] += len(item)
+                await writer.drain()
+        finally:
+            if not finished:
+                # the client went away: stop the worker and unblock it
+                out.cancelled = True
+                while not future.done():
+                    try:
+                        await asyncio.wait_for(queue.get(), 0.1)
+                    except asyncio.TimeoutError:
+                        pass
+            await future
+            self.metrics["render_seconds"] += time.time() - started
+
+    def _render(self, out, name, source, decoder_class, decoder_kwargs,
+                formatter_kwargs):
+        """
+        Render `source` to `out` (runs in a worker thread), then pass None
+        (or the exception which stopped the render) to the chunk queue.
+        """
+        try:
+            if decoder_class is None:
+                from .main import get_decoder_class
+                decoder_class = get_decoder_class(source)
+            decoder = WavDecoder(source, decoder_class=decoder_class,
+                                 **decoder_kwargs)
+            formatter = formatters[name](decoder, **formatter_kwargs)
+            if self.cache is not None and isinstance(source, str):
+                self.cache.output(formatter, out, bufsize=self.bufsize)
+            else:
+                formatter.output(out, bufsize=self.bufsize)
+        except Exception as e:
+            if out.cancelled:
+                return
+            logger.debug("Render failed: %r" % e)
+            out.put(e)
+            return
+        out.put(None)
+
+    async def _respond(self, writer, status, body, content_type="text/plain"):
+        body = body.encode("utf-8")
+        writer.write(_head(status, content_type,
+                           [("Content-Length", str(len(body)))]) + body)
+        await writer.drain()
+
+    def metrics_text(self):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        m = self.metrics
+        lines = []
+        for name, kind, value in (
+                ("requests_total", "counter", m["requests"]),
+                ("requests_rejected_total", "counter", m["rejected"]),
+                ("render_errors_total", "counter", m["errors"]),
+                ("bytes_sent_total", "counter", m["bytes_sent"]),
+                ("render_seconds_total", "counter", m["render_seconds"]),
+                ("renders_active", "gauge", self.active),
+                ("renders_queued", "gauge", self.pending - self.active),
+                ("workers", "gauge", self.workers)):
+            lines.append("# TYPE wav2vec_%s %s" % (name, kind))
+            lines.append("wav2vec_%s %s" % (name, value))
+        return "\n".join(lines) + "\n"
+
+
+async def _read_head(reader):
+    """
+    Read the request line and headers and return (method, target, headers),
+    with the header names in lower case.
+    """
+    line = await reader.readline()
+    parts = line.decode("latin-1").split()
+    if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+        raise ValueError("invalid request line %r" % line)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n"):
+            break
+        if not line:
+            raise asyncio.IncompleteReadError(line, None)
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return parts[0], parts[1], headers
+
+
+def _head(status, content_type, headers=()):
+    lines = ["HTTP/1.1 %d %s" % (status, _reasons[status]),
+             "Content-Type: %s" % content_type, "Connection: close"]
+    if status == 503:
+        lines.append("Retry-After: 1")
+    lines.extend("%s: %s" % header for header in headers)
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def main():
+    aparser = argparse.ArgumentParser(description=("Serve wav2vec renders "
+                                                   "over HTTP."))
+    aparser.add_argument("--host", default="127.0.0.1",
+                         help="The address to listen on.")
+    aparser.add_argument("--port", type=int, default=8000)
+    aparser.add_argument("--root", metavar="DIR", default=None,
+                         help=("Render files in DIR requested with the path "
+                               "option. Without it only uploaded files are "
+                               "rendered."))
+    aparser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                         help="The number of renders which run at once.")
+    aparser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE,
+                         help=("The number of requests which may wait for a "
+                               "worker before requests are rejected."))
+    aparser.add_argument("--max-upload", type=int,
+                         default=DEFAULT_MAX_UPLOAD // 2**20, metavar="MB",
+                         help="The maximum size of uploaded files.")
+    aparser.add_argument("--cache", metavar="DIR", default=None,
+                         help="Cache renders of files under --root in DIR.")
+    aparser.add_argument("--log", dest="loglevel",
+                         choices=['DEBUG', 'INFO', 'WARNING', 'ERROR',
+                                  'CRITICAL'], help="Set the logging level.",
+                         default='INFO', type=str)
+    args = aparser.parse_args()
+    logging.basicConfig(level=logging.getLevelName(args.loglevel))
+
+    cache = None
+    if args.cache is not None:
+        from .cache import RenderCache
+        cache = RenderCache(args.cache)
+    server = RenderServer(args.host, args.port, args.root, args.workers,
+                          args.max_queue, args.max_upload * 2**20,
+                          cache=cache)
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        sys.stderr.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+This module defines the Stats class, which collects timers and counters for
+the stages of decoding and formatting a file.
+
+Pass a Stats object to a WavDecoder to instrument it and the formatter which
+outputs it; without one, the only cost is a check per block:
+    >>> stats = Stats(observers=[export])
+    >>> wd = WavDecoder('filename', stats=stats)
+    >>> SVGFormatter(wd).output(outfile)
+    >>> sys.stderr.write(stats.summary())
+
+The stages are:
+    read: reading frames from the file
+    unpack: converting the bytes read into integers
+    scale: separating the channels and scaling the samples (or computing the
+        peak envelope)
+    format: converting the points into the output format
+    write: writing the output to the output file
+"""
+
+import time
+
+# a monotonic clock (time.time on Python 2)
+clock = getattr(time, "perf_counter", time.time)
+
+# the order in which summary() lists the stages
+stages = ("read", "unpack", "scale", "format", "write")
+
+
+class Stats(object):
+    """
+    Accumulates the time spent in each stage (in seconds, in `timers`) and
+    counts of bytes read, frames decoded, points formatted and bytes written
+    (in `counters`).
+
+    Observers are callables which are called with the Stats object whenever
+    `finish()` is called (at the end of `Formatter.output()`), e.g. to export
+    the metrics.
+    """
+
+    def __init__(self, observers=None):
+        """
+        Args:
+            observers (list): callables to call with this object on
+                `finish()`
+        """
+        self.observers = list(observers or [])
+        self.reset()
+
+    def reset(self):
+        """
+        Clear all timers and counters.
+        """
+        self.timers = {}
+        self.counters = {}
+
+    def add_observer(self, observer):
+        self.observers.append(observer)
+
+    def time(self, stage, seconds):
+        """
+        Add `seconds` to the timer of `stage`.
+        """
+        self.timers[stage] = self.timers.get(stage, 0.0) + seconds
+
+    def count(self, name, n=1):
+        """
+        Add `n` to the counter `name`.
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def finish(self):
+        """
+        Call every observer with this object.
+        """
+        for observer in self.observers:
+            observer(self)
+
+    def as_dict(self):
+        """
+        Return the timers and counters as a dict (e.g. for JSON).
+        """
+        return dict(timers=dict(self.timers), counters=dict(self.counters))
+
+    def summary(self):
+        """
+        Return a human readable summary of the timers and counters.
+        """
+        total = self.timers.get("total")
+        lines = []
+        names = [s for s in stages if s in self.timers] + sorted(
+            s for s in self.timers if s not in stages and s != "total")
+        for stage in names:
+            seconds = self.timers[stage]
+            if total:
+                lines.append("%-8s %9.3fs %5.1f%%"
+                             % (stage, seconds, 100.0 * seconds / total))
+            else:
+                lines.append("%-8s %9.3fs" % (stage, seconds))
+        if total is not None:
+            lines.append("%-8s %9.3fs" % ("total", total))
+        for name in sorted(self.counters):
+            lines.append("%-16s %d" % (name, self.counters[name]))
+        frames = self.counters.get("frames_decoded")
+        if total and frames:
+            lines.append("%-16s %.0f" % ("frames/s", frames / total))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,306 @@
+"""
+This module reads WAV (RIFF) and AIFF/AIFF-C data from a stream which cannot
+seek, such as a pipe from ffmpeg, stdin or a network connection. The header
+is parsed chunk by chunk as it arrives, chunks before the sample data are
+skipped by reading them, and the frames are then read in order.
+
+It mirrors the interface of the standard library's wave and aifc modules (and
+reads the same sample formats as `wav2vec.mmapreader`), so the module itself
+can be used as the `decoder_class` of a WavDecoder:
+    >>> from wav2vec import streamreader
+    >>> wd = WavDecoder(sys.stdin.buffer, decoder_class=streamreader, bs=4096)
+
+Streaming encoders write the header before they know how long the data is
+and leave its size as 0 or 0xFFFFFFFF; `getnframes()` then returns None and
+the frames are read until the end of the stream. WavDecoder scales such
+streams either by an expected `length` or, without one, by calling `spool()`
+to read the rest of the stream first (see `Stream_read.spool()`).
+"""
+
+import io
+import logging
+import struct
+import tempfile
+from collections import namedtuple
+
+from .mmapreader import Error, _parse_comm, _parse_fmt
+
+logger = logging.getLogger(__name__)
+
+_params = namedtuple(
+    "_params", "nchannels sampwidth framerate nframes comptype compname"
+)
+
+# data sizes which mean "unknown" in the headers of streamed files
+_UNKNOWN_SIZES = (0, 0xFFFFFFFF)
+
+# the most bytes read from the stream at a time
+_READ_SIZE = 2**20
+
+# spooled data is kept in memory up to this size (and in a temporary file
+# beyond it)
+DEFAULT_SPOOL_SIZE = 64 * 2**20
+
+
+class Stream_read(object):
+    """
+    A reader with the same interface as `wave.Wave_read` for a binary stream
+    which is only read forwards: `setpos()` can only skip ahead (by reading)
+    and `rewind()` is not supported, until `spool()` is called.
+    """
+
+    def __init__(self, f):
+        self._i_opened_the_file = None
+        if isinstance(f, str):
+            f = io.open(f, "rb")
+            self._i_opened_the_file = f
+        self._file = f
+        # the rest of the stream, read by spool() from frame _spool_start on
+        self._spool = None
+        self._spool_start = 0
+        try:
+            self._parse()
+        except Exception:
+            self.close()
+            raise
+        self._soundpos = 0
+
+    def _read(self, size):
+        """
+        Read `size` bytes, fewer only at the end of the stream (pipes and
+        sockets may return less than asked for).
+        """
+        parts = []
+        while size > 0:
+            data = self._file.read(min(size, _READ_SIZE))
+            if not data:
+                break
+            parts.append(data)
+            size -= len(data)
+        return b"".join(parts)
+
+    def _read_exact(self, size, what):
+        data = self._read(size)
+        if len(data) < size:
+            raise Error("stream ended in the %s" % what)
+        return data
+
+    def _skip(self, size, what):
+        while size > 0:
+            size -= len(self._read_exact(min(size, _READ_SIZE), what))
+
+    def _chunk_header(self, endchar):
+        """
+        Return the (id, size) of the next chunk.
+        """
+        header = self._read_exact(8, "header")
+        (size,) = struct.unpack(endchar + "L", header[4:8])
+        return header[:4], size
+
+    def _parse(self):
+        header = self._read_exact(12, "header")
+        magic = header[0:4]
+        form = header[8:12]
+        if magic == b"RIFF" and form == b"WAVE":
+            self._parse_riff()
+        elif magic == b"FORM" and form in (b"AIFF", b"AIFC"):
+            self._parse_aiff(form == b"AIFC")
+        else:
+            raise Error("stream does not start with a RIFF/WAVE or FORM/AIFF "
+                        "id")
+        self._framesize = self._nchannels * self._sampwidth
+        if self._data_size is None:
+            self._nframes = None
+        else:
+            self._nframes = self._data_size // self._framesize
+        logger.debug("Streaming %s data (%s frames)"
+                     % (self._filetype, self._nframes))
+
+    def _parse_riff(self):
+        self._filetype = "wav"
+        self._endchar = "<"
+        fmt = None
+        while True:
+            chunk_id, size = self._chunk_header("<")
+            if chunk_id == b"data":
+                break
+            if chunk_id == b"fmt ":
+                fmt = self._read_exact(size, "fmt chunk")
+                self._skip(size & 1, "fmt chunk")
+            else:
+                # chunks are padded to an even number of bytes
+                self._skip(size + (size & 1), "%r chunk" % (chunk_id,))
+        if fmt is None:
+            raise Error("data chunk before fmt chunk")
+        (self._nchannels, self._framerate, self._sampwidth,
+         self._sampleformat) = _parse_fmt(fmt)
+        self._comptype = "NONE"
+        self._compname = "not compressed"
+        self._data_size = None if size in _UNKNOWN_SIZES else size
+
+    def _parse_aiff(self, aifc):
+        self._filetype = "aifc" if aifc else "aiff"
+        comm = None
+        while True:
+            chunk_id, size = self._chunk_header(">")
+            if chunk_id == b"SSND":
+                break
+            if chunk_id == b"COMM":
+                comm = self._read_exact(size, "COMM chunk")
+                self._skip(size & 1, "COMM chunk")
+            else:
+                self._skip(size + (size & 1), "%r chunk" % (chunk_id,))
+        if comm is None:
+            # the COMM chunk may follow the SSND chunk in a file, but a
+            # stream cannot go back to the samples
+            raise Error("SSND chunk before COMM chunk")
+        (self._nchannels, nframes, self._framerate, self._sampwidth,
+         self._sampleformat, self._endchar, self._comptype,
+         self._compname) = _parse_comm(comm, aifc)
+        ssnd = self._read_exact(8, "SSND chunk")
+        (data_offset, _) = struct.unpack(">LL", ssnd)
+        self._skip(data_offset, "SSND chunk")
+        framesize = self._nchannels * self._sampwidth
+        if nframes in _UNKNOWN_SIZES or size in _UNKNOWN_SIZES:
+            self._data_size = None
+        else:
+            self._data_size = min(size - 8 - data_offset, nframes * framesize)
+
+    #
+    # wave.Wave_read compatible interface
+    #
+
+    def getnchannels(self):
+        return self._nchannels
+
+    def getsampwidth(self):
+        return self._sampwidth
+
+    def getframerate(self):
+        return self._framerate
+
+    def getnframes(self):
+        """
+        Return the number of frames, or None if the header does not say.
+        """
+        return self._nframes
+
+    def getcomptype(self):
+        return self._comptype
+
+    def getcompname(self):
+        return self._compname
+
+    def getparams(self):
+        return _params(self._nchannels, self._sampwidth, self._framerate,
+                       self._nframes, self._comptype, self._compname)
+
+    def getfiletype(self):
+        """
+        Return 'wav', 'aiff' or 'aifc' according to the stream's header.
+        """
+        return self._filetype
+
+    def getsampleformat(self):
+        """
+        Return 'int' for PCM (integer) samples or 'float' for IEEE float
+        samples.
+        """
+        return self._sampleformat
+
+    def getendchar(self):
+        """
+        Return the `struct` character for the endianness of the sample data
+        ('<' for little-endian, '>' for big-endian).
+        """
+        return self._endchar
+
+    def tell(self):
+        return self._soundpos
+
+    def rewind(self):
+        self.setpos(0)
+
+    def setpos(self, pos):
+        """
+        Move to frame `pos`. Before `spool()`, only moving forwards (which
+        reads and discards the frames in between) is possible.
+        """
+        if pos < 0 or (self._nframes is not None and pos > self._nframes):
+            raise Error("position not in range")
+        if self._spool is not None and pos >= self._spool_start:
+            self._spool.seek((pos - self._spool_start) * self._framesize)
+            self._soundpos = pos
+            return
+        if pos < self._soundpos:
+            raise Error("cannot seek backwards in a stream")
+        while self._soundpos < pos:
+            if not self.readframes(min(pos - self._soundpos,
+                                       _READ_SIZE // self._framesize)):
+                raise Error("position not in range")
+
+    def readframes(self, nframes):
+        """
+        Return the next `nframes` frames as bytes (fewer at the end of the
+        stream; a partial frame at the end is dropped).
+        """
+        if self._nframes is not None:
+            nframes = min(nframes, self._nframes - self._soundpos)
+        if nframes <= 0:
+            return b""
+        size = nframes * self._framesize
+        if self._spool is not None:
+            data = self._spool.read(size)
+        else:
+            data = self._read(size)
+        if len(data) < size:
+            data = data[: len(data) - len(data) % self._framesize]
+        self._soundpos += len(data) // self._framesize
+        return data
+
+    def spool(self, max_size=DEFAULT_SPOOL_SIZE):
+        """
+        Read the rest of the stream (from the current position) into memory,
+        or a temporary file once it exceeds `max_size` bytes. Afterwards the
+        number of frames is known and the reader can seek anywhere from the
+        current position on.
+        """
+        if self._spool is not None:
+            return
+        start = self._soundpos
+        spool = tempfile.SpooledTemporaryFile(max_size)
+        while True:
+            data = self.readframes(_READ_SIZE // self._framesize)
+            if not data:
+                break
+            spool.write(data)
+        self._nframes = self._soundpos
+        spool.seek(0)
+        self._spool = spool
+        self._spool_start = start
+        self._soundpos = start
+        logger.debug("Spooled %d frames" % (self._nframes - start))
+
+    def close(self):
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        if self._i_opened_the_file:
+            self._i_opened_the_file.close()
+            self._i_opened_the_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open(f, mode="rb"):
+    """
+    Open `f` (a binary file object, or a file name) for reading as a stream.
+    Only reading is supported.
+    """
+    if mode not in ("r", "rb"):
+        raise Error("mode must be 'r' or 'rb'")
+    return Stream_read(f)